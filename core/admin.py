@@ -1,25 +1,63 @@
 from django.contrib import admin
-from .models import Inmate, Charge, ChildAbuseIndex, NonChildAbuseIndex, LeaderboardEntry, MurderIndex, NonMurderIndex
+from .models import Inmate, Charge, CategoryMembership, CategoryGeneration, LeaderboardEntry, Job, ScrapeItem
+from .services import classify, search
+
+
+class _RuleFilter(admin.SimpleListFilter):
+    """Filtro con le voci prese da classify.RULES: niente SELECT DISTINCT sull'intera tabella."""
+    index = 0
+
+    def lookups(self, request, model_admin):
+        values = sorted({rule[self.index] for rule in classify.RULES})
+        return [(v, v) for v in values]
+
+    def queryset(self, request, queryset):
+        if self.value():
+            return queryset.filter(**{self.parameter_name: self.value()})
+        return queryset
+
+class CategoryFilter(_RuleFilter):
+    title = "category"
+    parameter_name = "category"
+    index = 0
+
+class LabelFilter(_RuleFilter):
+    title = "label"
+    parameter_name = "label"
+    index = 1
 
 @admin.register(Inmate)
 class InmateAdmin(admin.ModelAdmin):
     list_display  = ("booking_number", "last_name", "first_name", "age")
     search_fields = ("booking_number", "first_name", "last_name")
+    show_full_result_count = False
 
 @admin.register(Charge)
 class ChargeAdmin(admin.ModelAdmin):
     list_display  = ("inmate", "charge", "bond_amount", "court_case_number")
-    search_fields = ("inmate__booking_number", "inmate__last_name", "charge", "court_case_number")
+    # "charge" non è qui: lo cerca get_search_results tramite l'indice trigram
+    search_fields = ("inmate__booking_number", "inmate__last_name", "court_case_number")
+    list_select_related = ("inmate",)
+    show_full_result_count = False
 
-@admin.register(ChildAbuseIndex)
-class ChildAbuseIndexAdmin(admin.ModelAdmin):
-    list_display = ("inmate", "created_at")
-    search_fields = ("inmate__booking_number", "inmate__last_name")
+    def get_search_results(self, request, queryset, search_term):
+        results, may_have_duplicates = super().get_search_results(request, queryset, search_term)
+        term = search_term.strip()
+        if term:
+            results |= queryset.filter(pk__in=search.contains_any([term]).values("pk"))
+        return results, may_have_duplicates
 
-@admin.register(NonChildAbuseIndex)
-class NonChildAbuseIndexAdmin(admin.ModelAdmin):
-    list_display = ("inmate", "created_at")
+@admin.register(CategoryMembership)
+class CategoryMembershipAdmin(admin.ModelAdmin):
+    list_display  = ("inmate", "category", "label", "generation", "created_at")
+    list_filter   = (CategoryFilter, LabelFilter)
     search_fields = ("inmate__booking_number", "inmate__last_name")
+    list_select_related = ("inmate",)
+    show_full_result_count = False
+
+@admin.register(CategoryGeneration)
+class CategoryGenerationAdmin(admin.ModelAdmin):
+    list_display  = ("category", "active", "updated_at")
 
 @admin.register(LeaderboardEntry)
 class LeaderboardEntryAdmin(admin.ModelAdmin):
@@ -27,12 +65,13 @@ class LeaderboardEntryAdmin(admin.ModelAdmin):
     list_filter   = ("mode",)
     search_fields = ("name",)
 
-@admin.register(MurderIndex)
-class MurderIndexAdmin(admin.ModelAdmin):
-    list_display = ("inmate", "created_at")
-    search_fields = ("inmate__booking_number", "inmate__last_name")
+@admin.register(Job)
+class JobAdmin(admin.ModelAdmin):
+    list_display = ("id", "kind", "status", "attempts", "created_at", "started_at", "finished_at")
+    list_filter  = ("kind", "status")
 
-@admin.register(NonMurderIndex)
-class NonMurderIndexAdmin(admin.ModelAdmin):
-    list_display = ("inmate", "created_at")
-    search_fields = ("inmate__booking_number", "inmate__last_name")
\ No newline at end of file
+@admin.register(ScrapeItem)
+class ScrapeItemAdmin(admin.ModelAdmin):
+    list_display  = ("job", "booking_number", "status", "attempts", "updated_at")
+    list_filter   = ("status",)
+    search_fields = ("booking_number",)
@@ -0,0 +1,6 @@
+from core.services import classify
+
+
+def filter_categories(request):
+    """Categorie di classify.RULES per i pulsanti 'Filtra' della barra staff (base.html)."""
+    return {"filter_categories": classify.CATEGORIES}
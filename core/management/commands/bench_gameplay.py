@@ -0,0 +1,367 @@
+import json
+import math
+import os
+import random
+import re
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from urllib.parse import quote
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, transaction
+from django.test import Client
+from django.test.utils import override_settings, setup_test_environment, teardown_test_environment
+from django.urls import reverse
+
+from core.models import Inmate, Charge, LeaderboardEntry
+from core.services import classify, replay
+from core.services.filters import apply_filters
+from core.services.modes import MODES
+
+NEUTRAL_CHARGES = [
+    "DRIVING WHILE LICENSE SUSPENDED",
+    "PETIT THEFT",
+    "BATTERY",
+    "TRESPASS",
+    "RESISTING OFFICER WITHOUT VIOLENCE",
+    "VIOLATION OF PROBATION",
+    "DUI",
+    "BURGLARY",
+]
+FIRST_NAMES = ["JOHN", "MARIA", "JAMES", "LINDA", "ROBERT", "ANA", "MICHAEL", "SARAH", "DAVID", "LUIS"]
+LAST_NAMES = ["SMITH", "JOHNSON", "GARCIA", "BROWN", "DAVIS", "RODRIGUEZ", "WILSON", "LOPEZ", "TAYLOR", "MOORE"]
+
+_CSRF = re.compile(r'name="csrfmiddlewaretoken" value="([^"]+)"')
+
+
+def _percentile(sorted_values, p: float) -> float:
+    """Percentile nearest-rank (p in 0..1) di una lista già ordinata."""
+    if not sorted_values:
+        return 0.0
+    return sorted_values[min(len(sorted_values) - 1, max(math.ceil(p * len(sorted_values)) - 1, 0))]
+
+
+def _git_commit() -> str | None:
+    try:
+        out = subprocess.run(["git", "rev-parse", "HEAD"], cwd=settings.BASE_DIR,
+                             capture_output=True, text=True, timeout=5)
+        return out.stdout.strip() or None
+    except (OSError, subprocess.SubprocessError):
+        return None
+
+
+class _Recorder:
+    """Latenze per endpoint, condivise tra i thread del load generator."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.samples: dict[str, list[float]] = {}
+        self.errors: dict[str, int] = {}
+
+    def add(self, name: str, seconds: float, ok: bool):
+        with self._lock:
+            self.samples.setdefault(name, []).append(seconds)
+            if not ok:
+                self.errors[name] = self.errors.get(name, 0) + 1
+
+    def summary(self, wall: float) -> dict:
+        out = {}
+        for name, values in sorted(self.samples.items()):
+            values = sorted(values)
+            out[name] = {
+                "count": len(values),
+                "errors": self.errors.get(name, 0),
+                "rps": round(len(values) / wall, 2) if wall else 0.0,
+                "mean_ms": round(sum(values) / len(values) * 1000, 3),
+                "p50_ms": round(_percentile(values, 0.50) * 1000, 3),
+                "p99_ms": round(_percentile(values, 0.99) * 1000, 3),
+                "max_ms": round(values[-1] * 1000, 3),
+            }
+        return out
+
+
+class _ClientTransport:
+    """Django test client in-process (nessun server, niente CSRF)."""
+
+    def __init__(self):
+        self.client = Client()
+
+    def get(self, path):
+        r = self.client.get(path)
+        return r.status_code, r.content.decode("utf-8", "replace"), r.get("Location", "")
+
+    def post(self, path, data):
+        r = self.client.post(path, data)
+        return r.status_code, r.content.decode("utf-8", "replace"), r.get("Location", "")
+
+
+class _HttpTransport:
+    """requests.Session verso un server vero (cookie e token CSRF come un browser)."""
+
+    def __init__(self, base_url: str):
+        import requests
+
+        self.base_url = base_url.rstrip("/")
+        self.session = requests.Session()
+
+    def get(self, path):
+        r = self.session.get(self.base_url + path, allow_redirects=False, timeout=30)
+        return r.status_code, r.text, r.headers.get("Location", "")
+
+    def post(self, path, data):
+        r = self.session.post(self.base_url + path, data=data, allow_redirects=False, timeout=30,
+                              headers={"Referer": self.base_url + path})
+        return r.status_code, r.text, r.headers.get("Location", "")
+
+
+def _play_game(transport, recorder: _Recorder, mode: str, rng: random.Random, max_rounds: int):
+    """Una partita completa col flusso senza JS: start, play/choose fino al game over, submit, classifica."""
+
+    def timed(name, method, path, data=None):
+        started = time.perf_counter()
+        status, body, location = transport.post(path, data) if method == "POST" else transport.get(path)
+        recorder.add(name, time.perf_counter() - started, status < 400)
+        return status, body, location
+
+    play = reverse("mode_play", kwargs={"mode": mode})
+    choose = reverse("mode_choose", kwargs={"mode": mode})
+    gameover = reverse("mode_gameover", kwargs={"mode": mode})
+
+    timed("mode_start", "GET", reverse("mode_start", kwargs={"mode": mode}))
+    for _ in range(max_rounds):
+        status, body, location = timed("mode_play", "GET", play)
+        if status != 200 or 'name="side"' not in body:
+            break                                   # game over (redirect) o nessuna coppia
+        token = _CSRF.search(body)
+        data = {"side": rng.choice(["left", "right"])}
+        if token:
+            data["csrfmiddlewaretoken"] = token.group(1)
+        status, _, location = timed("mode_choose", "POST", choose, data)
+        if location.endswith(gameover):
+            break
+
+    status, body, _ = timed("mode_gameover", "GET", gameover)
+    token = _CSRF.search(body)
+    data = {"name": "bench"}
+    if token:
+        data["csrfmiddlewaretoken"] = token.group(1)
+    timed("leaderboard_submit", "POST", reverse("leaderboard_submit"), data)
+    timed("leaderboard", "GET", reverse("leaderboard", kwargs={"mode": mode}))
+
+
+class Command(BaseCommand):
+    help = (
+        "Benchmark del loop di gioco (play / choose / gameover / leaderboard / submit) "
+        "su un DB di benchmark con dati sintetici, via test client e/o gunicorn multi-worker. "
+        "Stampa un JSON con p50/p99 e throughput per endpoint, confrontabile tra commit."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--scales", default="10000", help="detenuti sintetici, es. 10000,100000,1000000")
+        parser.add_argument("--games", type=int, default=50, help="partite per driver (per thread con gunicorn)")
+        parser.add_argument("--max-rounds", type=int, default=30, help="round massimi per partita")
+        parser.add_argument("--modes", default=",".join(MODES), help="modalità da giocare, a rotazione")
+        parser.add_argument("--leaderboard-rows", type=int, default=1000, help="righe di classifica per modalità")
+        parser.add_argument("--no-client", action="store_true", help="salta il driver test client")
+        parser.add_argument("--gunicorn-workers", type=int, default=0, help="avvia gunicorn con N worker (0 = no)")
+        parser.add_argument("--concurrency", type=int, default=8, help="thread del load generator HTTP")
+        parser.add_argument("--image-bytes", type=int, default=20000, help="dimensione delle foto servite dallo stub")
+        parser.add_argument("--keepdb", action="store_true", help="conserva e riusa il DB di benchmark già popolato")
+        parser.add_argument("--output", help="scrive il JSON su file invece che su stdout")
+        parser.add_argument("--seed", type=int, default=0)
+
+    def handle(self, *args, **opts):
+        try:
+            scales = [int(s) for s in opts["scales"].split(",") if s.strip()]
+        except ValueError:
+            raise CommandError("--scales: numeri interi separati da virgola")
+        modes = [m for m in opts["modes"].split(",") if m in MODES]
+        if not modes:
+            raise CommandError(f"--modes: nessuna modalità valida (disponibili: {', '.join(MODES)})")
+        if opts["gunicorn_workers"]:
+            try:
+                import gunicorn  # noqa: F401
+            except ImportError:
+                raise CommandError("gunicorn non installato: pip install gunicorn oppure usa solo il test client")
+
+        result = {"commit": _git_commit(), "started_at": time.strftime("%Y-%m-%dT%H:%M:%S%z"),
+                  "vendor": connection.vendor, "runs": []}
+
+        # foto: stub locale invece di netapps.ocfl.net
+        stub = replay.ReplayServer([], image_bytes=opts["image_bytes"], fill_missing=True)
+        with stub, tempfile.TemporaryDirectory() as tmp:
+            for scale in scales:
+                old_name = self._setup_db(scale, opts)
+                try:
+                    result["runs"] += self._bench_scale(scale, modes, stub, tmp, opts)
+                finally:
+                    connection.creation.destroy_test_db(old_name, verbosity=0, keepdb=opts["keepdb"])
+
+        text = json.dumps(result, indent=2)
+        if opts["output"]:
+            with open(opts["output"], "w", encoding="utf-8") as f:
+                f.write(text + "\n")
+            self.stderr.write(f"risultati in {opts['output']}")
+        else:
+            self.stdout.write(text)
+
+    # ---- DB di benchmark -----------------------------------------------------
+
+    def _setup_db(self, scale: int, opts) -> str:
+        """Crea (o riusa con --keepdb) il DB di benchmark per `scale` e lo popola. Ritorna il nome originale."""
+        test = connection.settings_dict.setdefault("TEST", {})
+        if connection.vendor == "sqlite":
+            # su file (non in memoria): i worker gunicorn devono vederlo
+            test["NAME"] = os.path.join(tempfile.gettempdir(), f"gamehub_bench_{scale}.sqlite3")
+        else:
+            test["NAME"] = f"{connection.settings_dict['NAME']}_bench_{scale}"
+        old_name = connection.settings_dict["NAME"]
+        connection.creation.create_test_db(verbosity=0, autoclobber=True, serialize=False, keepdb=opts["keepdb"])
+
+        if Inmate.objects.count() != scale:
+            started = time.perf_counter()
+            self._seed(scale, opts)
+            self.stderr.write(f"[bench] {scale} detenuti sintetici in {time.perf_counter() - started:.1f}s")
+        return old_name
+
+    def _seed(self, scale: int, opts):
+        rng = random.Random(opts["seed"])
+        pool = NEUTRAL_CHARGES * 3 + replay.EXTRA_CHARGES      # ~1/4 dei charges in una categoria
+        flags = {text: classify.flags(text) for text in pool}
+        chunk = 5000
+
+        Inmate.objects.all().delete()
+        LeaderboardEntry.objects.all().delete()
+        for start in range(0, scale, chunk):
+            with transaction.atomic():
+                bookings = [f"B{n:09d}" for n in range(start, min(start + chunk, scale))]
+                Inmate.objects.bulk_create([
+                    Inmate(booking_number=b, first_name=rng.choice(FIRST_NAMES),
+                           last_name=rng.choice(LAST_NAMES), age=rng.randint(18, 80))
+                    for b in bookings
+                ])
+                ids = Inmate.objects.filter(booking_number__in=bookings).values_list("id", flat=True)
+                Charge.objects.bulk_create([
+                    Charge(inmate_id=inmate_id, charge=text, categories=flags[text])
+                    for inmate_id in ids
+                    for text in rng.sample(pool, rng.randint(1, 3))
+                ], batch_size=chunk)
+        apply_filters()
+
+        LeaderboardEntry.objects.bulk_create([
+            LeaderboardEntry(name=f"player{n}", score=rng.randint(1, 500), mode=mode)
+            for mode in MODES
+            for n in range(opts["leaderboard_rows"])
+        ], batch_size=chunk)
+
+    def _database_url(self) -> str:
+        s = connection.settings_dict
+        if connection.vendor == "sqlite":
+            return f"sqlite:///{s['NAME']}"
+        auth = f"{quote(s['USER'] or '')}:{quote(s['PASSWORD'] or '')}@" if s.get("USER") else ""
+        port = f":{s['PORT']}" if s.get("PORT") else ""
+        return f"{connection.vendor}://{auth}{s['HOST'] or 'localhost'}{port}/{s['NAME']}"
+
+    # ---- driver --------------------------------------------------------------
+
+    def _bench_scale(self, scale: int, modes, stub, tmp: str, opts) -> list[dict]:
+        runs = []
+        bench_settings = {
+            "SCRAPER_BASE_URL": stub.base_url,
+            "IMAGE_CACHE_DIR": os.path.join(tmp, f"images_{scale}"),
+            "LEADERBOARD_SPOOL_DIR": os.path.join(tmp, f"spool_{scale}"),
+            "CACHES": {"default": {"BACKEND": "django.core.cache.backends.locmem.LocMemCache",
+                                   "LOCATION": f"bench-{scale}"}},
+        }
+        base = {"scale": scale, "games": opts["games"], "modes": modes}
+
+        if not opts["no_client"]:
+            setup_test_environment()
+            try:
+                with override_settings(**bench_settings):
+                    recorder = _Recorder()
+                    rng = random.Random(opts["seed"])
+                    transport = _ClientTransport()
+                    started = time.perf_counter()
+                    for n in range(opts["games"]):
+                        _play_game(transport, recorder, modes[n % len(modes)], rng, opts["max_rounds"])
+                    wall = time.perf_counter() - started
+            finally:
+                teardown_test_environment()
+            runs.append({**base, "driver": "client", "workers": 1, "concurrency": 1,
+                         **self._totals(recorder, wall)})
+
+        if opts["gunicorn_workers"]:
+            runs.append({**base, "driver": "gunicorn", "workers": opts["gunicorn_workers"],
+                         "concurrency": opts["concurrency"],
+                         **self._bench_gunicorn(modes, bench_settings, opts)})
+        return runs
+
+    def _totals(self, recorder: _Recorder, wall: float) -> dict:
+        requests_done = sum(len(v) for v in recorder.samples.values())
+        return {
+            "wall_s": round(wall, 3),
+            "requests": requests_done,
+            "rps": round(requests_done / wall, 2) if wall else 0.0,
+            "endpoints": recorder.summary(wall),
+        }
+
+    def _server_command(self, workers: int, port: int) -> list[str]:
+        return [sys.executable, "-m", "gunicorn", "gamehub.wsgi", "--workers", str(workers),
+                "--bind", f"127.0.0.1:{port}", "--log-level", "warning"]
+
+    def _bench_gunicorn(self, modes, bench_settings, opts) -> dict:
+        with socket.socket() as s:
+            s.bind(("127.0.0.1", 0))
+            port = s.getsockname()[1]
+        env = {
+            **os.environ,
+            "DATABASE_URL": self._database_url(),
+            "SCRAPER_BASE_URL": bench_settings["SCRAPER_BASE_URL"],
+            "IMAGE_CACHE_DIR": bench_settings["IMAGE_CACHE_DIR"],
+            "LEADERBOARD_SPOOL_DIR": bench_settings["LEADERBOARD_SPOOL_DIR"],
+        }
+        env.pop("REDIS_URL", None)                  # cache locale per worker, come nel test client
+        proc = subprocess.Popen(self._server_command(opts["gunicorn_workers"], port),
+                                cwd=settings.BASE_DIR, env=env)
+        base_url = f"http://127.0.0.1:{port}"
+        try:
+            self._wait_ready(proc, port)
+            recorder = _Recorder()
+
+            def user(n):
+                rng = random.Random(opts["seed"] + n)
+                transport = _HttpTransport(base_url)
+                for game in range(opts["games"]):
+                    _play_game(transport, recorder, modes[(n + game) % len(modes)], rng, opts["max_rounds"])
+
+            threads = [threading.Thread(target=user, args=(n,)) for n in range(max(opts["concurrency"], 1))]
+            started = time.perf_counter()
+            for t in threads:
+                t.start()
+            for t in threads:
+                t.join()
+            return self._totals(recorder, time.perf_counter() - started)
+        finally:
+            proc.terminate()
+            try:
+                proc.wait(timeout=10)
+            except subprocess.TimeoutExpired:
+                proc.kill()
+
+    def _wait_ready(self, proc, port: int, timeout: float = 30):
+        deadline = time.monotonic() + timeout
+        while time.monotonic() < deadline:
+            if proc.poll() is not None:
+                raise CommandError(f"il server è uscito subito (codice {proc.returncode})")
+            try:
+                with socket.create_connection(("127.0.0.1", port), timeout=0.5):
+                    return
+            except OSError:
+                time.sleep(0.2)
+        raise CommandError(f"il server non risponde sulla porta {port}")
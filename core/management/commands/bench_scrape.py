@@ -0,0 +1,147 @@
+import os
+import string
+import tempfile
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.test.utils import override_settings
+
+from core.models import Inmate
+from core.services import replay
+from core.services.scraper import run_scrape
+
+
+class _WriteCounter:
+    """
+    execute_wrapper: conta statement e righe di INSERT/UPDATE/DELETE.
+    Per gli INSERT le righe si ricavano dai parametri: con RETURNING (bulk_create)
+    il rowcount del cursore non è affidabile.
+    """
+
+    def __init__(self):
+        self.statements = 0
+        self.rows = 0
+
+    def __call__(self, execute, sql, params, many, context):
+        result = execute(sql, params, many, context)
+        verb = sql.lstrip()[:6].upper()
+        if verb == "INSERT":
+            self.statements += 1
+            if many:
+                self.rows += len(params)
+            else:
+                columns = sql.split("(", 1)[1].split(")", 1)[0].count(",") + 1
+                self.rows += len(params or ()) // columns
+        elif verb in ("UPDATE", "DELETE"):
+            self.statements += 1
+            self.rows += max(context["cursor"].rowcount, 0)
+        return result
+
+
+class Command(BaseCommand):
+    help = (
+        "Benchmark di run_scrape contro un replay locale delle API BestJail. "
+        "Per ogni numero di worker: inmates/s, req/s e scritture DB/s. "
+        "Gira su un DB usa e getta (create_test_db, come bench_gameplay), svuotato a ogni giro: "
+        "il DB vero non viene toccato e i commit dei batch sono commit veri."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--fixture", help="fixture JSON (default: costruita da debug_search.html + descriptions/)")
+        parser.add_argument("--record", metavar="PATH", help="salva la fixture usata in PATH")
+        parser.add_argument("--size", type=int, default=0, help="detenuti nel dataset (0 = quelli della fixture)")
+        parser.add_argument("--workers", default="1,4,8", help="numeri di worker da provare, separati da virgola")
+        parser.add_argument("--latency", type=float, default=50, help="latenza per richiesta in ms")
+        parser.add_argument("--jitter", type=float, default=0, help="jitter massimo aggiunto alla latenza, in ms")
+        parser.add_argument("--error-rate", type=float, default=0.0, help="probabilità di 503 per richiesta (0..1)")
+        parser.add_argument("--image-bytes", type=int, default=0, help="dimensione della foto restituita da getInmateDetails")
+        parser.add_argument("--batch-size", type=int, default=None, help="detenuti per transazione (default: SCRAPER_BATCH_SIZE)")
+        parser.add_argument("--filters", default=string.ascii_lowercase, help="lettere da cercare (default a..z)")
+        parser.add_argument("--seed", type=int, default=0)
+
+    def handle(self, *args, **opts):
+        if opts["fixture"]:
+            inmates = replay.load(opts["fixture"])
+        else:
+            inmates = replay.from_captures(settings.BASE_DIR, seed=opts["seed"])
+        if not inmates:
+            raise CommandError("fixture vuota: passa --fixture o aggiungi le catture (debug_search.html)")
+        if opts["size"]:
+            inmates = replay.scale(inmates, opts["size"])
+        if opts["record"]:
+            replay.dump(inmates, opts["record"])
+            self.stdout.write(f"fixture salvata in {opts['record']} ({len(inmates)} detenuti)")
+
+        try:
+            worker_counts = [int(w) for w in opts["workers"].split(",") if w.strip()]
+        except ValueError:
+            raise CommandError("--workers: numeri interi separati da virgola")
+
+        server = replay.ReplayServer(
+            inmates,
+            latency=opts["latency"] / 1000,
+            jitter=opts["jitter"] / 1000,
+            error_rate=opts["error_rate"],
+            image_bytes=opts["image_bytes"],
+            seed=opts["seed"],
+        )
+        self.stdout.write(
+            f"dataset: {len(inmates)} detenuti, latenza {opts['latency']:.0f}ms, "
+            f"errori {opts['error_rate']:.0%}, filtri {len(opts['filters'])}"
+        )
+        self.stdout.write(f"{'workers':>7} {'secondi':>8} {'inmates/s':>10} {'req/s':>8} {'writes/s':>9} "
+                          f"{'req':>6} {'err':>5} {'writes':>7} {'failed':>6}")
+
+        old_name = self._setup_db()
+        try:
+            with server, tempfile.TemporaryDirectory() as image_dir:
+                with override_settings(SCRAPER_BASE_URL=server.base_url, IMAGE_CACHE_DIR=image_dir):
+                    for workers in worker_counts:
+                        row = self._run(server, workers, opts)
+                        self.stdout.write(
+                            f"{workers:>7} {row['seconds']:>8.2f} {row['inmates_s']:>10.1f} {row['req_s']:>8.1f} "
+                            f"{row['writes_s']:>9.1f} {row['requests']:>6} {row['errors']:>5} "
+                            f"{row['writes']:>7} {row['failed']:>6}"
+                        )
+        finally:
+            connection.creation.destroy_test_db(old_name, verbosity=0)
+
+    def _setup_db(self) -> str:
+        """Crea il DB di benchmark (migrato, vuoto) e ci sposta la connessione. Ritorna il nome originale."""
+        test = connection.settings_dict.setdefault("TEST", {})
+        if connection.vendor == "sqlite":
+            # su file (non in memoria): i commit dei batch costano come sul DB vero
+            test["NAME"] = os.path.join(tempfile.gettempdir(), "gamehub_bench_scrape.sqlite3")
+        else:
+            test["NAME"] = f"{connection.settings_dict['NAME']}_bench_scrape"
+        old_name = connection.settings_dict["NAME"]
+        connection.creation.create_test_db(verbosity=0, autoclobber=True, serialize=False)
+        return old_name
+
+    def _run(self, server, workers: int, opts) -> dict:
+        counter = _WriteCounter()
+        # partenza a freddo: DB di benchmark vuoto
+        Inmate.objects.all().delete()
+        server.reset()
+        started = time.perf_counter()
+        with connection.execute_wrapper(counter):
+            stats = run_scrape(
+                filters=list(opts["filters"]),
+                verbose=False,
+                workers=workers,
+                rate_limit=0,
+                batch_size=opts["batch_size"],
+            )
+        seconds = time.perf_counter() - started
+        return {
+            "seconds": seconds,
+            "inmates_s": stats["scanned"] / seconds,
+            "req_s": server.requests / seconds,
+            "writes_s": counter.rows / seconds,
+            "requests": server.requests,
+            "errors": server.errors,
+            "writes": counter.rows,
+            "failed": stats["failed"],
+        }
@@ -0,0 +1,14 @@
+from django.core.management.base import BaseCommand
+
+from core.services.jobs import run_worker
+
+
+class Command(BaseCommand):
+    help = "Worker della coda job (scrape / filtri). Esegue un job per volta."
+
+    def add_arguments(self, parser):
+        parser.add_argument("--poll", type=float, default=2.0, help="secondi tra un controllo e l'altro della coda")
+        parser.add_argument("--once", action="store_true", help="esegue i job in coda ed esce")
+
+    def handle(self, *args, **opts):
+        run_worker(poll=opts["poll"], once=opts["once"])
@@ -0,0 +1,147 @@
+"""
+Misura per richiesta: fasi (db, session, render, upstream) nell'header
+Server-Timing e negli istogrammi di core/services/metrics.py.
+
+In settings.MIDDLEWARE:
+    ServerTimingMiddleware      subito PRIMA di SessionMiddleware (esterno)
+    SessionMiddleware
+    SessionTimingMarker         subito DOPO SessionMiddleware (interno)
+Il marker segna quando la risposta esce dalla vista; il tempo fino al ritorno
+nel middleware esterno è il salvataggio della sessione (process_response).
+
+Entrambi sono sync e async (come i middleware di Django): sotto ASGI la catena
+resta async e la vista async /img/ non viene avvolta in async_to_sync.
+L'header Server-Timing espone i tempi interni: solo per lo staff, con DEBUG o
+con SERVER_TIMING=True; le metriche vengono raccolte comunque.
+"""
+
+import time
+from contextlib import ExitStack, contextmanager
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from django.conf import settings
+from django.db import connections
+
+from core.services import metrics
+
+_MARK = "_timing_session_mark"
+
+
+def _db_timer(execute, sql, params, many, context):
+    started = time.perf_counter()
+    try:
+        return execute(sql, params, many, context)
+    finally:
+        metrics.add_phase("db", time.perf_counter() - started)
+
+
+@contextmanager
+def _db_timing():
+    with ExitStack() as stack:
+        for alias in connections:
+            stack.enter_context(connections[alias].execute_wrapper(_db_timer))
+        yield
+
+
+def _view_name(request) -> str:
+    match = getattr(request, "resolver_match", None)
+    return (match.view_name or "unnamed") if match else "unresolved"
+
+
+def _header(timings, total: float) -> str:
+    parts = []
+    for name, (seconds, count) in sorted(timings.phases.items()):
+        entry = f"{name};dur={seconds * 1000:.1f}"
+        if name in ("db", "upstream"):
+            entry += f';desc="{count}"'
+        parts.append(entry)
+    parts.append(f"total;dur={total * 1000:.1f}")
+    return ", ".join(parts)
+
+
+def _show_header(request) -> bool:
+    """
+    Header per lo staff senza costi extra: request.user è lazy e leggerlo qui,
+    dopo la vista, costerebbe una SELECT della sessione a ogni richiesta con
+    cookie. Si guarda solo l'utente già caricato dalla vista (o dall'admin).
+    """
+    if getattr(settings, "SERVER_TIMING", False) or settings.DEBUG:
+        return True
+    if settings.SESSION_COOKIE_NAME not in request.COOKIES:
+        return False
+    user = request.__dict__.get("_cached_user")
+    return bool(user and user.is_staff)
+
+
+class ServerTimingMiddleware:
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        self.async_mode = iscoroutinefunction(get_response)
+        if self.async_mode:
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if self.async_mode:
+            return self.__acall__(request)
+        if not metrics.enabled():
+            return self.get_response(request)
+        timings, token = metrics.begin()
+        try:
+            with _db_timing():
+                response = self.get_response(request)
+        finally:
+            metrics.end(token)
+        return self._finish(request, response, timings)
+
+    async def __acall__(self, request):
+        if not metrics.enabled():
+            return await self.get_response(request)
+        timings, token = metrics.begin()
+        try:
+            with _db_timing():
+                response = await self.get_response(request)
+        finally:
+            metrics.end(token)
+        return self._finish(request, response, timings)
+
+    def _finish(self, request, response, timings):
+        mark = getattr(request, _MARK, None)
+        if mark is not None:
+            timings.add("session", time.perf_counter() - mark)
+        total = timings.elapsed()
+
+        view = _view_name(request)
+        metrics.observe("gamehub_request_seconds", total, view=view, status=f"{response.status_code // 100}xx")
+        for name, (seconds, _) in timings.phases.items():
+            metrics.observe("gamehub_request_phase_seconds", seconds, view=view, phase=name)
+        metrics.observe("gamehub_db_queries", timings.phases.get("db", (0, 0))[1], view=view)
+
+        if _show_header(request):
+            response["Server-Timing"] = _header(timings, total)
+        return response
+
+
+class SessionTimingMarker:
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        self.async_mode = iscoroutinefunction(get_response)
+        if self.async_mode:
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if self.async_mode:
+            return self.__acall__(request)
+        response = self.get_response(request)
+        setattr(request, _MARK, time.perf_counter())
+        return response
+
+    async def __acall__(self, request):
+        response = await self.get_response(request)
+        setattr(request, _MARK, time.perf_counter())
+        return response
@@ -0,0 +1,18 @@
+# Generated by Django 5.1.1 on 2026-10-17 20:25
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0009_remove_inmate_image'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='inmate',
+            name='charges_hash',
+            field=models.CharField(blank=True, max_length=64),
+        ),
+    ]
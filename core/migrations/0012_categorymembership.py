@@ -0,0 +1,69 @@
+# Generated by Django 5.1.1 on 2026-10-17 20:31
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+# vecchia tabella indice -> (category, label); le tabelle "Non*" non servono più (anti-join)
+OLD_INDEXES = {
+    "ChildAbuseIndex": ("child", "child_abuse"),
+    "MurderIndex": ("murder", "murder"),
+    "CannabisIndex": ("drugs", "cannabis"),
+    "CocaineFentanylIndex": ("drugs", "cocaine_fentanyl"),
+}
+
+
+def copy_indexes(apps, schema_editor):
+    CategoryMembership = apps.get_model("core", "CategoryMembership")
+    for model_name, (category, label) in OLD_INDEXES.items():
+        model = apps.get_model("core", model_name)
+        CategoryMembership.objects.bulk_create(
+            [
+                CategoryMembership(category=category, label=label, inmate_id=inmate_id)
+                for inmate_id in model.objects.values_list("inmate_id", flat=True).iterator()
+            ],
+            batch_size=1000,
+            ignore_conflicts=True,
+        )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0011_job'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='CategoryMembership',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('category', models.CharField(max_length=30)),
+                ('label', models.CharField(max_length=30)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('inmate', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='memberships', to='core.inmate')),
+            ],
+            options={
+                'indexes': [models.Index(fields=['inmate', 'category'], name='core_membership_inmate_cat')],
+                'constraints': [models.UniqueConstraint(fields=('category', 'label', 'inmate'), name='core_membership_unique')],
+            },
+        ),
+        migrations.RunPython(copy_indexes, migrations.RunPython.noop),
+        migrations.DeleteModel(
+            name='CannabisIndex',
+        ),
+        migrations.DeleteModel(
+            name='ChildAbuseIndex',
+        ),
+        migrations.DeleteModel(
+            name='CocaineFentanylIndex',
+        ),
+        migrations.DeleteModel(
+            name='MurderIndex',
+        ),
+        migrations.DeleteModel(
+            name='NonChildAbuseIndex',
+        ),
+        migrations.DeleteModel(
+            name='NonMurderIndex',
+        ),
+    ]
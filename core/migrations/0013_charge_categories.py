@@ -0,0 +1,62 @@
+# Generated by Django 5.1.1 on 2026-10-17 21:02
+
+import re
+
+from django.db import migrations, models
+
+# Regole e bit congelati come erano a questa migrazione: core.services.classify
+# può cambiare in seguito senza alterare il risultato di questa data migration.
+CHILD_SECONDARY_KEYWORDS = [
+    "assault", "sex", "sexual", "abuse", "molest", "exploitation",
+    "pornograph", "indecent", "lewd", "lascivious", "battery",
+    "neglect", "endangerment", "solicitation", "entice", "incest",
+    "rape", "sodomy", "traffick", "conduct", "exposure", "fondling",
+    "statutory", "child abuse", "child neglect", "child porn", "video"
+]
+RULES = [
+    # (bit, tutte queste, almeno una di queste)
+    (1 << 0, ["child"], CHILD_SECONDARY_KEYWORDS),
+    (1 << 1, [], ["murder"]),
+    (1 << 2, [], ["cannabis"]),
+    (1 << 3, [], ["cocaine", "fentanyl"]),
+]
+
+
+def flags(text):
+    text = re.sub(r"\s+", " ", (text or "").lower()).strip()
+    mask = 0
+    for bit, all_kw, any_kw in RULES:
+        if all(k in text for k in all_kw) and any(k in text for k in any_kw):
+            mask |= bit
+    return mask
+
+
+def populate_categories(apps, schema_editor):
+    Charge = apps.get_model("core", "Charge")
+    batch = []
+    for charge in Charge.objects.only("id", "charge").iterator(chunk_size=2000):
+        mask = flags(charge.charge)
+        if mask:
+            charge.categories = mask
+            batch.append(charge)
+        if len(batch) >= 1000:
+            Charge.objects.bulk_update(batch, ["categories"])
+            batch = []
+    if batch:
+        Charge.objects.bulk_update(batch, ["categories"])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0012_categorymembership'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='charge',
+            name='categories',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.RunPython(populate_categories, migrations.RunPython.noop),
+    ]
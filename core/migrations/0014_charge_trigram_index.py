@@ -0,0 +1,92 @@
+# Generated by Django 5.1.1 on 2026-10-17 21:40
+
+from django.db import DatabaseError, migrations, transaction
+
+# PostgreSQL: pg_trgm + GIN su UPPER(charge)
+PG_FORWARD = [
+    "CREATE EXTENSION IF NOT EXISTS pg_trgm",
+    "CREATE INDEX IF NOT EXISTS core_charge_charge_trgm ON core_charge USING gin (UPPER(charge) gin_trgm_ops)",
+]
+PG_BACKWARD = [
+    "DROP INDEX IF EXISTS core_charge_charge_trgm",
+]
+
+# SQLite: tabella FTS5 con contenuto esterno (core_charge) + trigger di allineamento
+SQLITE_FORWARD = [
+    "CREATE VIRTUAL TABLE IF NOT EXISTS core_charge_fts USING fts5("
+    "charge, content='core_charge', content_rowid='id', tokenize='trigram')",
+    "CREATE TRIGGER IF NOT EXISTS core_charge_fts_ai AFTER INSERT ON core_charge BEGIN "
+    "INSERT INTO core_charge_fts(rowid, charge) VALUES (new.id, new.charge); END",
+    "CREATE TRIGGER IF NOT EXISTS core_charge_fts_ad AFTER DELETE ON core_charge BEGIN "
+    "INSERT INTO core_charge_fts(core_charge_fts, rowid, charge) VALUES ('delete', old.id, old.charge); END",
+    "CREATE TRIGGER IF NOT EXISTS core_charge_fts_au AFTER UPDATE OF charge ON core_charge BEGIN "
+    "INSERT INTO core_charge_fts(core_charge_fts, rowid, charge) VALUES ('delete', old.id, old.charge); "
+    "INSERT INTO core_charge_fts(rowid, charge) VALUES (new.id, new.charge); END",
+    "INSERT INTO core_charge_fts(core_charge_fts) VALUES ('rebuild')",
+]
+SQLITE_BACKWARD = [
+    "DROP TRIGGER IF EXISTS core_charge_fts_ai",
+    "DROP TRIGGER IF EXISTS core_charge_fts_ad",
+    "DROP TRIGGER IF EXISTS core_charge_fts_au",
+    "DROP TABLE IF EXISTS core_charge_fts",
+]
+
+
+# PostgreSQL (SQLSTATE): estensione non installata / permessi mancanti / non supportata /
+# opclass gin_trgm_ops assente
+PG_UNAVAILABLE = {"58P01", "42501", "0A000", "42704"}
+# SQLite: build senza FTS5 o senza il tokenizer trigram (< 3.34)
+SQLITE_UNAVAILABLE = ("no such module", "no such tokenizer", "parse error in tokenize directive")
+
+
+def _unavailable(error) -> bool:
+    """True se l'errore dice solo che pg_trgm / FTS5 trigram non c'è."""
+    cause = error.__cause__
+    code = getattr(cause, "pgcode", None) or getattr(cause, "sqlstate", None)
+    if code:
+        return code in PG_UNAVAILABLE
+    return str(error).lower().startswith(SQLITE_UNAVAILABLE)
+
+
+def _run(schema_editor, statements):
+    """
+    Indice opzionale: se il DB non lo supporta (pg_trgm non installabile,
+    SQLite senza FTS5/trigram) la migration passa e la ricerca resta icontains.
+    Qualsiasi altro errore fa fallire la migration.
+    """
+    try:
+        with transaction.atomic(using=schema_editor.connection.alias):
+            with schema_editor.connection.cursor() as cursor:
+                for sql in statements:
+                    cursor.execute(sql)
+    except DatabaseError as e:
+        if not _unavailable(e):
+            raise
+        print(f"\n[MIGRATION] indice trigram non creato: {e}")
+
+
+def forward(apps, schema_editor):
+    vendor = schema_editor.connection.vendor
+    if vendor == "postgresql":
+        _run(schema_editor, PG_FORWARD)
+    elif vendor == "sqlite":
+        _run(schema_editor, SQLITE_FORWARD)
+
+
+def backward(apps, schema_editor):
+    vendor = schema_editor.connection.vendor
+    if vendor == "postgresql":
+        _run(schema_editor, PG_BACKWARD)
+    elif vendor == "sqlite":
+        _run(schema_editor, SQLITE_BACKWARD)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0013_charge_categories'),
+    ]
+
+    operations = [
+        migrations.RunPython(forward, backward),
+    ]
@@ -0,0 +1,17 @@
+# Generated by Django 5.1.1 on 2026-10-17 20:36
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0014_charge_trigram_index'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='leaderboardentry',
+            index=models.Index(fields=['mode', '-score', 'created_at'], name='core_lb_mode_score'),
+        ),
+    ]
@@ -0,0 +1,19 @@
+# Generated by Django 5.1.1 on 2026-10-17 20:37
+
+import django.utils.timezone
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0015_leaderboardentry_mode_score_index'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='leaderboardentry',
+            name='created_at',
+            field=models.DateTimeField(default=django.utils.timezone.now, editable=False),
+        ),
+    ]
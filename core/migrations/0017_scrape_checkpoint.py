@@ -0,0 +1,37 @@
+# Generated by Django 5.1.1 on 2026-10-17 20:41
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0016_leaderboardentry_created_at_default'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='job',
+            name='checkpoint',
+            field=models.JSONField(blank=True, default=dict),
+        ),
+        migrations.CreateModel(
+            name='ScrapeItem',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('booking_number', models.CharField(max_length=20)),
+                ('first_name', models.CharField(blank=True, max_length=100)),
+                ('last_name', models.CharField(blank=True, max_length=100)),
+                ('status', models.CharField(choices=[('pending', 'Da scaricare'), ('done', 'Scritto'), ('failed', 'Fallito')], default='pending', max_length=10)),
+                ('attempts', models.IntegerField(default=0)),
+                ('error', models.TextField(blank=True)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+                ('job', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='scrape_items', to='core.job')),
+            ],
+            options={
+                'indexes': [models.Index(fields=['job', 'status'], name='core_scrapeitem_job_status')],
+                'constraints': [models.UniqueConstraint(fields=('job', 'booking_number'), name='core_scrapeitem_unique')],
+            },
+        ),
+    ]
@@ -0,0 +1,43 @@
+# Generated by Django 5.1.1 on 2026-10-17 20:45
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0017_scrape_checkpoint'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='CategoryGeneration',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('category', models.CharField(max_length=30, unique=True)),
+                ('active', models.PositiveIntegerField(default=0)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+            ],
+        ),
+        migrations.RemoveConstraint(
+            model_name='categorymembership',
+            name='core_membership_unique',
+        ),
+        migrations.RemoveIndex(
+            model_name='categorymembership',
+            name='core_membership_inmate_cat',
+        ),
+        migrations.AddField(
+            model_name='categorymembership',
+            name='generation',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.AddIndex(
+            model_name='categorymembership',
+            index=models.Index(fields=['inmate', 'category', 'generation'], name='core_membership_inmate_cat'),
+        ),
+        migrations.AddConstraint(
+            model_name='categorymembership',
+            constraint=models.UniqueConstraint(fields=('generation', 'category', 'label', 'inmate'), name='core_membership_unique'),
+        ),
+    ]
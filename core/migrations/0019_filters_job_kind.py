@@ -0,0 +1,42 @@
+# Generated by Django 5.1.1 on 2026-10-17 21:08
+
+import core.models
+from django.db import migrations, models
+
+OLD_KINDS = {"filters_child": "child", "filters_murder": "murder", "filters_drugs": "drugs"}
+
+
+def merge_filter_kinds(apps, schema_editor):
+    """filters_<categoria> -> filters con params.categories; al più un job attivo resta in coda."""
+    Job = apps.get_model("core", "Job")
+    active_kept = False
+    for job in Job.objects.filter(kind__in=OLD_KINDS).order_by("created_at"):
+        job.params = {**(job.params or {}), "categories": [OLD_KINDS[job.kind]]}
+        job.kind = "filters"
+        if job.status in ("queued", "running"):
+            if active_kept:
+                job.status = "failed"
+                job.error = "Sostituito dal job filters già attivo (migrazione 0019)."
+            active_kept = True
+        job.save(update_fields=["kind", "params", "status", "error"])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0018_membership_generation'),
+    ]
+
+    operations = [
+        migrations.RunPython(merge_filter_kinds, migrations.RunPython.noop),
+        migrations.AlterField(
+            model_name='job',
+            name='kind',
+            field=models.CharField(choices=[('scrape', 'Aggiorna database'), ('filters', 'Filtra')], max_length=30),
+        ),
+        migrations.AlterField(
+            model_name='leaderboardentry',
+            name='mode',
+            field=models.CharField(choices=core.models.mode_choices, max_length=20),
+        ),
+    ]
@@ -1,4 +1,5 @@
 from django.db import models
+from django.utils import timezone
 
 
 class Inmate(models.Model):
@@ -6,6 +7,7 @@ class Inmate(models.Model):
     first_name     = models.CharField(max_length=100, blank=True)
     last_name      = models.CharField(max_length=100, blank=True)
     age            = models.IntegerField(blank=True, null=True)
+    charges_hash   = models.CharField(max_length=64, blank=True)    # sha256 del payload getCharges (scrape incrementale)
     #image          = models.ImageField(upload_to="inmates/", blank=True, null=True)
 
     def __str__(self):
@@ -19,59 +21,150 @@ class Charge(models.Model):
     court_case_number  = models.CharField(max_length=50, blank=True)        # opzionale
     court_location     = models.CharField(max_length=50, blank=True)        # opzionale
     note               = models.TextField(blank=True)                       # opzionale
+    categories         = models.PositiveIntegerField(default=0)             # bit di classify.BITS
 
     def __str__(self):
         return f"{self.charge[:60]}..."
 
-class ChildAbuseIndex(models.Model):
-    inmate = models.OneToOneField("Inmate", on_delete=models.CASCADE, related_name="idx_child_abuse")
-    created_at = models.DateTimeField(auto_now_add=True)
-
-    def __str__(self):
-        return f"ChildAbuseIndex({self.inmate.booking_number})"
-
+def mode_choices():
+    """Choices delle modalità dal registro (callable: una modalità nuova non richiede migrazioni)."""
+    from core.services.modes import MODES
+    return [(key, mode.title) for key, mode in MODES.items()]
 
-class NonChildAbuseIndex(models.Model):
-    inmate = models.OneToOneField("Inmate", on_delete=models.CASCADE, related_name="idx_non_child_abuse")
-    created_at = models.DateTimeField(auto_now_add=True)
-
-    def __str__(self):
-        return f"NonChildAbuseIndex({self.inmate.booking_number})"
 
 class LeaderboardEntry(models.Model):
-    MODES = (
-        ("child", "Child Abuse"),
-        ("murder", "Murder"),
-        ("drugs", "Drugs"),
-    )
     name  = models.CharField(max_length=50)
     score = models.IntegerField()
-    mode = models.CharField(max_length=20, choices=MODES)
-    created_at = models.DateTimeField(auto_now_add=True)
+    mode = models.CharField(max_length=20, choices=mode_choices)
+    # non auto_now_add: con i submit bufferizzati l'orario è quello del submit, non del flush
+    created_at = models.DateTimeField(default=timezone.now, editable=False)
 
     class Meta:
         ordering = ["-score", "created_at"]
+        indexes = [
+            # top-N e rank per modalità (core/services/leaderboard.py)
+            models.Index(fields=["mode", "-score", "created_at"], name="core_lb_mode_score"),
+        ]
 
     def __str__(self):
         return f"[{self.mode}] {self.name} — {self.score}"
 
-class MurderIndex(models.Model):
-    inmate = models.OneToOneField("Inmate", on_delete=models.CASCADE, related_name="idx_murder")
+class CategoryMembership(models.Model):
+    """
+    Appartenenza di un detenuto a una classe di una categoria di gioco.
+    category = gruppo (es. "child", "murder", "drugs"), label = classe (es. "child_abuse", "cannabis").
+    I "negativi" (non-child, non-murder...) NON sono salvati: sono i detenuti senza
+    righe per quella categoria (anti-join).
+    generation: le ricostruzioni scrivono una generazione nuova accanto a quella
+    attiva e poi spostano CategoryGeneration.active in una transazione; i lettori
+    filtrano sempre per la generazione attiva.
+    """
+    generation = models.PositiveIntegerField(default=0)
+    category   = models.CharField(max_length=30)
+    label      = models.CharField(max_length=30)
+    inmate     = models.ForeignKey("Inmate", on_delete=models.CASCADE, related_name="memberships")
     created_at = models.DateTimeField(auto_now_add=True)
 
+    class Meta:
+        constraints = [
+            # anche indice composito per le estrazioni (generation, category, label) -> inmate_id
+            models.UniqueConstraint(fields=["generation", "category", "label", "inmate"], name="core_membership_unique"),
+        ]
+        indexes = [
+            # anti-join: NOT EXISTS (... WHERE inmate_id = ? AND category = ? AND generation = ?)
+            models.Index(fields=["inmate", "category", "generation"], name="core_membership_inmate_cat"),
+        ]
+
     def __str__(self):
-        return f"MurderIndex({self.inmate.booking_number})"
+        return f"{self.category}/{self.label}({self.inmate_id})@{self.generation}"
 
 
-class NonMurderIndex(models.Model):
-    inmate = models.OneToOneField("Inmate", on_delete=models.CASCADE, related_name="idx_non_murder")
-    created_at = models.DateTimeField(auto_now_add=True)
+class CategoryGeneration(models.Model):
+    """Generazione attiva di CategoryMembership per categoria (assente => 0)."""
+    category   = models.CharField(max_length=30, unique=True)
+    active     = models.PositiveIntegerField(default=0)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    @classmethod
+    def active_map(cls, categories) -> dict:
+        """{category: generazione attiva} con UNA query."""
+        found = dict(cls.objects.filter(category__in=categories).values_list("category", "active"))
+        return {category: found.get(category, 0) for category in categories}
 
     def __str__(self):
-        return f"NonMurderIndex({self.inmate.booking_number})"
+        return f"{self.category}@{self.active}"
 
-class CannabisIndex(models.Model):
-    inmate = models.OneToOneField("Inmate", on_delete=models.CASCADE, related_name="idx_cannabis")
+class Job(models.Model):
+    """Lavoro in background (scrape / filtri) eseguito dal worker `manage.py run_jobs`."""
+    KINDS = (
+        ("scrape", "Aggiorna database"),
+        ("filters", "Filtra"),                  # params: {"categories": [...]} (vuoto = tutte)
+    )
+    QUEUED, RUNNING, DONE, FAILED = "queued", "running", "done", "failed"
+    STATUSES = (
+        (QUEUED, "In coda"),
+        (RUNNING, "In esecuzione"),
+        (DONE, "Completato"),
+        (FAILED, "Fallito"),
+    )
+
+    kind         = models.CharField(max_length=30, choices=KINDS)
+    status       = models.CharField(max_length=10, choices=STATUSES, default=QUEUED)
+    params       = models.JSONField(default=dict, blank=True)
+    progress     = models.JSONField(default=dict, blank=True)   # scanned/created/updated/total...
+    checkpoint   = models.JSONField(default=dict, blank=True)   # stato per la ripresa (es. last_filter dello scrape)
+    result       = models.JSONField(default=dict, blank=True)
+    error        = models.TextField(blank=True)
+    attempts     = models.IntegerField(default=0)
+    created_at   = models.DateTimeField(auto_now_add=True)
+    started_at   = models.DateTimeField(blank=True, null=True)
+    heartbeat_at = models.DateTimeField(blank=True, null=True)
+    finished_at  = models.DateTimeField(blank=True, null=True)
+
+    class Meta:
+        ordering = ["-created_at"]
+        constraints = [
+            # un solo job attivo (in coda o in esecuzione) per tipo
+            models.UniqueConstraint(
+                fields=["kind"],
+                condition=models.Q(status__in=["queued", "running"]),
+                name="core_job_one_active_per_kind",
+            ),
+        ]
+
+    def __str__(self):
+        return f"[{self.kind}] #{self.pk} {self.status}"
+
+
+class ScrapeItem(models.Model):
+    """
+    Checkpoint di uno scrape legato a un Job: un booking trovato nel listing.
+    Se il job viene ripreso (worker morto) i 'done' non vengono riscaricati;
+    i 'failed' vengono ritentati a fine giro.
+    """
+    PENDING, DONE, FAILED = "pending", "done", "failed"
+    STATUSES = (
+        (PENDING, "Da scaricare"),
+        (DONE, "Scritto"),
+        (FAILED, "Fallito"),
+    )
 
-class CocaineFentanylIndex(models.Model):
-    inmate = models.OneToOneField("Inmate", on_delete=models.CASCADE, related_name="idx_cocaine_fentanyl")
+    job            = models.ForeignKey(Job, on_delete=models.CASCADE, related_name="scrape_items")
+    booking_number = models.CharField(max_length=20)
+    first_name     = models.CharField(max_length=100, blank=True)
+    last_name      = models.CharField(max_length=100, blank=True)
+    status         = models.CharField(max_length=10, choices=STATUSES, default=PENDING)
+    attempts       = models.IntegerField(default=0)
+    error          = models.TextField(blank=True)
+    updated_at     = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=["job", "booking_number"], name="core_scrapeitem_unique"),
+        ]
+        indexes = [
+            models.Index(fields=["job", "status"], name="core_scrapeitem_job_status"),
+        ]
+
+    def __str__(self):
+        return f"[job {self.job_id}] {self.booking_number} {self.status}"
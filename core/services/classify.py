@@ -0,0 +1,122 @@
+# core/services/classify.py
+# -*- coding: utf-8 -*-
+"""
+Classificazione dei charges nelle categorie di gioco.
+
+Tutte le parole chiave di tutte le categorie sono compilate in UNA regex;
+ogni testo viene normalizzato una volta (minuscolo, spazi compattati) e
+scansionato una volta sola, poi le regole di ogni (category, label) vengono
+valutate sull'insieme delle parole trovate.
+
+Regola = {"all": [...], "any": [...]}: tutte le parole di "all" e almeno una di "any"
+(nello STESSO charge, come la vecchia Q(charge__icontains=...) per riga).
+
+Ogni (category, label) ha un bit in BITS: lo scraper salva in Charge.categories
+la maschera del charge al momento dell'ingest (flags()), così le appartenenze
+si ricavano dalla colonna senza riscansionare il testo.
+"""
+
+import re
+
+CHILD_SECONDARY_KEYWORDS = [
+    "assault", "sex", "sexual", "abuse", "molest", "exploitation",
+    "pornograph", "indecent", "lewd", "lascivious", "battery",
+    "neglect", "endangerment", "solicitation", "entice", "incest",
+    "rape", "sodomy", "traffick", "conduct", "exposure", "fondling",
+    "statutory", "child abuse", "child neglect", "child porn", "video"
+]
+
+# (category, label) -> regola
+RULES = {
+    ("child", "child_abuse"):       {"all": ["child"], "any": CHILD_SECONDARY_KEYWORDS},
+    ("murder", "murder"):           {"any": ["murder"]},
+    ("drugs", "cannabis"):          {"any": ["cannabis"]},
+    ("drugs", "cocaine_fentanyl"):  {"any": ["cocaine", "fentanyl"]},
+}
+
+CATEGORIES = sorted({category for category, _ in RULES})
+
+# (category, label) -> bit di Charge.categories. I bit sono salvati nel DB:
+# non riassegnarli, aggiungerne di nuovi in coda.
+BITS = {
+    ("child", "child_abuse"):       1 << 0,
+    ("murder", "murder"):           1 << 1,
+    ("drugs", "cannabis"):          1 << 2,
+    ("drugs", "cocaine_fentanyl"):  1 << 3,
+}
+
+_WS_RE = re.compile(r"\s+")
+
+
+def normalize(text: str) -> str:
+    return _WS_RE.sub(" ", (text or "").lower()).strip()
+
+
+class _Matcher:
+    """
+    Regex unica con lookahead: trova, per ogni posizione del testo, la parola più lunga
+    che inizia lì (quindi anche parole sovrapposte, es. "sex" dentro "sexual").
+    Le parole contenute in quella trovata ("child" in "child abuse") sono implicite.
+    """
+
+    def __init__(self, keywords):
+        self.keywords = sorted({normalize(k) for k in keywords}, key=len, reverse=True)
+        alternation = "|".join(re.escape(k) for k in self.keywords)
+        self.regex = re.compile(f"(?=({alternation}))")
+        self.implied = {
+            k: frozenset(other for other in self.keywords if other in k)
+            for k in self.keywords
+        }
+
+    def find(self, normalized_text: str) -> set:
+        found = set()
+        for m in self.regex.finditer(normalized_text):
+            found |= self.implied[m.group(1)]
+        return found
+
+
+def _compile_rules():
+    rules = {}
+    keywords = set()
+    for key, rule in RULES.items():
+        all_kw = frozenset(normalize(k) for k in rule.get("all", ()))
+        any_kw = frozenset(normalize(k) for k in rule.get("any", ()))
+        rules[key] = (all_kw, any_kw)
+        keywords |= all_kw | any_kw
+    return rules, _Matcher(keywords)
+
+
+_RULES, _MATCHER = _compile_rules()
+
+
+def classify(text: str) -> set:
+    """Insieme di (category, label) a cui appartiene un singolo charge."""
+    found = _MATCHER.find(normalize(text))
+    if not found:
+        return set()
+    return {
+        key for key, (all_kw, any_kw) in _RULES.items()
+        if all_kw <= found and (not any_kw or any_kw & found)
+    }
+
+
+def flags(text: str) -> int:
+    """Maschera di bit (BITS) di un singolo charge, da salvare in Charge.categories."""
+    mask = 0
+    for key in classify(text):
+        mask |= BITS[key]
+    return mask
+
+
+def labels_of(mask: int) -> set:
+    """Inverso di flags(): insieme di (category, label) dei bit accesi."""
+    return {key for key, bit in BITS.items() if mask & bit}
+
+
+def keywords(categories=None) -> list:
+    """Tutte le parole chiave (normalizzate) usate dalle regole delle categorie indicate."""
+    words = set()
+    for (category, _), (all_kw, any_kw) in _RULES.items():
+        if categories is None or category in categories:
+            words |= all_kw | any_kw
+    return sorted(words)
@@ -0,0 +1,162 @@
+# core/services/filters.py
+# -*- coding: utf-8 -*-
+"""
+Popolamento di CategoryMembership, usata dalle modalità di gioco.
+
+La classificazione avviene all'ingest: lo scraper salva in Charge.categories
+la maschera di bit del charge (core/services/classify.py) e, nella stessa
+transazione del batch, allinea le appartenenze dei detenuti scritti
+(sync_memberships, solo sugli id del batch).
+
+I pulsanti "filtri" ricostruiscono le categorie lato DB (rebuild): un
+INSERT ... SELECT DISTINCT per label scrive una generazione NUOVA accanto a quella
+attiva (nessuna riga passa da Python), poi CategoryGeneration.active viene spostato
+nella stessa transazione e la vecchia generazione cancellata dopo. I lettori
+(core/services/pairs.py) filtrano per generazione attiva: vedono sempre un
+insieme completo, mai tabelle vuote o a metà.
+I negativi (non-child, non-murder) non vengono salvati: sono derivati per anti-join.
+"""
+
+from django.db import connection, transaction
+from django.db.models import Count, Max, Q
+from django.utils import timezone
+
+from core.models import Inmate, Charge, CategoryMembership, CategoryGeneration
+from core.services import classify, pairs, search
+
+
+def sync_memberships(inmate_ids=None, categories=None) -> dict:
+    """
+    Allinea CategoryMembership a Charge.categories, per i detenuti indicati
+    (None => tutti) e le categorie indicate (None => tutte).
+    Ritorna {"added", "removed"}.
+    """
+    categories = set(categories or classify.CATEGORIES)
+    mask = 0
+    for (category, _), bit in classify.BITS.items():
+        if category in categories:
+            mask |= bit
+
+    generations = CategoryGeneration.active_map(categories)
+    charges = Charge.objects.filter(categories__gt=0)
+    current = CategoryMembership.objects.filter(
+        Q(*[Q(category=c, generation=g) for c, g in generations.items()], _connector=Q.OR)
+    )
+    if inmate_ids is not None:
+        inmate_ids = list(inmate_ids)
+        charges = charges.filter(inmate_id__in=inmate_ids)
+        current = current.filter(inmate_id__in=inmate_ids)
+
+    expected = set()
+    for inmate_id, flags in charges.values_list("inmate_id", "categories").iterator(chunk_size=2000):
+        if flags & mask:
+            for category, label in classify.labels_of(flags & mask):
+                expected.add((category, label, inmate_id))
+
+    stale = []
+    for pk, category, label, inmate_id in current.values_list("id", "category", "label", "inmate_id"):
+        key = (category, label, inmate_id)
+        if key in expected:
+            expected.discard(key)
+        else:
+            stale.append(pk)
+
+    with transaction.atomic():
+        for i in range(0, len(stale), 500):
+            CategoryMembership.objects.filter(id__in=stale[i:i + 500]).delete()
+        CategoryMembership.objects.bulk_create(
+            [
+                CategoryMembership(generation=generations[category], category=category,
+                                   label=label, inmate_id=inmate_id)
+                for category, label, inmate_id in expected
+            ],
+            batch_size=1000,
+            ignore_conflicts=True,      # rebuild concorrente che ha già scritto la riga
+        )
+    return {"added": len(expected), "removed": len(stale)}
+
+
+def _rebuild_category(category: str) -> int:
+    """Scrive la generazione nuova di `category` con INSERT ... SELECT e la attiva. Ritorna la generazione."""
+    active = CategoryGeneration.active_map([category])[category]
+    highest = CategoryMembership.objects.filter(category=category).aggregate(m=Max("generation"))["m"] or 0
+    new = max(active, highest) + 1      # mai riusare una generazione rimasta da un rebuild interrotto
+
+    table = CategoryMembership._meta.db_table
+    charge_table = Charge._meta.db_table
+    now = connection.ops.adapt_datetimefield_value(timezone.now())
+    sql = (
+        f"INSERT INTO {table} (generation, category, label, inmate_id, created_at) "
+        f"SELECT DISTINCT %s, %s, %s, inmate_id, %s FROM {charge_table} WHERE (categories & %s) <> 0"
+    )
+    with transaction.atomic():
+        with connection.cursor() as cursor:
+            for (cat, label), bit in classify.BITS.items():
+                if cat == category:
+                    cursor.execute(sql, [new, category, label, now, bit])
+        CategoryGeneration.objects.update_or_create(category=category, defaults={"active": new})
+    # la vecchia generazione non è più letta da nessuno
+    CategoryMembership.objects.filter(category=category).exclude(generation=new).delete()
+    return new
+
+
+def reclassify() -> int:
+    """
+    Ricalcola Charge.categories dal testo (da usare quando cambiano le regole
+    in classify.py). Ritorna quanti charges sono cambiati.
+    Rilegge solo i candidati: charges già classificati (per spegnere i bit) e
+    charges che contengono almeno una parola chiave (indice trigram, vedi search.py).
+    """
+    candidates = (
+        Charge.objects.filter(categories__gt=0),
+        search.contains_any(classify.keywords(), Charge.objects.filter(categories=0)),
+    )
+    changed = []
+    updated = 0
+    for queryset in candidates:
+        for charge in queryset.only("id", "charge", "categories").iterator(chunk_size=2000):
+            flags = classify.flags(charge.charge)
+            if flags != charge.categories:
+                charge.categories = flags
+                changed.append(charge)
+            if len(changed) >= 1000:
+                Charge.objects.bulk_update(changed, ["categories"])
+                updated += len(changed)
+                changed = []
+    if changed:
+        Charge.objects.bulk_update(changed, ["categories"])
+        updated += len(changed)
+    return updated
+
+
+def apply_filters(categories=None, full: bool = False, progress=None) -> dict:
+    """
+    Ricostruisce le categorie indicate (None => tutte) dalle maschere salvate.
+    full=True => prima riclassifica i charges dal testo.
+    progress: callable opzionale chiamato con {scanned, total} dopo ogni categoria.
+    Ritorna i conteggi per label (+ i negativi dove servono) e le generazioni attivate.
+    """
+    categories = sorted(set(categories or classify.CATEGORIES))
+    reclassified = reclassify() if full else 0
+    generations = {}
+    for category in categories:
+        generations[category] = _rebuild_category(category)
+        if progress:
+            progress({"scanned": len(generations), "total": len(categories)})
+    pairs.invalidate()
+
+    counts = {label: 0 for (category, label) in classify.RULES if category in categories}
+    active = Q(*[Q(category=c, generation=g) for c, g in generations.items()], _connector=Q.OR)
+    for row in CategoryMembership.objects.filter(active).values("label").annotate(n=Count("id")):
+        counts[row["label"]] = row["n"]
+    total = Inmate.objects.count()
+    for category in categories:
+        labels = [label for (cat, label) in classify.RULES if cat == category]
+        if len(labels) == 1:
+            # categoria a una sola label: il negativo è "tutti gli altri"
+            counts[f"non_{category}"] = total - counts[labels[0]]
+    counts["generation"] = generations
+    if full:
+        counts["reclassified"] = reclassified
+    return counts
+
@@ -0,0 +1,103 @@
+# core/services/gamestate.py
+# -*- coding: utf-8 -*-
+"""
+Stato di gioco fuori dalla sessione Django.
+
+Prima ogni click faceva leggere e riscrivere la riga di django_session; ora lo
+stato della partita (e il punteggio finale / la riga in classifica del giocatore)
+viaggia in un cookie firmato (django.core.signing, salt per chiave), quindi il
+loop di gioco legge dal DB solo i due Inmate della coppia. Il valore è
+signing.dumps (base64 url-safe): niente virgolette o virgole nel cookie, che
+client non-browser (requests, load test) altrimenti alterano.
+
+GAME_STATE_STORE:
+- "cookie" (default): il cookie contiene lo stato, JSON compatto firmato.
+  Non manomettibile ma leggibile (firmato, non cifrato): non deve contenere
+  niente che il giocatore non possa vedere (es. quale lato è quello giusto).
+  Un cookie vecchio resta valido fino a GAME_STATE_MAX_AGE: le azioni che non
+  devono essere rigiocate passano da once().
+- "cache": il cookie firmato contiene solo un token casuale, lo stato sta nella
+  cache di Django (autorevole lato server, niente replay). Ha senso solo con una
+  cache condivisa tra i worker (REDIS_URL).
+"""
+
+import secrets
+
+from django.conf import settings
+from django.core import signing
+from django.core.cache import cache
+
+_SALT = "gamehub.state."
+
+
+def _store() -> str:
+    return getattr(settings, "GAME_STATE_STORE", "cookie")
+
+
+def _max_age() -> int:
+    return getattr(settings, "GAME_STATE_MAX_AGE", 24 * 3600)
+
+
+def _cookie_name(key: str) -> str:
+    return f"gs_{key}"
+
+
+def _read_cookie(request, key: str):
+    raw = request.COOKIES.get(_cookie_name(key))
+    if not raw:
+        return None
+    try:
+        return signing.loads(raw, salt=_SALT + key, max_age=_max_age())
+    except signing.BadSignature:
+        return None
+
+
+def load(request, key: str) -> dict | None:
+    """Stato salvato sotto `key` (None se assente, scaduto o manomesso)."""
+    value = _read_cookie(request, key)
+    if value is None:
+        return None
+    if _store() == "cache":
+        return cache.get(f"gamestate:{key}:{value}") if isinstance(value, str) else None
+    return value if isinstance(value, dict) else None
+
+
+def save(request, response, key: str, value: dict | None):
+    """Scrive (o cancella, se value è None) lo stato `key` sulla risposta."""
+    name = _cookie_name(key)
+    if value is None:
+        if _store() == "cache":
+            token = _read_cookie(request, key)
+            if isinstance(token, str):
+                cache.delete(f"gamestate:{key}:{token}")
+        response.delete_cookie(name, samesite="Lax")
+        return response
+
+    if _store() == "cache":
+        token = _read_cookie(request, key)
+        if not isinstance(token, str):
+            token = secrets.token_urlsafe(12)
+        cache.set(f"gamestate:{key}:{token}", value, _max_age())
+        payload = token
+    else:
+        payload = value
+
+    response.set_cookie(
+        name, signing.dumps(payload, salt=_SALT + key, compress=True), max_age=_max_age(),
+        httponly=True, samesite="Lax",
+        secure=getattr(settings, "SESSION_COOKIE_SECURE", False),
+    )
+    return response
+
+
+def once(key: str, token: str, value):
+    """
+    Primo valore registrato per (key, token): le richieste successive con lo
+    stesso token (cookie vecchio rigiocato, doppio click) ricevono quello invece
+    di `value`. Autorevole tra i worker solo con una cache condivisa (REDIS_URL).
+    """
+    cache_key = f"gamestate:once:{key}:{token}"
+    if cache.add(cache_key, value, _max_age()):
+        return value
+    stored = cache.get(cache_key)
+    return value if stored is None else stored
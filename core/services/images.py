@@ -0,0 +1,327 @@
+# core/services/images.py
+# -*- coding: utf-8 -*-
+"""
+Cache su disco delle foto dei detenuti.
+
+Layout (sotto settings.IMAGE_CACHE_DIR):
+- blobs/ab/<sha256>.jpg   contenuto, indirizzato per hash (foto identiche => un solo file)
+- refs/<booking_number>   "<sha256> <fetched_at>" : booking -> blob
+- variants/ab/<sha256>-<variant>.<ext>   versioni ridimensionate/ricompresse (Pillow),
+                                         generate una volta sola alla prima richiesta
+
+- TTL: un ref più vecchio di IMAGE_CACHE_TTL secondi è considerato assente
+- LRU: ogni lettura aggiorna l'mtime del ref; evict() elimina i ref meno usati
+  finché blob + varianti stanno sotto IMAGE_CACHE_MAX_BYTES, poi i blob non più
+  referenziati e più vecchi di _ORPHAN_GRACE secondi (store() scrive il blob prima
+  del ref: un blob appena scritto non è ancora un orfano).
+
+Lo scraper la popola mentre ha già in mano il payload getInmateDetails;
+le pagine di gioco puntano a /img/<booking>/<variant>.<ext> invece di inlinare base64.
+Le pagine di gioco non chiamano mai netapps.ocfl.net: una foto mancante viene
+scaricata dalla vista async /img/ (get_or_fetch) quando il browser la chiede,
+solo se il booking è un detenuto noto (known(): Inmate); i booking sconosciuti restano
+in una cache negativa per _UNKNOWN_TTL secondi e non arrivano mai all'upstream.
+"""
+
+import base64
+import binascii
+import hashlib
+import os
+import re
+import tempfile
+import threading
+import time
+from pathlib import Path
+
+from django.conf import settings
+from django.core.cache import cache
+from PIL import Image, UnidentifiedImageError
+
+from core.models import Inmate
+from core.services import metrics, upstream
+
+# variante -> altezza massima in px (None = originale). h280 = altezza CSS delle pagine di gioco
+VARIANTS = {"orig": None, "h280": 280, "h560": 560}
+# estensione -> (formato Pillow, content-type, opzioni di salvataggio)
+FORMATS = {
+    "jpg":  ("JPEG", "image/jpeg", {"quality": 82, "optimize": True, "progressive": True}),
+    "webp": ("WEBP", "image/webp", {"quality": 80, "method": 4}),
+}
+
+_BOOKING_RE = re.compile(r"^[A-Za-z0-9_-]{1,20}$")
+_EVICT_EVERY = 500          # evict() opportunistico ogni N store per processo
+_ORPHAN_GRACE = 300         # secondi: blob/varianti senza ref più giovani di così restano
+_UNKNOWN_TTL = 600          # secondi di cache negativa per i booking non presenti in Inmate
+
+_lock = threading.Lock()
+_stores = 0
+
+
+def _root() -> Path:
+    return Path(getattr(settings, "IMAGE_CACHE_DIR", Path(settings.BASE_DIR) / "cache" / "images"))
+
+
+def _ttl() -> int:
+    return getattr(settings, "IMAGE_CACHE_TTL", 7 * 24 * 3600)
+
+
+def _ref_path(booking: str) -> Path | None:
+    if not _BOOKING_RE.match(booking or ""):
+        return None
+    return _root() / "refs" / booking
+
+
+def _blob_path(sha: str) -> Path:
+    return _root() / "blobs" / sha[:2] / f"{sha}.jpg"
+
+
+def _variant_path(sha: str, variant: str, ext: str) -> Path:
+    return _root() / "variants" / sha[:2] / f"{sha}-{variant}.{ext}"
+
+
+def _atomic_write(path: Path, data: bytes):
+    path.parent.mkdir(parents=True, exist_ok=True)
+    fd, tmp = tempfile.mkstemp(dir=path.parent, prefix=".tmp-")
+    try:
+        with os.fdopen(fd, "wb") as f:
+            f.write(data)
+        os.replace(tmp, path)
+    except BaseException:
+        try:
+            os.unlink(tmp)
+        except OSError:
+            pass
+        raise
+
+
+def _read_ref(booking: str) -> tuple[str, float] | None:
+    path = _ref_path(booking)
+    if path is None:
+        return None
+    try:
+        sha, fetched_at = path.read_text().split()
+        return sha, float(fetched_at)
+    except (OSError, ValueError):
+        return None
+
+
+def store(booking: str, data: bytes) -> str | None:
+    """Salva i bytes della foto per `booking`. Ritorna lo sha256 (None se non salvata)."""
+    global _stores
+    ref = _ref_path(booking)
+    if ref is None or not data:
+        return None
+
+    sha = hashlib.sha256(data).hexdigest()
+    blob = _blob_path(sha)
+    try:
+        if blob.exists():
+            os.utime(blob)          # rinfresca la grace: evict() non lo tratta da orfano
+        else:
+            _atomic_write(blob, data)
+        _atomic_write(ref, f"{sha} {time.time():.0f}".encode())
+    except OSError as e:
+        print(f"[IMAGES][ERR] store {booking}: {e}")
+        return None
+
+    with _lock:
+        _stores += 1
+        run_evict = _stores % _EVICT_EVERY == 0
+    if run_evict:
+        evict()
+    return sha
+
+
+def store_b64(booking: str, b64: str | None) -> str | None:
+    """Come store() ma parte dal campo IMAGE (base64) di getInmateDetails."""
+    if not b64:
+        return None
+    try:
+        data = base64.b64decode(b64, validate=False)
+    except (binascii.Error, ValueError):
+        return None
+    return store(booking, data)
+
+
+def lookup(booking: str) -> tuple[str, Path] | None:
+    """(sha, path del blob) se in cache e non scaduta, altrimenti None. Aggiorna l'LRU."""
+    ref = _read_ref(booking)
+    if ref is None:
+        return None
+    sha, fetched_at = ref
+    if time.time() - fetched_at > _ttl():
+        return None
+    blob = _blob_path(sha)
+    if not blob.exists():
+        return None
+    try:
+        os.utime(_ref_path(booking))
+    except OSError:
+        pass
+    return sha, blob
+
+
+def get(booking: str) -> bytes | None:
+    """Foto dalla cache (senza chiamate remote)."""
+    hit = lookup(booking)
+    if hit is None:
+        return None
+    try:
+        return hit[1].read_bytes()
+    except OSError:
+        return None
+
+
+def known(booking: str) -> bool:
+    """
+    True se `booking` è un detenuto in DB (indice unique); i negativi restano in cache.
+    Tocca il DB: dalle viste async va chiamata nel thread sync (sync_to_async di default).
+    """
+    key = f"images:unknown:{booking}"
+    if cache.get(key):
+        return False
+    if Inmate.objects.filter(booking_number=booking).exists():
+        return True
+    cache.set(key, True, _UNKNOWN_TTL)
+    return False
+
+
+def get_or_fetch(booking: str) -> bytes | None:
+    """
+    Foto dalla cache; se manca la scarica via getInmateDetails e la salva.
+    Solo per booking già verificati con known(): qui non si tocca il DB.
+    """
+    if _ref_path(booking) is None:
+        return None
+    data = get(booking)
+    if data is not None:
+        return data
+    # import locale: scraper importa questo modulo
+    from core.services.scraper import fetch_inmate_details
+
+    details = fetch_inmate_details(booking)
+    b64 = details.get("IMAGE", "") or details.get("Image", "")
+    if not b64 or store_b64(booking, b64) is None:
+        return None
+    return get(booking)
+
+
+def _render_variant(src: Path, dst: Path, variant: str, ext: str):
+    fmt, _, options = FORMATS[ext]
+    height = VARIANTS[variant]
+    with Image.open(src) as img:
+        img = img.convert("RGB")
+        if height and img.height > height:
+            width = max(round(img.width * height / img.height), 1)
+            img = img.resize((width, height), Image.LANCZOS)
+        tmp = dst.with_name(f".tmp-{os.getpid()}-{threading.get_ident()}-{dst.name}")
+        dst.parent.mkdir(parents=True, exist_ok=True)
+        try:
+            img.save(tmp, fmt, **options)
+            os.replace(tmp, dst)
+        finally:
+            tmp.unlink(missing_ok=True)
+
+
+def get_variant(booking: str, variant: str = "orig", ext: str = "jpg", fetch: bool = True) -> tuple[str, Path] | None:
+    """
+    (sha, path) della foto nella variante richiesta; la genera e la salva se manca.
+    fetch=True => se la foto non è in cache la scarica (getInmateDetails): passarlo
+    solo per booking noti (known()), altrimenti ogni URL inventato va all'upstream.
+    """
+    if variant not in VARIANTS or ext not in FORMATS:
+        return None
+    hit = lookup(booking)
+    metrics.cache_result("images", hit is not None)
+    if hit is None and fetch and get_or_fetch(booking) is not None:
+        hit = lookup(booking)
+    if hit is None:
+        return None
+
+    sha, blob = hit
+    if variant == "orig" and ext == "jpg":
+        return sha, blob
+    path = _variant_path(sha, variant, ext)
+    if not path.exists():
+        try:
+            _render_variant(blob, path, variant, ext)
+        except (OSError, UnidentifiedImageError) as e:
+            print(f"[IMAGES][ERR] variant {booking} {variant}.{ext}: {e}")
+            return None
+    return sha, path
+
+
+def _size_mtime(path: Path) -> tuple[int, float] | None:
+    try:
+        st = path.stat()
+    except OSError:
+        return None
+    return st.st_size, st.st_mtime
+
+
+def evict(max_bytes: int | None = None) -> dict:
+    """
+    Elimina ref scaduti, poi i meno usati finché blob + varianti stanno sotto
+    `max_bytes`, poi blob e varianti orfani più vecchi di _ORPHAN_GRACE secondi.
+    """
+    if max_bytes is None:
+        max_bytes = getattr(settings, "IMAGE_CACHE_MAX_BYTES", 512 * 1024 * 1024)
+    root = _root()
+    now = time.time()
+    ttl = _ttl()
+
+    refs = []                       # (mtime, path, sha)
+    removed_refs = 0
+    for path in (root / "refs").glob("*"):
+        try:
+            sha, fetched_at = path.read_text().split()
+            mtime = path.stat().st_mtime
+        except (OSError, ValueError):
+            continue
+        if now - float(fetched_at) > ttl:
+            path.unlink(missing_ok=True)
+            removed_refs += 1
+            continue
+        refs.append((mtime, path, sha))
+
+    sizes = {}                      # sha -> byte di blob + varianti
+    mtimes = {}                     # sha -> mtime del blob
+    for blob in (root / "blobs").glob("*/*.jpg"):
+        info = _size_mtime(blob)
+        if info:
+            sizes[blob.stem], mtimes[blob.stem] = info
+    variants = []                   # (path, sha, mtime)
+    for path in (root / "variants").glob("*/*"):
+        info = _size_mtime(path)
+        if info is None or path.name.startswith(".tmp-"):
+            continue
+        sha = path.name.split("-", 1)[0]
+        sizes[sha] = sizes.get(sha, 0) + info[0]
+        variants.append((path, sha, info[1]))
+
+    live = {sha for _, _, sha in refs}
+    total = sum(size for sha, size in sizes.items() if sha in live)
+    refs.sort()                     # meno usati prima
+    refcount = {}
+    for _, _, sha in refs:
+        refcount[sha] = refcount.get(sha, 0) + 1
+    for _, path, sha in refs:
+        if total <= max_bytes:
+            break
+        path.unlink(missing_ok=True)
+        removed_refs += 1
+        refcount[sha] -= 1
+        if refcount[sha] == 0:
+            live.discard(sha)
+            total -= sizes.get(sha, 0)
+
+    removed_blobs = 0
+    for sha, mtime in mtimes.items():
+        if sha not in live and now - mtime > _ORPHAN_GRACE:
+            _blob_path(sha).unlink(missing_ok=True)
+            removed_blobs += 1
+    for path, sha, mtime in variants:
+        if sha not in live and now - mtime > _ORPHAN_GRACE:
+            path.unlink(missing_ok=True)
+
+    return {"refs_removed": removed_refs, "blobs_removed": removed_blobs, "bytes": total}
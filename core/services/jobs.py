@@ -0,0 +1,176 @@
+# core/services/jobs.py
+# -*- coding: utf-8 -*-
+"""
+Coda di job locale, appoggiata alla tabella core.Job (nessun broker esterno).
+
+- enqueue(kind, params)  -> le view admin accodano e rispondono subito
+- run_worker()           -> loop eseguito da `python manage.py run_jobs`
+- un solo job attivo per tipo (vincolo core_job_one_active_per_kind)
+- un job 'running' senza heartbeat da JOBS_STALE_AFTER secondi è considerato
+  orfano (worker morto) e viene rimesso in coda: lo scrape riparte dal
+  checkpoint (ultimo filtro completato + ScrapeItem già scritti).
+  L'heartbeat lo scrive un thread del _Reporter ogni JOBS_STALE_AFTER/3 secondi
+  per tutta la durata dell'handler, anche nelle fasi che non riportano progresso
+  (listing, rebuild dei filtri): un job vivo non viene mai dato a un secondo worker.
+"""
+
+import threading
+import time
+import traceback
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import IntegrityError, close_old_connections, connection, transaction
+from django.db.models import F
+from django.utils import timezone
+
+from core.models import Inmate, Charge, Job
+from core.services.filters import apply_filters
+from core.services.scraper import run_scrape
+
+ACTIVE = (Job.QUEUED, Job.RUNNING)
+
+
+def _stale_after() -> timedelta:
+    return timedelta(seconds=getattr(settings, "JOBS_STALE_AFTER", 300))
+
+
+def enqueue(kind: str, params: dict | None = None) -> tuple[Job, bool]:
+    """Accoda un job. Se ne esiste già uno attivo dello stesso tipo ritorna quello (created=False)."""
+    try:
+        with transaction.atomic():
+            return Job.objects.create(kind=kind, params=params or {}), True
+    except IntegrityError:
+        return Job.objects.filter(kind=kind, status__in=ACTIVE).first(), False
+
+
+def requeue_stale() -> int:
+    """Rimette in coda i job rimasti 'running' dopo un crash del worker."""
+    cutoff = timezone.now() - _stale_after()
+    return Job.objects.filter(status=Job.RUNNING, heartbeat_at__lt=cutoff).update(status=Job.QUEUED)
+
+
+def claim_next() -> Job | None:
+    """Prende il job in coda più vecchio (compare-and-set su status, sicuro con più worker)."""
+    for pk in Job.objects.filter(status=Job.QUEUED).order_by("created_at").values_list("pk", flat=True):
+        now = timezone.now()
+        claimed = Job.objects.filter(pk=pk, status=Job.QUEUED).update(
+            status=Job.RUNNING, started_at=now, heartbeat_at=now, attempts=F("attempts") + 1,
+        )
+        if claimed:
+            return Job.objects.get(pk=pk)
+    return None
+
+
+class _Reporter:
+    """
+    Callback di progresso: salva job.progress + heartbeat al massimo ogni `every` secondi.
+    Come context manager tiene vivo l'heartbeat da un thread ogni `heartbeat` secondi.
+    """
+
+    def __init__(self, job: Job, every: float = 2.0, heartbeat: float | None = None):
+        self.job = job
+        self.every = every
+        self.heartbeat = heartbeat or max(_stale_after().total_seconds() / 3, 1.0)
+        self._last = 0.0
+        self._stop = threading.Event()
+        self._thread = None
+
+    def __enter__(self):
+        self._thread = threading.Thread(target=self._beat, name=f"job-{self.job.pk}-heartbeat", daemon=True)
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        self._stop.set()
+        self._thread.join()
+
+    def _beat(self):
+        try:
+            while not self._stop.wait(self.heartbeat):
+                try:
+                    Job.objects.filter(pk=self.job.pk).update(heartbeat_at=timezone.now())
+                except Exception as e:
+                    print(f"[JOBS][ERR] heartbeat {self.job}: {e}")
+        finally:
+            connection.close()          # connessione di questo thread
+
+    def __call__(self, data: dict, force: bool = False):
+        self.job.progress = {**self.job.progress, **data}
+        now = time.monotonic()
+        if not force and now - self._last < self.every:
+            return
+        self._last = now
+        Job.objects.filter(pk=self.job.pk).update(progress=self.job.progress, heartbeat_at=timezone.now())
+
+
+# ========== HANDLER ==========
+def _scrape(job: Job, report: _Reporter) -> dict:
+    params = job.params
+    if params.get("reset"):
+        Inmate.objects.all().delete()
+        Charge.objects.all().delete()
+        # checkpoint: se il job viene ripreso dopo un crash non si azzera di nuovo il DB
+        job.params = {**params, "reset": False}
+        Job.objects.filter(pk=job.pk).update(params=job.params)
+
+    return run_scrape(
+        filters=params.get("filters"),
+        limit=params.get("limit"),
+        verbose=True,
+        incremental=True,
+        recheck=bool(params.get("recheck")),
+        progress=report,
+        checkpoint=job,
+    )
+
+
+HANDLERS = {
+    "scrape": _scrape,
+    "filters": lambda job, report: apply_filters(job.params.get("categories") or None, progress=report),
+}
+
+
+def run_job(job: Job):
+    report = _Reporter(job)
+    try:
+        with report:
+            result = HANDLERS[job.kind](job, report)
+    except Exception:
+        print(f"[JOBS][ERR] {job}:\n{traceback.format_exc()}")
+        Job.objects.filter(pk=job.pk).update(
+            status=Job.FAILED, error=traceback.format_exc(), finished_at=timezone.now(),
+        )
+        return
+    report({}, force=True)
+    Job.objects.filter(pk=job.pk).update(
+        status=Job.DONE, result=result or {}, error="", finished_at=timezone.now(),
+    )
+
+
+def run_worker(poll: float = 2.0, once: bool = False, verbose: bool = True):
+    """Loop del worker. once=True => esegue i job in coda ed esce."""
+    while True:
+        close_old_connections()
+        requeue_stale()
+        job = claim_next()
+        if job:
+            if verbose:
+                print(f"[JOBS] start {job}")
+            run_job(job)
+            if verbose:
+                print(f"[JOBS] end {Job.objects.get(pk=job.pk)}")
+            continue
+        if once:
+            return
+        time.sleep(poll)
+
+
+def eta_seconds(job: Job) -> int | None:
+    """Stima del tempo rimanente in base a scanned/total e al tempo trascorso."""
+    total = job.progress.get("total")
+    done = job.progress.get("scanned") or 0
+    if job.status != Job.RUNNING or not total or not done or not job.started_at:
+        return None
+    elapsed = (timezone.now() - job.started_at).total_seconds()
+    return int(elapsed / done * max(total - done, 0))
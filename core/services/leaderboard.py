@@ -0,0 +1,374 @@
+# core/services/leaderboard.py
+# -*- coding: utf-8 -*-
+"""
+Classifiche per modalità.
+
+- top(mode): le prime TOP_N righe, materializzate nella cache di Django
+  (chiave "leaderboard:<mode>"); la query usa l'indice (mode, -score, created_at).
+- submit(): salva la riga e PATCHA la lista in cache (inserimento ordinato +
+  taglio a TOP_N) invece di invalidarla, così sotto molti submit la pagina non
+  torna mai a interrogare il DB. Il read-modify-write è serializzato da un lock
+  in cache (cache.add, condiviso tra i worker con Redis); se il lock non si
+  ottiene la lista viene cancellata e ricaricata alla prossima lettura.
+- rank_of(): posizione di un punteggio con un COUNT sull'indice, senza scorrere la tabella.
+- LEADERBOARD_BUFFERED=True: submit() non scrive subito ma accoda (write-behind);
+  un thread svuota la coda con UN bulk_create ogni LEADERBOARD_FLUSH_EVERY righe o
+  LEADERBOARD_FLUSH_MS millisecondi. Ogni riga accodata è prima appesa a un file di
+  spool (LEADERBOARD_SPOOL_DIR/<pid>-<token>-<n>.jsonl, token casuale per istanza):
+  flush all'uscita del processo (atexit) e, se il processo muore, lo spool viene
+  riletto dal prossimo processo (at-least-once: dopo un crash una riga può
+  comparire due volte, mai zero). Un'istanza è viva finché tiene il flock su
+  <pid>-<token>.lock, quindi un pid riusato dopo un riavvio non nasconde gli
+  spool del processo morto (senza fcntl, es. Windows: controllo del pid).
+  Se il bulk_create fallisce lo spool .flushing resta su disco e il thread lo
+  riprova ai tick successivi con backoff esponenziale (fino a RETRY_MAX secondi).
+  La riga del giocatore resta visibile subito grazie a with_own() (sessione).
+
+Ordine = quello di LeaderboardEntry.Meta.ordering: score decrescente, a parità vince il più vecchio.
+"""
+
+import atexit
+import itertools
+import json
+import os
+import secrets
+import threading
+import time
+from datetime import datetime
+from pathlib import Path
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import connection
+from django.db.models import Q
+from django.utils import timezone
+
+from core.models import LeaderboardEntry
+from core.services import metrics
+
+try:
+    import fcntl
+except ImportError:         # Windows: si ripiega sul controllo del pid
+    fcntl = None
+
+TOP_N = 50
+FIELDS = ("id", "name", "score", "mode", "created_at")
+LOCK_TIMEOUT = 5        # secondi: scadenza del lock se il processo muore mentre lo tiene
+LOCK_TRIES = 20         # tentativi da 10ms prima di rinunciare e invalidare
+RETRY_MAX = 60          # secondi: backoff massimo tra due tentativi su uno spool fallito
+
+
+def _key(mode: str) -> str:
+    return f"leaderboard:{mode}"
+
+
+def _ttl() -> int:
+    return getattr(settings, "LEADERBOARD_CACHE_TTL", 300)
+
+
+def _row(entry: LeaderboardEntry) -> dict:
+    return {field: getattr(entry, field) for field in FIELDS}
+
+
+def _sort_key(row: dict):
+    return (-row["score"], row["created_at"], row["id"])
+
+
+def top(mode: str) -> list[dict]:
+    """Prime TOP_N righe della modalità (dict con FIELDS), dalla cache se presente."""
+    rows = cache.get(_key(mode))
+    metrics.cache_result("leaderboard", rows is not None)
+    if rows is None:
+        rows = list(LeaderboardEntry.objects.filter(mode=mode).values(*FIELDS)[:TOP_N])
+        cache.set(_key(mode), rows, _ttl())
+    return rows
+
+
+def add_to_top(entries):
+    """Inserisce righe già salvate nelle liste in cache delle loro modalità."""
+    by_mode = {}
+    for entry in entries:
+        by_mode.setdefault(entry.mode, []).append(_row(entry))
+    for mode, new_rows in by_mode.items():
+        _patch_top(mode, new_rows)
+
+
+def _patch_top(mode: str, new_rows: list[dict]):
+    key, lock = _key(mode), f"{_key(mode)}:lock"
+    token = secrets.token_hex(8)
+    for _ in range(LOCK_TRIES):
+        if cache.add(lock, token, LOCK_TIMEOUT):
+            break
+        time.sleep(0.01)
+    else:
+        cache.delete(key)               # niente lock: meglio una lettura dal DB che una lista senza la riga
+        return
+    try:
+        rows = cache.get(key)
+        if rows is None:
+            return                      # verrà ricaricata alla prossima lettura
+        if len(rows) >= TOP_N and all(_sort_key(r) > _sort_key(rows[-1]) for r in new_rows):
+            return                      # nessuna entra in classifica
+        cache.set(key, sorted(rows + new_rows, key=_sort_key)[:TOP_N], _ttl())
+    finally:
+        if cache.get(lock) == token:
+            cache.delete(lock)
+
+
+def submit(name: str, score: int, mode: str) -> LeaderboardEntry:
+    """
+    Registra un punteggio. In modalità buffered la riga ritornata NON è ancora
+    salvata (pk None): verrà scritta dal prossimo flush.
+    """
+    entry = LeaderboardEntry(name=name or "Anonimo", score=score, mode=mode, created_at=timezone.now())
+    if getattr(settings, "LEADERBOARD_BUFFERED", False):
+        _buffer().add(entry)
+    else:
+        entry.save()
+        add_to_top([entry])
+    return entry
+
+
+def own_entry(entry: LeaderboardEntry) -> dict:
+    """Riferimento alla riga del giocatore da tenere in sessione (serializzabile)."""
+    return {"mode": entry.mode, "name": entry.name, "score": entry.score,
+            "created_at": entry.created_at.isoformat()}
+
+
+def with_own(rows: list[dict], own: dict | None, mode: str) -> list[dict]:
+    """
+    Copia di rows con is_own=True sulla riga del giocatore; se la riga non è
+    ancora nel DB (buffer non svuotato) ma entrerebbe in classifica, la inserisce.
+    """
+    rows = [dict(row, is_own=False) for row in rows]
+    if not own or own.get("mode") != mode:
+        return rows
+    try:
+        mine = {"id": None, "name": own["name"], "score": int(own["score"]), "mode": own["mode"],
+                "created_at": datetime.fromisoformat(own["created_at"]), "is_own": True}
+    except (KeyError, TypeError, ValueError):
+        return rows
+    for row in rows:
+        if (row["name"], row["score"], row["created_at"]) == (mine["name"], mine["score"], mine["created_at"]):
+            row["is_own"] = True
+            return rows
+    mine["id"] = 0
+    return sorted(rows + [mine], key=_sort_key)[:TOP_N]
+
+
+def rank_of(mode: str, score: int, created_at=None) -> int:
+    """
+    Posizione (1 = primo) di un punteggio nella modalità.
+    Con created_at conta anche le righe a pari punteggio più vecchie (la posizione di una riga salvata);
+    senza, la posizione che un nuovo punteggio otterrebbe adesso.
+    """
+    ahead = Q(score__gt=score)
+    if created_at is None:
+        ahead |= Q(score=score)
+    else:
+        ahead |= Q(score=score, created_at__lt=created_at)
+    return LeaderboardEntry.objects.filter(ahead, mode=mode).count() + 1
+
+
+def total(mode: str) -> int:
+    return LeaderboardEntry.objects.filter(mode=mode).count()
+
+
+# ---------- write-behind (LEADERBOARD_BUFFERED) ----------
+
+def _entry_to_line(entry: LeaderboardEntry) -> str:
+    return json.dumps({"name": entry.name, "score": entry.score, "mode": entry.mode,
+                       "created_at": entry.created_at.isoformat()}) + "\n"
+
+
+def _entry_from_line(line: str) -> LeaderboardEntry | None:
+    try:
+        data = json.loads(line)
+        return LeaderboardEntry(name=data["name"], score=int(data["score"]), mode=data["mode"],
+                                created_at=datetime.fromisoformat(data["created_at"]))
+    except (KeyError, TypeError, ValueError):
+        return None             # riga troncata da un crash a metà scrittura
+
+
+def _pid_alive(pid: int) -> bool:
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except OSError:
+        return True
+    return True
+
+
+class _Buffer:
+    """
+    Coda in-process + spool su disco. Tutte le scritture DB avvengono in flush().
+    Spool: <owner>-<n>.jsonl in scrittura (owner = "<pid>-<token>" dell'istanza);
+    al flush viene rinominato .flushing e cancellato solo dopo il bulk_create riuscito.
+    Un .flushing rimasto (bulk_create fallito) viene riprovato da tick() con backoff.
+    """
+
+    def __init__(self, spool_dir: Path, flush_every: int, flush_ms: int):
+        self.spool_dir = spool_dir
+        self.flush_every = max(int(flush_every), 1)
+        self.flush_ms = max(int(flush_ms), 10)
+        self.pid = os.getpid()
+        self.owner = f"{self.pid}-{secrets.token_hex(4)}"
+        self._lock = threading.Lock()           # coda + file di spool corrente
+        self._flush_lock = threading.Lock()     # un solo flush alla volta
+        self._pending: list[LeaderboardEntry] = []
+        self._counter = itertools.count()
+        self._spool = None
+        self._wake = threading.Event()
+        self._retry_at = None                   # monotonic del prossimo tentativo (None = niente da riprovare)
+        self._backoff = 0.0
+        self.spool_dir.mkdir(parents=True, exist_ok=True)
+        self._owner_lock = self._hold_owner_lock()
+        self._thread = threading.Thread(target=self._run, name="leaderboard-flush", daemon=True)
+        self._thread.start()
+        atexit.register(self.flush)
+
+    def _hold_owner_lock(self):
+        """flock tenuto per tutta la vita dell'istanza: il kernel lo rilascia quando il processo muore."""
+        if fcntl is None:
+            return None
+        handle = open(self.spool_dir / f"{self.owner}.lock", "w")
+        fcntl.flock(handle, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        return handle
+
+    def _owner_alive(self, owner: str) -> bool:
+        if owner == self.owner:
+            return True
+        try:
+            pid = int(owner.split("-", 1)[0])
+        except ValueError:
+            return True                         # file estraneo: non si tocca
+        lock_path = self.spool_dir / f"{owner}.lock"
+        if fcntl is None or "-" not in owner:
+            # senza flock (o spool nel vecchio formato <pid>-<n>): lo stesso pid
+            # con un altro owner è un processo precedente, quindi morto
+            return pid != self.pid and _pid_alive(pid)
+        try:
+            handle = open(lock_path, "r+")
+        except FileNotFoundError:
+            return False
+        with handle:
+            try:
+                # condiviso: due processi che controllano lo stesso owner non si vedono "vivi" a vicenda
+                fcntl.flock(handle, fcntl.LOCK_SH | fcntl.LOCK_NB)
+            except OSError:
+                return True
+            fcntl.flock(handle, fcntl.LOCK_UN)
+        return False
+
+    def _spool_path(self, suffix: str = "jsonl") -> Path:
+        return self.spool_dir / f"{self.owner}-{next(self._counter)}.{suffix}"
+
+    def add(self, entry: LeaderboardEntry):
+        with self._lock:
+            if self._spool is None:
+                self._spool = open(self._spool_path(), "a", encoding="utf-8")
+            self._spool.write(_entry_to_line(entry))
+            self._spool.flush()
+            self._pending.append(entry)
+            full = len(self._pending) >= self.flush_every
+        if full:
+            self._wake.set()
+
+    def _run(self):
+        self.recover()
+        while True:
+            self._wake.wait(self.flush_ms / 1000)
+            self._wake.clear()
+            try:
+                self.tick()
+            except Exception as e:
+                print(f"[LEADERBOARD][ERR] flush: {e}")
+            finally:
+                connection.close()      # connessione di questo thread
+
+    def tick(self) -> int:
+        """Un giro del thread: flush della coda e, se è ora, nuovo tentativo sugli spool falliti."""
+        written = self.flush()
+        if self._retry_at is not None and time.monotonic() >= self._retry_at:
+            self._retry_at = None
+            written += self.recover()
+        return written
+
+    def flush(self) -> int:
+        """Scrive le righe in coda con un bulk_create. Ritorna quante."""
+        with self._flush_lock:
+            with self._lock:
+                entries, self._pending = self._pending, []
+                spool, self._spool = self._spool, None
+            if spool is None:
+                return 0
+            spool.close()
+            claimed = Path(spool.name).with_suffix(".flushing")
+            os.replace(spool.name, claimed)
+            return self._write(entries, claimed)
+
+    def _write(self, entries, spool_file: Path) -> int:
+        try:
+            LeaderboardEntry.objects.bulk_create(entries, batch_size=500)
+        except Exception as e:
+            # lo spool resta su disco: lo riprova tick() dopo il backoff
+            self._backoff = min(max(self._backoff * 2, self.flush_ms / 1000), RETRY_MAX)
+            self._retry_at = time.monotonic() + self._backoff
+            print(f"[LEADERBOARD][ERR] bulk_create di {len(entries)} righe (nuovo tentativo tra {self._backoff:.1f}s): {e}")
+            return 0
+        self._backoff = 0.0
+        spool_file.unlink(missing_ok=True)
+        add_to_top(entries)
+        return len(entries)
+
+    def recover(self) -> int:
+        """Riscrive gli spool rimasti da istanze morte (o da flush falliti di questa)."""
+        written = 0
+        alive = {}
+        for path in sorted(self.spool_dir.glob("*-*.*")):
+            if path.suffix == ".lock":
+                continue
+            owner = path.stem.rsplit("-", 1)[0]
+            if owner not in alive:
+                alive[owner] = self._owner_alive(owner)
+            mine = owner == self.owner
+            if (mine and path.suffix != ".flushing") or (not mine and alive[owner]):
+                continue
+            # sotto _flush_lock: un .flushing di questa istanza non è quello di un flush in corso
+            with self._flush_lock:
+                claimed = self._spool_path("flushing")
+                try:
+                    os.replace(path, claimed)   # un solo processo vince il rename
+                except FileNotFoundError:
+                    continue
+                lines = claimed.read_text(encoding="utf-8").splitlines()
+                entries = [e for e in map(_entry_from_line, lines) if e is not None]
+                written += self._write(entries, claimed) if entries else 0
+                if not entries:
+                    claimed.unlink(missing_ok=True)
+        for path in self.spool_dir.glob("*.lock"):
+            if path.stem != self.owner and not self._owner_alive(path.stem):
+                path.unlink(missing_ok=True)
+        return written
+
+
+_buffer_instance: _Buffer | None = None
+_buffer_lock = threading.Lock()
+
+
+def _buffer() -> _Buffer:
+    global _buffer_instance
+    with _buffer_lock:
+        if _buffer_instance is None or _buffer_instance.pid != os.getpid():
+            _buffer_instance = _Buffer(
+                Path(getattr(settings, "LEADERBOARD_SPOOL_DIR", Path(settings.BASE_DIR) / "cache" / "leaderboard")),
+                getattr(settings, "LEADERBOARD_FLUSH_EVERY", 50),
+                getattr(settings, "LEADERBOARD_FLUSH_MS", 1000),
+            )
+    return _buffer_instance
+
+
+def flush() -> int:
+    """Svuota subito la coda del processo corrente (no-op se non buffered)."""
+    return _buffer_instance.flush() if _buffer_instance is not None else 0
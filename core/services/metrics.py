@@ -0,0 +1,253 @@
+# core/services/metrics.py
+# -*- coding: utf-8 -*-
+"""
+Metriche leggere per richiesta e per processo.
+
+- Fasi della richiesta (db, session, render, upstream): il middleware
+  (core/middleware.py) apre un contesto con begin(); il codice misurato usa
+  phase("nome") o add_phase(). Il contesto vive in una ContextVar, quindi segue
+  la richiesta anche dentro sync_to_async / async_to_sync (vista async delle
+  foto). Le fasi finiscono nell'header Server-Timing e negli istogrammi.
+- Registro per processo: istogrammi (durata per vista, per fase, per endpoint
+  upstream) e contatori (hit/miss delle cache). render() li esporta in formato
+  testo Prometheus per la vista /metrics/. Con più worker gunicorn ogni processo
+  ha il suo registro: Prometheus vede il worker che risponde (come prometheus_client
+  senza multiprocess mode).
+- Avanzamento di scrape e filtri: letto dalla tabella Job al momento dell'export,
+  perché i job girano in un altro processo (manage.py run_jobs).
+
+Costo: un perf_counter e un lock breve per osservazione; METRICS_ENABLED=False
+spegne tutto (le funzioni diventano no-op).
+"""
+
+import bisect
+import threading
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+from urllib.parse import urlsplit
+
+from django.conf import settings
+from django.template.backends.django import DjangoTemplates
+
+from core.models import Job
+
+BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+HELP = {
+    "gamehub_request_seconds": ("histogram", "Durata delle richieste per vista."),
+    "gamehub_request_phase_seconds": ("histogram", "Tempo per fase (db, session, render, upstream) e vista."),
+    "gamehub_db_queries": ("histogram", "Query SQL per richiesta e vista."),
+    "gamehub_upstream_seconds": ("histogram", "Durata delle chiamate a netapps.ocfl.net per endpoint ed esito."),
+    "gamehub_cache_requests_total": ("counter", "Letture di cache per cache e risultato (hit/miss)."),
+}
+# istogrammi con bucket diversi dai secondi
+_BUCKETS_BY_NAME = {"gamehub_db_queries": (1, 2, 3, 5, 10, 20, 50, 100)}
+
+_lock = threading.Lock()
+_series: dict[str, dict[tuple, list]] = {}
+_current: ContextVar["Timings | None"] = ContextVar("gamehub_timings", default=None)
+
+
+def enabled() -> bool:
+    return getattr(settings, "METRICS_ENABLED", True)
+
+
+class Timings:
+    """Fasi della richiesta corrente: nome -> [secondi, conteggio]."""
+
+    __slots__ = ("started", "phases", "_lock")
+
+    def __init__(self):
+        self.started = time.perf_counter()
+        self.phases: dict[str, list] = {}
+        self._lock = threading.Lock()
+
+    def add(self, name: str, seconds: float, count: int = 1):
+        with self._lock:
+            slot = self.phases.setdefault(name, [0.0, 0])
+            slot[0] += seconds
+            slot[1] += count
+
+    def elapsed(self) -> float:
+        return time.perf_counter() - self.started
+
+
+def begin() -> tuple["Timings", object]:
+    """Apre il contesto di misura della richiesta. Ritorna (timings, token per end())."""
+    timings = Timings()
+    return timings, _current.set(timings)
+
+
+def end(token):
+    _current.reset(token)
+
+
+def current() -> Timings | None:
+    return _current.get()
+
+
+def add_phase(name: str, seconds: float, count: int = 1):
+    timings = _current.get()
+    if timings is not None:
+        timings.add(name, seconds, count)
+
+
+@contextmanager
+def phase(name: str):
+    """Cronometra il blocco come fase `name` della richiesta corrente (se c'è)."""
+    if _current.get() is None:
+        yield
+        return
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        add_phase(name, time.perf_counter() - started)
+
+
+# ---- registro --------------------------------------------------------------
+
+def _labels_key(labels: dict) -> tuple:
+    return tuple(sorted(labels.items()))
+
+
+def observe(name: str, value: float, **labels):
+    """Aggiunge `value` all'istogramma `name` con le label indicate."""
+    if not enabled():
+        return
+    buckets = _BUCKETS_BY_NAME.get(name, BUCKETS)
+    key = _labels_key(labels)
+    with _lock:
+        series = _series.setdefault(name, {})
+        hist = series.get(key)
+        if hist is None:
+            hist = series[key] = [[0] * (len(buckets) + 1), 0.0, 0]     # conteggi per bucket, somma, totale
+        hist[0][bisect.bisect_left(buckets, value)] += 1
+        hist[1] += value
+        hist[2] += 1
+
+
+def inc(name: str, amount: float = 1, **labels):
+    if not enabled():
+        return
+    key = _labels_key(labels)
+    with _lock:
+        series = _series.setdefault(name, {})
+        series[key] = series.get(key, 0) + amount
+
+
+def cache_result(cache_name: str, hit: bool, count: int = 1):
+    if count:
+        inc("gamehub_cache_requests_total", count, cache=cache_name, result="hit" if hit else "miss")
+
+
+def upstream_endpoint(url: str) -> str:
+    """'.../getInmateDetails/123' -> 'getInmateDetails' (mai il booking: cardinalità limitata)."""
+    parts = [p for p in urlsplit(url).path.split("/") if p]
+    return parts[-2] if len(parts) >= 2 else "other"
+
+
+def observe_upstream(source: str, url: str, seconds: float, outcome: str):
+    """Una chiamata upstream: istogramma per endpoint ed esito + fase 'upstream' della richiesta."""
+    add_phase("upstream", seconds)
+    observe("gamehub_upstream_seconds", seconds, source=source, endpoint=upstream_endpoint(url), outcome=outcome)
+
+
+def reset():
+    with _lock:
+        _series.clear()
+
+
+# ---- export ----------------------------------------------------------------
+
+def _escape(value) -> str:
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _fmt_labels(key: tuple, extra: tuple = ()) -> str:
+    items = list(key) + list(extra)
+    if not items:
+        return ""
+    return "{" + ",".join(f'{k}="{_escape(v)}"' for k, v in items) + "}"
+
+
+def _fmt_number(value) -> str:
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+def _job_lines() -> list[str]:
+    """Avanzamento dei job dalla tabella Job (scrape / filtri, scritti dal worker)."""
+    lines = [
+        "# HELP gamehub_jobs Job per tipo e stato.",
+        "# TYPE gamehub_jobs gauge",
+    ]
+    counts = {}
+    for kind, status in Job.objects.values_list("kind", "status"):
+        counts[(kind, status)] = counts.get((kind, status), 0) + 1
+    for (kind, status), n in sorted(counts.items()):
+        lines.append(f'gamehub_jobs{{kind="{_escape(kind)}",status="{_escape(status)}"}} {n}')
+
+    lines += [
+        "# HELP gamehub_job_progress Avanzamento dei job in esecuzione (campi di Job.progress).",
+        "# TYPE gamehub_job_progress gauge",
+    ]
+    for job_id, kind, progress in Job.objects.filter(status=Job.RUNNING).values_list("id", "kind", "progress"):
+        for field, value in sorted((progress or {}).items()):
+            if isinstance(value, (int, float)) and not isinstance(value, bool):
+                lines.append(f'gamehub_job_progress{{job="{job_id}",kind="{_escape(kind)}",'
+                             f'field="{_escape(field)}"}} {_fmt_number(value)}')
+    return lines
+
+
+def render() -> str:
+    """Tutte le metriche del processo in formato testo Prometheus (0.0.4)."""
+    with _lock:
+        snapshot = {name: {k: (v if not isinstance(v, list) else [list(v[0]), v[1], v[2]])
+                           for k, v in series.items()}
+                    for name, series in _series.items()}
+
+    lines = []
+    for name, (kind, help_text) in HELP.items():
+        series = snapshot.get(name, {})
+        lines += [f"# HELP {name} {help_text}", f"# TYPE {name} {kind}"]
+        for key, value in sorted(series.items()):
+            if kind == "histogram":
+                counts, total, count = value
+                buckets = _BUCKETS_BY_NAME.get(name, BUCKETS)
+                cumulative = 0
+                for bound, n in zip(buckets, counts):
+                    cumulative += n
+                    lines.append(f"{name}_bucket{_fmt_labels(key, (('le', bound),))} {cumulative}")
+                lines.append(f"{name}_bucket{_fmt_labels(key, (('le', '+Inf'),))} {count}")
+                lines.append(f"{name}_sum{_fmt_labels(key)} {_fmt_number(total)}")
+                lines.append(f"{name}_count{_fmt_labels(key)} {count}")
+            else:
+                lines.append(f"{name}{_fmt_labels(key)} {_fmt_number(value)}")
+    lines += _job_lines()
+    return "\n".join(lines) + "\n"
+
+
+# ---- template ----------------------------------------------------------------
+
+class _TimedTemplate:
+    def __init__(self, template):
+        self.template = template
+        self.origin = getattr(template, "origin", None)
+
+    def render(self, context=None, request=None):
+        with phase("render"):
+            return self.template.render(context, request)
+
+    def __getattr__(self, name):
+        return getattr(self.template, name)
+
+
+class TimedDjangoTemplates(DjangoTemplates):
+    """Backend TEMPLATES: come DjangoTemplates, con il render contato nella fase 'render'."""
+
+    def from_string(self, template_code):
+        return _TimedTemplate(super().from_string(template_code))
+
+    def get_template(self, template_name):
+        return _TimedTemplate(super().get_template(template_name))
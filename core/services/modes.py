@@ -0,0 +1,217 @@
+# core/services/modes.py
+# -*- coding: utf-8 -*-
+"""
+Motore unico delle modalità di gioco.
+
+Ogni modalità è una voce del registro MODES: quale categoria è la risposta
+giusta (positive), contro quale categoria viene mostrata (negative), testi e
+regole di punteggio. View, URL e template sono generici (mode/<key>/...),
+quindi una nuova modalità = una nuova register(Mode(...)) qui sotto. Se usa una
+categoria nuova basta aggiungerla a classify.RULES/BITS: il job "filters" e i
+pulsanti Filtra prendono le categorie da lì, le choices di LeaderboardEntry.mode
+da questo registro (nessuna migrazione).
+
+positive/negative sono sorgenti di core/services/pairs.py: (category, label)
+di CategoryMembership, oppure (category, None) = chi non è nella categoria.
+Lo stato della partita sta in un cookie firmato (core/services/gamestate.py)
+sotto "game_<key>": {"id", "lives", "streak", "score", "mult", "seq", "pair"}.
+Il cookie è leggibile dal giocatore: "pair" contiene solo gli id dei due
+detenuti, il lato giusto si ricava lato server in answer(). L'esito di ogni
+round è registrato con gamestate.once() su (id partita, numero del round), così
+rigiocare un cookie precedente alla risposta non cambia il risultato.
+"""
+
+import random
+import secrets
+
+from core.models import Inmate
+from core.services import gamestate, pairs
+
+# (streak minima, moltiplicatore), dalla più alta
+DEFAULT_MULTIPLIERS = ((15, 10), (10, 4), (5, 2))
+
+
+class Mode:
+    def __init__(
+        self,
+        key: str,
+        title: str,
+        positive: tuple,
+        negative: tuple,
+        prompt: str,
+        description: str = "",
+        icon: str = "",
+        positive_label: str = "",
+        negative_label: str = "",
+        lives: int = 3,
+        max_lives: int = 5,
+        life_every: int = 5,
+        multipliers=DEFAULT_MULTIPLIERS,
+    ):
+        self.key = key
+        self.title = title
+        self.positive = positive            # categoria da indovinare
+        self.negative = negative            # categoria "distrattore"
+        self.prompt = prompt                # es. "Scegli il <strong>murderer</strong>." (HTML)
+        self.description = description
+        self.icon = icon
+        self.positive_label = positive_label or positive[1]
+        self.negative_label = negative_label or f"non-{negative[0]}"
+        self.lives = lives                  # vite iniziali
+        self.max_lives = max_lives          # tetto per le vite bonus
+        self.life_every = life_every        # +1 vita ogni N risposte giuste di fila
+        self.multipliers = multipliers
+
+    def __repr__(self):
+        return f"Mode({self.key!r})"
+
+    @property
+    def state_key(self) -> str:
+        return f"game_{self.key}"
+
+    # ----- punteggio -----
+    def multiplier(self, streak: int) -> int:
+        for min_streak, mult in self.multipliers:
+            if streak >= min_streak:
+                return mult
+        return 1
+
+    # ----- stato partita -----
+    def new_game(self) -> dict:
+        return {"id": secrets.token_urlsafe(8), "lives": self.lives, "streak": 0, "score": 0, "mult": 1,
+                "seq": None, "pair": None}
+
+    def next_pair(self, game: dict):
+        """
+        Estrae la prossima coppia e la registra in game["pair"].
+        Ritorna (left, right) oppure None se una delle due liste è esaurita.
+        """
+        pos, neg, game["seq"] = pairs.pick_pair(self.positive, self.negative, game.get("seq"))
+        return self._set_pair(game, pos, neg)
+
+    def next_pair_ahead(self, game: dict):
+        """
+        Come next_pair, ma carica nella stessa query anche i detenuti della coppia
+        successiva. Ritorna ((left, right) | None, upcoming).
+        """
+        pos, neg, game["seq"], upcoming = pairs.pick_pair_ahead(self.positive, self.negative, game.get("seq"))
+        return self._set_pair(game, pos, neg), upcoming
+
+    def _set_pair(self, game: dict, pos, neg):
+        if not pos or not neg:
+            return None
+        left, right = (pos, neg) if random.choice([True, False]) else (neg, pos)
+        game["pair"] = {"left_id": left.id, "right_id": right.id}
+        return left, right
+
+    def current_pair(self, game: dict):
+        """(left, right) della coppia già estratta e non ancora risposta, altrimenti None."""
+        pair = game.get("pair")
+        if not pair:
+            return None
+        found = Inmate.objects.in_bulk([pair["left_id"], pair["right_id"]])
+        if pair["left_id"] not in found or pair["right_id"] not in found:
+            return None
+        return found[pair["left_id"]], found[pair["right_id"]]
+
+    def peek(self, game: dict) -> list[int]:
+        """Id dei detenuti della coppia successiva (vuota se non ce n'è un'altra)."""
+        ids = pairs.peek(self.positive, self.negative, game.get("seq"))
+        return list(ids) if ids else []
+
+    def _positive_id(self, pair: dict, seq: str | None) -> int | None:
+        """Id del detenuto 'giusto' della coppia: dalla sequenza (O(1)), altrimenti da CategoryMembership."""
+        left, right = pair.get("left_id"), pair.get("right_id")
+        drawn = pairs.last_drawn(self.positive, self.negative, seq)
+        if drawn and {drawn[0], drawn[1]} == {left, right}:
+            return drawn[0]
+        # pool ricaricati dopo l'estrazione (filtri rieseguiti)
+        if left is not None and pairs.is_member(self.positive, left):
+            return left
+        return right
+
+    def answer(self, game: dict, side: str) -> bool:
+        """
+        Applica la risposta alla coppia corrente. Ritorna True se corretta.
+        Lo stesso round risposto di nuovo (cookie rigiocato) ha l'esito della prima risposta.
+        """
+        pair = game.get("pair") or {}
+        round_token = f"{game.setdefault('id', secrets.token_urlsafe(8))}:{pairs.drawn(game.get('seq'))}"
+        is_correct = side in ("left", "right") and pair.get(f"{side}_id") == self._positive_id(pair, game.get("seq"))
+        game["pair"] = None
+
+        lives, streak, score = game["lives"], game["streak"], game["score"]
+        if is_correct:
+            streak += 1
+            score += 1 * self.multiplier(streak)
+            if streak % self.life_every == 0 and lives < self.max_lives:
+                lives += 1
+        else:
+            lives = max(lives - 1, 0)
+            streak = 0
+
+        game.update(lives=lives, streak=streak, score=score, mult=self.multiplier(streak))
+        outcome = gamestate.once(self.state_key, round_token, {"game": game, "correct": bool(is_correct)})
+        if outcome["game"] is not game:         # round già risposto: vale lo stato registrato allora
+            game.clear()
+            game.update(outcome["game"])
+        return outcome["correct"]
+
+    def rounds_played(self, game: dict) -> int:
+        return pairs.drawn(game.get("seq"))
+
+    def counts(self) -> dict:
+        return {
+            "positive": len(pairs.get_pool(self.positive).ids),
+            "negative": len(pairs.get_pool(self.negative).ids),
+        }
+
+
+MODES: dict[str, Mode] = {}
+
+
+def register(mode: Mode) -> Mode:
+    MODES[mode.key] = mode
+    return mode
+
+
+def get_mode(key: str) -> Mode | None:
+    return MODES.get(key)
+
+
+register(Mode(
+    key="child",
+    title="Child vs Non-Child",
+    positive=("child", "child_abuse"),
+    negative=("child", None),
+    prompt="Scegli il <strong>child-abuser</strong>.",
+    description="Vengono mostrate due foto: una è un child-abuser, l’altra no. "
+                "Seleziona quella corretta, costruisci la streak e moltiplica il punteggio!",
+    icon="👦",
+    positive_label="Child abuse",
+    negative_label="Non-child",
+))
+
+register(Mode(
+    key="murder",
+    title="Murder vs Non-Murder",
+    positive=("murder", "murder"),
+    negative=("murder", None),
+    prompt="Scegli il <strong>murderer</strong>.",
+    description="Indovina chi è accusato di omicidio. Vite, streak e moltiplicatori come nella Child vs Non-Child",
+    icon="🩸",
+    positive_label="Murder",
+    negative_label="Non-murder",
+))
+
+register(Mode(
+    key="drugs",
+    title="Cannabis vs Cocaine/Fentanyl",
+    positive=("drugs", "cannabis"),
+    negative=("drugs", "cocaine_fentanyl"),
+    prompt="Scegli chi è il <strong>cannabis user</strong>.",
+    description="Cannabis o cocaina/fentanyl? Indovina il capo d'accusa dalla foto.",
+    icon="💊",
+    positive_label="Cannabis",
+    negative_label="Cocaine/Fentanyl",
+))
@@ -0,0 +1,216 @@
+# core/services/pairs.py
+# -*- coding: utf-8 -*-
+"""
+Pool di id per sorgente, per estrarre le coppie delle modalità di gioco in O(1).
+
+Una sorgente è una tupla (category, label) di CategoryMembership;
+(category, None) = i detenuti SENZA righe per quella categoria (anti-join).
+Si legge sempre la generazione attiva della categoria (CategoryGeneration):
+durante un rebuild i pool vedono la generazione precedente, completa.
+
+- Ogni processo tiene in memoria, per sorgente, la lista degli inmate_id
+  permutata in modo deterministico (seed = hash del contenuto): tutti i worker
+  gunicorn vedono la stessa permutazione per gli stessi dati.
+- La sessione non tiene più la lista degli id visti ma una stringa di
+  dimensione costante "seed:n:vpos:vneg" (seed casuale della partita, coppie già
+  estratte, versioni dei due pool). Da seed e categoria si ricava una permutazione
+  affine  i -> (start + i * stride) % N  (gcd(stride, N) == 1), quindi la n-esima
+  coppia si calcola in O(1) senza mai ripetere un id; la partita finisce quando
+  n == N per una delle due liste.
+- Il pool si ricarica dopo PAIR_POOL_TTL secondi o quando i filtri vengono
+  rieseguiti (invalidate(); la chiave di generazione nella cache di Django
+  propaga l'invalidazione agli altri processi se la cache è condivisa).
+"""
+
+import hashlib
+import math
+import random
+import threading
+import time
+
+from django.conf import settings
+from django.core.cache import cache
+
+from django.db.models import Exists, OuterRef
+
+from core.models import Inmate, CategoryMembership, CategoryGeneration
+from core.services import metrics
+
+_GEN_KEY = "pairs:generation"
+
+_lock = threading.Lock()
+_pools: dict[tuple, "_Pool"] = {}
+
+
+class _Pool:
+    __slots__ = ("ids", "version", "generation", "loaded_at")
+
+    def __init__(self, ids, version, generation):
+        self.ids = ids
+        self.version = version
+        self.generation = generation
+        self.loaded_at = time.monotonic()
+
+
+def source_ids(source: tuple):
+    """Queryset (flat) degli inmate_id di una sorgente (category, label|None)."""
+    category, label = source
+    generation = CategoryGeneration.active_map([category])[category]
+    members = CategoryMembership.objects.filter(generation=generation, category=category)
+    if label is None:
+        members = members.filter(inmate=OuterRef("pk"))
+        return Inmate.objects.filter(~Exists(members)).values_list("id", flat=True)
+    return members.filter(label=label).values_list("inmate_id", flat=True)
+
+
+def _load(source: tuple, generation) -> _Pool:
+    ids = sorted(source_ids(source))
+    version = hashlib.blake2b(",".join(map(str, ids)).encode(), digest_size=4).hexdigest()
+    random.Random(version).shuffle(ids)
+    return _Pool(ids, version, generation)
+
+
+def get_pool(source: tuple) -> _Pool:
+    ttl = getattr(settings, "PAIR_POOL_TTL", 60)
+    generation = cache.get(_GEN_KEY, 0)
+    with _lock:
+        pool = _pools.get(source)
+        stale = pool is None or pool.generation != generation or time.monotonic() - pool.loaded_at > ttl
+        if stale:
+            pool = _pools[source] = _load(source, generation)
+    metrics.cache_result("pairs", not stale)
+    return pool
+
+
+def invalidate():
+    """Da chiamare quando le tabelle indice cambiano (filtri rieseguiti)."""
+    with _lock:
+        _pools.clear()
+    try:
+        cache.incr(_GEN_KEY)
+    except ValueError:
+        cache.set(_GEN_KEY, 1, None)
+
+
+def _mix(seed: int, source: tuple) -> int:
+    digest = hashlib.blake2b(f"{seed}:{source[0]}:{source[1]}".encode(), digest_size=8).digest()
+    return int.from_bytes(digest, "big")
+
+
+def _position(seed: int, source: tuple, n: int, size: int) -> int:
+    """n-esimo indice della permutazione affine della partita su [0, size)."""
+    h = _mix(seed, source)
+    start = h % size
+    stride = (h >> 32) % size or 1
+    while math.gcd(stride, size) != 1:
+        stride += 1
+    return (start + n * stride) % size
+
+
+def new_sequence(pos_source: tuple, neg_source: tuple) -> str:
+    """Stato iniziale compatto della partita: 'seed:n:vpos:vneg'."""
+    seed = random.getrandbits(32)
+    return f"{seed:x}:0:{get_pool(pos_source).version}:{get_pool(neg_source).version}"
+
+
+def drawn(seq: str | None) -> int:
+    """Quante coppie sono già state estratte nella partita."""
+    try:
+        return int((seq or "").split(":")[1])
+    except (IndexError, ValueError):
+        return 0
+
+
+def peek(pos_source: tuple, neg_source: tuple, seq: str | None) -> tuple[int, int] | None:
+    """
+    Id (positivo, negativo) della coppia che pick_pair estrarrebbe dopo `seq`,
+    senza avanzare la sequenza né toccare il DB (per il prefetch delle immagini).
+    """
+    pos_pool, neg_pool = get_pool(pos_source), get_pool(neg_source)
+    try:
+        seed_hex, n, v_pos, v_neg = (seq or "").split(":")
+        seed, n = int(seed_hex, 16), int(n)
+    except ValueError:
+        return None
+    if v_pos != pos_pool.version or v_neg != neg_pool.version:
+        return None
+    if n >= len(pos_pool.ids) or n >= len(neg_pool.ids):
+        return None
+    return (pos_pool.ids[_position(seed, pos_source, n, len(pos_pool.ids))],
+            neg_pool.ids[_position(seed, neg_source, n, len(neg_pool.ids))])
+
+
+def last_drawn(pos_source: tuple, neg_source: tuple, seq: str | None) -> tuple[int, int] | None:
+    """
+    Id (positivo, negativo) dell'ultima coppia estratta con `seq`, senza DB.
+    None se non è stata estratta nessuna coppia o i pool sono cambiati da allora.
+    """
+    pos_pool, neg_pool = get_pool(pos_source), get_pool(neg_source)
+    try:
+        seed_hex, n, v_pos, v_neg = (seq or "").split(":")
+        seed, n = int(seed_hex, 16), int(n) - 1
+    except ValueError:
+        return None
+    if v_pos != pos_pool.version or v_neg != neg_pool.version:
+        return None
+    if n < 0 or n >= len(pos_pool.ids) or n >= len(neg_pool.ids):
+        return None
+    return (pos_pool.ids[_position(seed, pos_source, n, len(pos_pool.ids))],
+            neg_pool.ids[_position(seed, neg_source, n, len(neg_pool.ids))])
+
+
+def is_member(source: tuple, inmate_id: int) -> bool:
+    """True se il detenuto appartiene alla sorgente nella generazione attiva (una query)."""
+    category, label = source
+    generation = CategoryGeneration.active_map([category])[category]
+    members = CategoryMembership.objects.filter(generation=generation, category=category, inmate_id=inmate_id)
+    if label is None:
+        return not members.exists()
+    return members.filter(label=label).exists()
+
+
+def pick_pair(pos_source: tuple, neg_source: tuple, seq: str | None):
+    """
+    Prossima coppia (positivo, negativo) non ancora vista, con UNA query (in_bulk).
+    Ritorna (pos, neg, nuova_seq); (None, None, seq) se una delle due liste è esaurita.
+    """
+    pos, neg, seq, _ = pick_pair_ahead(pos_source, neg_source, seq, lookahead=False)
+    return pos, neg, seq
+
+
+def pick_pair_ahead(pos_source: tuple, neg_source: tuple, seq: str | None, lookahead: bool = True):
+    """
+    Come pick_pair, ma la stessa query carica anche la coppia successiva (quella
+    che peek() darebbe dopo la nuova seq), per il prefetch delle immagini.
+    Ritorna (pos, neg, nuova_seq, upcoming): upcoming = lista di Inmate, vuota se
+    non c'è un'altra coppia.
+    """
+    for _ in range(2):
+        pos_pool, neg_pool = get_pool(pos_source), get_pool(neg_source)
+        try:
+            seed_hex, n, v_pos, v_neg = (seq or "").split(":")
+            seed, n = int(seed_hex, 16), int(n)
+        except ValueError:
+            v_pos = None
+        if v_pos != pos_pool.version or v_neg != neg_pool.version:
+            # partita nuova o dati cambiati dall'inizio della partita: si riparte
+            seq = new_sequence(pos_source, neg_source)
+            seed_hex, n, v_pos, v_neg = seq.split(":")
+            seed, n = int(seed_hex, 16), int(n)
+
+        if n >= len(pos_pool.ids) or n >= len(neg_pool.ids):
+            return None, None, seq, []
+        pos_id = pos_pool.ids[_position(seed, pos_source, n, len(pos_pool.ids))]
+        neg_id = neg_pool.ids[_position(seed, neg_source, n, len(neg_pool.ids))]
+        upcoming_ids = []
+        if lookahead and n + 1 < len(pos_pool.ids) and n + 1 < len(neg_pool.ids):
+            upcoming_ids = [pos_pool.ids[_position(seed, pos_source, n + 1, len(pos_pool.ids))],
+                            neg_pool.ids[_position(seed, neg_source, n + 1, len(neg_pool.ids))]]
+
+        found = Inmate.objects.in_bulk([pos_id, neg_id, *upcoming_ids])
+        if pos_id in found and neg_id in found:
+            upcoming = [found[i] for i in upcoming_ids if i in found]
+            return found[pos_id], found[neg_id], f"{seed:x}:{n + 1}:{v_pos}:{v_neg}", upcoming
+        # id non più presenti (DB aggiornato nel frattempo): ricarica e riprova
+        invalidate()
+    return None, None, seq, []
@@ -0,0 +1,255 @@
+# core/services/replay.py
+# -*- coding: utf-8 -*-
+"""
+Replay locale delle API BestJail, per misurare lo scraper senza toccare netapps.ocfl.net.
+
+Fixture (JSON, una lista di detenuti con le risposte registrate):
+
+    {"inmates": [
+        {"bookingNumber": "2025014879",
+         "inmateName": "ABDELAZIZ, AHMIR",
+         "details": {"BIRTH": "29", "IMAGE": ""},
+         "charges": [{"Charge": "DISORDERLY CONDUCT", "BondAmount": "1500.00",
+                      "CourtCaseNumber": "2023CF0017", "CourtLocation": "", "Note": ""}]}
+    ]}
+
+- from_captures(): costruisce una fixture dalle catture salvate nel repo
+  (debug_search.html per booking/nomi/età, descriptions/*.txt per i testi dei charges);
+- scale(): porta la fixture a N detenuti clonandola con booking nuovi;
+- ReplayServer: ThreadingHTTPServer che risponde a getInmates/{filtro},
+  getInmateDetails/{bk} e getCharges/{bk} con latenza, tasso di errori (503)
+  e dimensione della foto configurabili. Usato da `manage.py bench_scrape`.
+
+getInmates/{filtro} restituisce i detenuti con almeno una parola del nome che
+inizia per il filtro: come sull'API vera, lo stesso booking compare sotto più lettere.
+"""
+
+import base64
+import json
+import random
+import re
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+
+# charges aggiunti a quelli catturati, così la classificazione ha qualcosa da trovare
+EXTRA_CHARGES = [
+    "MURDER 1ST DEGREE",
+    "CHILD ABUSE",
+    "POSS CANNABIS OVER 20 GRAMS",
+    "TRAFFICKING FENTANYL",
+    "POSS COCAINE",
+    "DRIVING WHILE LICENSE SUSPENDED",
+    "BATTERY",
+    "PETIT THEFT",
+]
+
+_ROW = re.compile(
+    r'<td class="UnderLine[^"]*"[^>]*>\s*(\d+)\s*</td>.*?'
+    r'<td[^>]*>([^<,]+,[^<]*)</td><td[^>]*>\d{2}/\d{4}</td><td[^>]*>(\d+)</td>',
+    re.S,
+)
+
+
+def load(path) -> list[dict]:
+    with open(path, encoding="utf-8") as f:
+        return json.load(f)["inmates"]
+
+
+def dump(inmates: list[dict], path):
+    with open(path, "w", encoding="utf-8") as f:
+        json.dump({"inmates": inmates}, f, ensure_ascii=False, indent=1)
+
+
+def _capture_charges(base_dir: Path) -> list[str]:
+    """Testi dei charges dalle catture descriptions/*.txt (blocco dopo l'intestazione Case#Charge...)."""
+    found = []
+    for path in sorted((base_dir / "descriptions").glob("*.txt")):
+        text = path.read_text(encoding="utf-8", errors="replace")
+        if "Case#Charge" not in text:
+            continue
+        block = text.split("Case#Charge", 1)[1].split("Hold Reason", 1)[0]
+        for line in block.splitlines()[1:]:
+            line = line.strip()
+            # salta la riga di tabella concatenata e gli articoli di legge (es. 973.055(1)(b))
+            if line and not line[0].isdigit() and line.upper() not in found:
+                found.append(line.upper())
+    return found
+
+
+def from_captures(base_dir, seed: int = 0) -> list[dict]:
+    """Fixture dalle catture salvate (debug_search.html + descriptions/*.txt) in `base_dir`."""
+    base_dir = Path(base_dir)
+    rng = random.Random(seed)
+    pool = _capture_charges(base_dir) + EXTRA_CHARGES
+
+    search = base_dir / "debug_search.html"
+    rows = _ROW.findall(search.read_text(encoding="utf-8", errors="replace")) if search.exists() else []
+    inmates = []
+    seen = set()
+    for booking, name, age in rows:
+        if booking in seen:
+            continue
+        seen.add(booking)
+        last, first = [x.strip() for x in name.split(",", 1)]
+        inmates.append({
+            "bookingNumber": booking,
+            "inmateName": f"{last}, {first}".upper(),
+            "details": {"BIRTH": age, "IMAGE": ""},
+            "charges": [
+                {"Charge": c, "BondAmount": f"{rng.choice([0, 500, 1500, 5000])}.00",
+                 "CourtCaseNumber": f"{booking[:4]}CF{rng.randint(1, 9999):06d}",
+                 "CourtLocation": "", "Note": ""}
+                for c in rng.sample(pool, rng.randint(1, min(4, len(pool))))
+            ],
+        })
+    return inmates
+
+
+def scale(inmates: list[dict], size: int) -> list[dict]:
+    """Ritorna esattamente `size` detenuti; oltre la fixture si clonano con booking nuovi."""
+    if not inmates or size <= len(inmates):
+        return inmates[:size] if size else inmates
+    out = list(inmates)
+    n = 0
+    while len(out) < size:
+        src = inmates[n % len(inmates)]
+        out.append({**src, "bookingNumber": f"{src['bookingNumber']}-{n // len(inmates) + 1}"})
+        n += 1
+    return out
+
+
+class ReplayServer:
+    """
+    Stand-in HTTP delle API BestJail su 127.0.0.1 (porta libera).
+
+    - latency: secondi di attesa per richiesta (+ jitter uniforme in [0, jitter]);
+    - error_rate: probabilità [0..1] che una richiesta risponda 503;
+    - image_bytes: dimensione della foto (base64 in IMAGE) restituita da getInmateDetails;
+    - fill_missing: risponde anche per booking assenti dalla fixture (details con
+      la sola foto, charges vuoti): serve da stub delle foto per dataset sintetici.
+    Contatori: requests, errors, bytes_sent.
+    """
+
+    def __init__(self, inmates: list[dict], latency: float = 0.0, jitter: float = 0.0,
+                 error_rate: float = 0.0, image_bytes: int = 0, seed: int | None = None,
+                 fill_missing: bool = False):
+        self.inmates = {i["bookingNumber"]: i for i in inmates}
+        self.fill_missing = fill_missing
+        self.latency = latency
+        self.jitter = jitter
+        self.error_rate = error_rate
+        self.image_bytes = image_bytes
+        self._rng = random.Random(seed)
+        self._lock = threading.Lock()
+        self._images: dict[str, str] = {}
+        self._httpd = None
+        self._thread = None
+        self.reset()
+
+    def reset(self):
+        with self._lock:
+            self.requests = 0
+            self.errors = 0
+            self.bytes_sent = 0
+
+    @property
+    def base_url(self) -> str:
+        host, port = self._httpd.server_address[:2]
+        return f"http://{host}:{port}/BestJail/Home/"
+
+    def start(self) -> str:
+        self._httpd = ThreadingHTTPServer(("127.0.0.1", 0), self._handler())
+        self._httpd.daemon_threads = True
+        self._thread = threading.Thread(target=self._httpd.serve_forever, daemon=True)
+        self._thread.start()
+        return self.base_url
+
+    def stop(self):
+        if self._httpd:
+            self._httpd.shutdown()
+            self._httpd.server_close()
+            self._httpd = None
+
+    def __enter__(self):
+        self.start()
+        return self
+
+    def __exit__(self, *exc):
+        self.stop()
+
+    # ---- risposte ----------------------------------------------------------
+
+    def _image(self, booking: str) -> str:
+        if not self.image_bytes:
+            return ""
+        with self._lock:
+            if booking not in self._images:
+                data = random.Random(booking).randbytes(self.image_bytes)
+                self._images[booking] = base64.b64encode(data).decode("ascii")
+            return self._images[booking]
+
+    def respond(self, kind: str, arg: str):
+        """(status, payload) per l'endpoint `kind` con argomento `arg`."""
+        if kind == "getInmates":
+            flt = arg.lower()
+            return 200, [
+                {"bookingNumber": i["bookingNumber"], "inmateName": i["inmateName"]}
+                for i in self.inmates.values()
+                if any(w.startswith(flt) for w in re.split(r"[\s,]+", i["inmateName"].lower()))
+            ]
+        inmate = self.inmates.get(arg)
+        if inmate is None and self.fill_missing:
+            inmate = {"bookingNumber": arg, "details": {}, "charges": []}
+        if kind == "getInmateDetails":
+            if inmate is None:
+                return 200, []
+            return 200, [{**inmate.get("details", {}), "IMAGE": self._image(arg)}]
+        if kind == "getCharges":
+            return 200, inmate.get("charges", []) if inmate else []
+        return 404, {"error": "endpoint sconosciuto"}
+
+    def _handler(self):
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"      # keep-alive, come l'IIS vero
+            # header e body partono con due write: con Nagle attivo la seconda aspetta
+            # l'ACK ritardato del client (~40ms a richiesta su connessione keep-alive)
+            disable_nagle_algorithm = True
+
+            def do_POST(self):
+                length = int(self.headers.get("Content-Length") or 0)
+                if length:
+                    self.rfile.read(length)
+                parts = [p for p in self.path.split("?", 1)[0].split("/") if p]
+                kind, arg = (parts[-2], parts[-1]) if len(parts) >= 2 else ("", "")
+
+                with server._lock:
+                    server.requests += 1
+                    fail = server._rng.random() < server.error_rate
+                    delay = server.latency + (server._rng.uniform(0, server.jitter) if server.jitter else 0)
+                if delay:
+                    time.sleep(delay)
+
+                if fail:
+                    status, payload = 503, {"error": "replay: errore simulato"}
+                else:
+                    status, payload = server.respond(kind, arg)
+                body = json.dumps(payload).encode("utf-8")
+                with server._lock:
+                    server.bytes_sent += len(body)
+                    if status >= 400:
+                        server.errors += 1
+
+                self.send_response(status)
+                self.send_header("Content-Type", "application/json; charset=utf-8")
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, *args):
+                pass
+
+        return Handler
@@ -7,20 +7,42 @@ Scraper per https://netapps.ocfl.net/BestJail/
 - getInmateDetails/{bk}    -> nome, età, immagine (base64 nel campo "IMAGE")
 - getCharges/{bk}          -> lista charges (salvati su tabella Charge, FK → Inmate)
 
-⚠️ NOTA: Le immagini non vengono più salvate su disco o DB.
-         Quando servono, si ottengono live via fetch_inmate_details().
+⚠️ NOTA: Le immagini non vengono salvate nel DB ma nella cache su disco
+         (core/services/images.py), popolata qui mentre abbiamo già il payload
+         getInmateDetails; se mancano si ottengono live via fetch_inmate_details().
+
+Pipeline concorrente:
+- la ricerca per filtro resta sequenziale (poche chiamate) e produce un
+  listing deduplicato: ogni booking viene scaricato una volta sola;
+- details + charges di ogni booking vengono scaricati da un pool di thread
+  (SCRAPER_WORKERS) con un rate limit per host (SCRAPER_RATE_LIMIT req/s);
+- tutte le scritture ORM avvengono nel thread chiamante (unico writer),
+  così il DB non vede mai scritture concorrenti.
 """
 
+import hashlib
+import json
+import random
 import re
 import string
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, FIRST_COMPLETED, wait
+from email.utils import parsedate_to_datetime
+from urllib.parse import urlsplit
+
 import requests
 from django.conf import settings
-from core.models import Inmate, Charge
+from django.db import transaction
+from django.db.models import F
+from core.models import Inmate, Charge, ScrapeItem
+from core.services import classify, images, metrics, pairs, upstream
+from core.services.filters import sync_memberships
 
-BASE = "https://netapps.ocfl.net/BestJail/Home/"
-URL_SEARCH   = BASE + "getInmates/{}"
-URL_DETAILS  = BASE + "getInmateDetails/{}"
-URL_CHARGES  = BASE + "getCharges/{}"
+BASE = "https://netapps.ocfl.net/BestJail/Home/"      # default di settings.SCRAPER_BASE_URL
+URL_SEARCH   = "getInmates/{}"
+URL_DETAILS  = "getInmateDetails/{}"
+URL_CHARGES  = "getCharges/{}"
 
 HEADERS = {
     "User-Agent": "Mozilla/5.0",
@@ -31,6 +53,41 @@ HEADERS = {
     "Content-Type": "application/x-www-form-urlencoded; charset=UTF-8",
 }
 TIMEOUT = 30
+# risposte per cui vale la pena ritentare (rate limit / errori transitori del server)
+RETRY_STATUSES = {429, 500, 502, 503, 504}
+
+
+def endpoint(template: str, value) -> str:
+    """URL completo di un endpoint (es. endpoint(URL_CHARGES, bk)) sotto SCRAPER_BASE_URL."""
+    base = getattr(settings, "SCRAPER_BASE_URL", "") or BASE
+    return base.rstrip("/") + "/" + template.format(value)
+
+
+class _RateLimiter:
+    """Limita le richieste per host a `rate` req/s (None/0 => nessun limite)."""
+
+    def __init__(self, rate: float | None):
+        self.interval = 1.0 / rate if rate else 0.0
+        self._lock = threading.Lock()
+        self._next_at: dict[str, float] = {}
+
+    def wait(self, url: str):
+        if not self.interval:
+            return
+        host = urlsplit(url).netloc
+        with self._lock:
+            now = time.monotonic()
+            at = max(now, self._next_at.get(host, now))
+            self._next_at[host] = at + self.interval
+        if at > now:
+            time.sleep(at - now)
+
+    def pause(self, url: str, seconds: float):
+        """Nessuna richiesta verso l'host di `url` per `seconds` (es. 429 + Retry-After)."""
+        host = urlsplit(url).netloc
+        with self._lock:
+            until = time.monotonic() + seconds
+            self._next_at[host] = max(self._next_at.get(host, 0.0), until)
 
 
 def _split_name(inmate_name: str):
@@ -50,39 +107,376 @@ def _split_name(inmate_name: str):
     return first, last
 
 
-def _fetch_json(session: requests.Session, url: str):
-    """Effettua una POST vuota e ritorna JSON."""
-    r = session.post(url, data="{}", timeout=TIMEOUT)
-    r.raise_for_status()
-    return r.json()
+def _retry_after(resp) -> float | None:
+    """Secondi indicati dall'header Retry-After (numero o data HTTP), None se assente."""
+    value = (resp.headers or {}).get("Retry-After")
+    if not value:
+        return None
+    try:
+        return max(float(value), 0.0)
+    except ValueError:
+        pass
+    try:
+        return max(parsedate_to_datetime(value).timestamp() - time.time(), 0.0)
+    except (TypeError, ValueError):
+        return None
+
+
+def _backoff(attempt: int) -> float:
+    """Backoff esponenziale con full jitter: uniforme in [0, min(max, base * 2^attempt)]."""
+    base = getattr(settings, "SCRAPER_RETRY_BASE", 0.5)
+    cap = getattr(settings, "SCRAPER_RETRY_MAX_WAIT", 30)
+    return random.uniform(0, min(cap, base * 2 ** attempt))
+
+
+def _fetch_json(session: requests.Session, url: str, limiter: _RateLimiter | None = None, retries: int | None = None):
+    """
+    Effettua una POST vuota e ritorna JSON.
+    Errori di rete, timeout e risposte RETRY_STATUSES vengono ritentati fino a
+    `retries` volte (None => settings.SCRAPER_RETRIES) con backoff + jitter;
+    su 429/503 con Retry-After si aspetta quanto chiesto dal server e si rallenta
+    l'intero host (tutti i worker). Esauriti i tentativi l'eccezione risale.
+    """
+    if retries is None:
+        retries = getattr(settings, "SCRAPER_RETRIES", 4)
+    cap = getattr(settings, "SCRAPER_RETRY_MAX_WAIT", 30)
+    for attempt in range(retries + 1):
+        if limiter:
+            limiter.wait(url)
+        started = time.perf_counter()
+        try:
+            r = session.post(url, data="{}", timeout=TIMEOUT)
+        except (requests.ConnectionError, requests.Timeout):
+            metrics.observe_upstream("scraper", url, time.perf_counter() - started, "error")
+            if attempt >= retries:
+                raise
+            time.sleep(_backoff(attempt))
+            continue
+        metrics.observe_upstream("scraper", url, time.perf_counter() - started, str(r.status_code))
+
+        if r.status_code in RETRY_STATUSES and attempt < retries:
+            delay = _backoff(attempt)
+            after = _retry_after(r)
+            if after is not None:
+                delay = min(max(delay, after), cap)
+                if limiter:
+                    limiter.pause(url, delay)
+            time.sleep(delay)
+            continue
+        r.raise_for_status()
+        return r.json()
 
 
 def fetch_inmate_details(booking_number: str) -> dict:
     """
     Ritorna i dettagli dell'inmate come JSON (incluso il campo IMAGE in base64).
+    Usata live dalle pagine (foto mancanti): client condiviso con timeout brevi
+    e circuit breaker (core/services/upstream.py).
     """
     try:
-        resp = requests.post(URL_DETAILS.format(booking_number), data="{}", headers=HEADERS, timeout=TIMEOUT)
-        resp.raise_for_status()
-        data = resp.json()
+        data = upstream.post_json(endpoint(URL_DETAILS, booking_number))
         return data[0] if isinstance(data, list) and data else {}
+    except upstream.CircuitOpen:
+        return {}
     except Exception as e:
         print(f"[SCRAPER][ERR] fetch_inmate_details {booking_number}: {e}")
         return {}
 
 
+def _new_session() -> requests.Session:
+    session = requests.Session()
+    session.headers.update(HEADERS)
+    return session
+
+
+def _parse_age(det0: dict):
+    birth_field = det0.get("BIRTH")
+    try:
+        return int(str(birth_field).strip()) if birth_field not in (None, "", "NULL") else None
+    except Exception:
+        return None
+
+
+def _fetch_booking(local: threading.local, limiter: _RateLimiter, booking: str):
+    """
+    Eseguito nei worker: scarica details + charges di un booking.
+    Nessun accesso al DB qui dentro. Un errore (dopo i retry di _fetch_json)
+    risale: il booking finisce nella coda dei falliti invece di essere salvato a metà.
+    """
+    session = getattr(local, "session", None)
+    if session is None:
+        session = local.session = _new_session()
+
+    # --- Dettagli (per età)
+    det = _fetch_json(session, endpoint(URL_DETAILS, booking), limiter)
+    det0 = det[0] if isinstance(det, list) and det else {}
+
+    # --- Charges
+    charges = _fetch_json(session, endpoint(URL_CHARGES, booking), limiter)
+
+    images.store_b64(booking, det0.get("IMAGE") or det0.get("Image"))
+    return det0, charges
+
+
+def _recheck_booking(local: threading.local, limiter: _RateLimiter, booking: str, old_hash: str):
+    """
+    Eseguito nei worker (modalità incrementale): riscarica solo i charges.
+    Ritorna None se l'hash del payload non è cambiato, altrimenti (det0, charges).
+    """
+    session = getattr(local, "session", None)
+    if session is None:
+        session = local.session = _new_session()
+
+    charges = _fetch_json(session, endpoint(URL_CHARGES, booking), limiter)
+    if old_hash and _charges_hash(charges) == old_hash:
+        return None
+
+    det = _fetch_json(session, endpoint(URL_DETAILS, booking), limiter)
+    det0 = det[0] if isinstance(det, list) and det else {}
+    images.store_b64(booking, det0.get("IMAGE") or det0.get("Image"))
+    return det0, charges
+
+
+def _charges_hash(charges) -> str:
+    """Hash stabile del payload getCharges (per capire se è cambiato)."""
+    payload = json.dumps(charges, sort_keys=True, separators=(",", ":"), default=str)
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+
+def _build_charges(charges, charge_filter_contains):
+    """Normalizza il payload getCharges in una lista di dict pronti per Charge(...)."""
+    rows = []
+    for ch in charges:
+        desc   = (ch.get("Charge") or "").strip()
+        if not desc:
+            continue
+        if charge_filter_contains:
+            if charge_filter_contains.upper() not in desc.upper():
+                continue
+
+        rows.append({
+            "charge":            desc,
+            "bond_amount":       (ch.get("BondAmount") or "").strip(),
+            "court_case_number": (ch.get("CourtCaseNumber") or "").strip(),
+            "court_location":    (ch.get("CourtLocation") or "").strip(),
+            "note":              (ch.get("Note") or "").strip(),
+            "categories":        classify.flags(desc),
+        })
+    return rows
+
+
+class _InmateWriter:
+    """
+    Stage di scrittura a batch.
+    Accumula fino a `batch_size` detenuti e per ogni batch, in UNA transazione:
+    - upsert degli Inmate con bulk_create(update_conflicts=True) su booking_number
+    - una delete di tutti i loro Charge
+    - un bulk_create dei nuovi Charge (già classificati, vedi classify.flags)
+    - l'allineamento delle loro CategoryMembership
+    """
+
+    def __init__(self, batch_size: int = 200, charge_filter_contains: str | None = None, on_flush=None):
+        self.batch_size = max(int(batch_size), 1)
+        self.charge_filter_contains = charge_filter_contains
+        self.on_flush = on_flush            # callable(bookings) eseguito nella transazione del batch
+        self._batch: dict[str, tuple[Inmate, list[dict]]] = {}
+        self.created = 0
+        self.updated = 0
+
+    def add(self, booking, first, last, det0, charges):
+        inmate = Inmate(
+            booking_number=booking,
+            first_name=first,
+            last_name=last,
+            age=_parse_age(det0),
+            charges_hash=_charges_hash(charges),
+        )
+        # stesso booking due volte nello stesso batch => vince l'ultimo (conta come update)
+        if booking in self._batch:
+            self.updated += 1
+        self._batch[booking] = (inmate, _build_charges(charges, self.charge_filter_contains))
+        if len(self._batch) >= self.batch_size:
+            self.flush()
+
+    def flush(self):
+        if not self._batch:
+            return
+        batch, self._batch = self._batch, {}
+        bookings = list(batch)
+
+        with transaction.atomic():
+            existing = set(
+                Inmate.objects.filter(booking_number__in=bookings)
+                .values_list("booking_number", flat=True)
+            )
+            Inmate.objects.bulk_create(
+                [inmate for inmate, _ in batch.values()],
+                update_conflicts=True,
+                unique_fields=["booking_number"],
+                update_fields=["first_name", "last_name", "age", "charges_hash"],
+            )
+            # gli id restituiti dall'upsert non sono affidabili su tutti i backend
+            ids = dict(
+                Inmate.objects.filter(booking_number__in=bookings)
+                .values_list("booking_number", "id")
+            )
+            Charge.objects.filter(inmate_id__in=ids.values()).delete()
+            Charge.objects.bulk_create([
+                Charge(inmate_id=ids[booking], **row)
+                for booking, (_, rows) in batch.items()
+                for row in rows
+            ])
+            sync_memberships(ids.values())
+            if self.on_flush:
+                self.on_flush(bookings)
+
+        self.created += len(bookings) - len(existing)
+        self.updated += len(existing)
+
+
+def _search_filter(session, limiter, flt, verbose) -> list[tuple[str, str, str]]:
+    """Listing getInmates/{filtro}: lista di (booking, first, last). Gli errori risalgono."""
+    url = endpoint(URL_SEARCH, flt)
+    if verbose: 
+        print(f"[SCRAPER] Filtro '{flt}' -> {url}")
+
+    rows = []
+    for row in _fetch_json(session, url, limiter):
+        booking = str(row.get("bookingNumber") or "").strip()
+        if not booking:
+            continue
+        full_name = row.get("inmateName", "").strip()
+        first, last = _split_name(full_name)
+        rows.append((booking, first, last))
+    return rows
+
+
+class _Checkpoint:
+    """
+    Stato di uno scrape legato a un Job, per riprenderlo dopo un crash:
+    - job.checkpoint["last_filter"]: ultimo filtro il cui listing è stato salvato;
+    - job.checkpoint["failed_filters"]: filtri il cui listing è fallito (e non è
+      ancora riuscito): alla ripresa vengono ricercati, e finché ce n'è uno il
+      listing non è completo (niente cancellazione dei rilasciati);
+    - ScrapeItem: i booking del listing con stato pending / done / failed.
+    I 'done' vengono scritti nella stessa transazione del batch del writer (flush),
+    quindi un booking marcato done è davvero nel DB.
+    """
+
+    def __init__(self, job, filters: list[str]):
+        self.job = job
+        self.filters = filters
+        self._done: list[str] = []
+
+    def _position(self, flt) -> int:
+        return self.filters.index(flt) if flt in self.filters else -1
+
+    def remaining_filters(self) -> list[str]:
+        """Filtri dopo last_filter + quelli falliti prima del crash, nell'ordine dei filtri del job."""
+        start = self._position(self.job.checkpoint.get("last_filter")) + 1
+        failed = set(self.failed_filters())
+        return [flt for i, flt in enumerate(self.filters) if i >= start or flt in failed]
+
+    def failed_filters(self) -> list[str]:
+        return list(self.job.checkpoint.get("failed_filters", []))
+
+    def _save(self, **changes):
+        self.job.checkpoint = {**self.job.checkpoint, **changes}
+        type(self.job).objects.filter(pk=self.job.pk).update(checkpoint=self.job.checkpoint)
+
+    def save_filter(self, flt: str, rows):
+        ScrapeItem.objects.bulk_create(
+            [ScrapeItem(job=self.job, booking_number=b, first_name=f, last_name=l) for b, f, l in rows],
+            batch_size=1000,
+            ignore_conflicts=True,
+        )
+        changes = {"failed_filters": [f for f in self.failed_filters() if f != flt]}
+        # un filtro fallito ripreso in seguito non deve far tornare indietro last_filter
+        if self._position(flt) > self._position(self.job.checkpoint.get("last_filter")):
+            changes["last_filter"] = flt
+        self._save(**changes)
+
+    def filter_failed(self, flt: str):
+        failed = self.failed_filters()
+        if flt not in failed:
+            self._save(failed_filters=failed + [flt])
+
+    def listing(self) -> dict:
+        items = ScrapeItem.objects.filter(job=self.job).order_by("id")
+        return {b: (f, l) for b, f, l in items.values_list("booking_number", "first_name", "last_name")}
+
+    def done_bookings(self) -> set:
+        return set(
+            ScrapeItem.objects.filter(job=self.job, status=ScrapeItem.DONE)
+            .values_list("booking_number", flat=True)
+        )
+
+    def done(self, bookings):
+        """Booking completati senza scritture (es. charges invariati): marcati al prossimo flush."""
+        self._done.extend(bookings)
+
+    def flush(self, bookings=()):
+        todo, self._done = list(bookings) + self._done, []
+        for i in range(0, len(todo), 500):
+            ScrapeItem.objects.filter(job=self.job, booking_number__in=todo[i:i + 500]).update(
+                status=ScrapeItem.DONE, error="",
+            )
+
+    def failed(self, booking: str, error):
+        ScrapeItem.objects.filter(job=self.job, booking_number=booking).update(
+            status=ScrapeItem.FAILED, attempts=F("attempts") + 1, error=str(error)[:500],
+        )
+
+    def finish(self):
+        """
+        A fine scrape restano solo i falliti (da ispezionare in admin) e il checkpoint
+        si azzera: rieseguire lo stesso job riparte da un listing completo, invece di
+        prendere per completo un listing ripreso da last_filter senza più ScrapeItem.
+        """
+        ScrapeItem.objects.filter(job=self.job).exclude(status=ScrapeItem.FAILED).delete()
+        self.job.checkpoint = {}
+        type(self.job).objects.filter(pk=self.job.pk).update(checkpoint={})
+
+
 def run_scrape(
     filters: list[str] | None = None,
     limit: int | None = None,
     reset: bool = False,
     verbose: bool = True,
     charge_filter_contains: str | None = None,
+    workers: int | None = None,
+    rate_limit: float | None = None,
+    batch_size: int | None = None,
+    incremental: bool = False,
+    recheck: bool = False,
+    progress=None,
+    checkpoint=None,
 ):
     """
     - filters: lista lettere (es. ['a','d']); None => a..z
     - limit: massimo detenuti totali; 0/None => tutti
     - reset: svuota DB prima
     - charge_filter_contains: se valorizzato, salva SOLO i charges che contengono questa stringa (case-insensitive).
+    - workers: thread che scaricano details/charges in parallelo; None => settings.SCRAPER_WORKERS
+    - rate_limit: massimo req/s verso l'host remoto; None => settings.SCRAPER_RATE_LIMIT (0 = nessun limite)
+    - batch_size: detenuti per transazione di scrittura; None => settings.SCRAPER_BATCH_SIZE
+    - il listing di tutti i filtri viene raccolto e deduplicato PRIMA di scaricare:
+      details/charges una sola volta per booking (stats["duplicates_skipped"]).
+    - incremental: confronta il listing getInmates con il DB; scarica solo i booking nuovi
+      e cancella quelli rilasciati (solo se i filtri coprono a..z, senza limit e
+      senza filtri falliti). Le tabelle restano popolate per tutta la durata.
+    - recheck: (solo incremental) riscarica i charges dei booking già presenti e
+      riscrive quelli il cui hash del payload è cambiato.
+    - progress: callable opzionale chiamato con {listed_filters, total_filters} a
+      ogni filtro del listing e poi con {scanned, created, updated, total} man mano
+      che i detenuti vengono processati (total=None se non noto).
+    - checkpoint: Job a cui legare lo stato (ScrapeItem). Se il job viene ripreso
+      riparte dal filtro successivo all'ultimo salvato (più quelli falliti prima del
+      crash) e salta i booking già scritti.
+
+    Ogni richiesta viene ritentata con backoff (vedi _fetch_json); i booking
+    ancora falliti vengono riprovati a fine giro (SCRAPER_REDRIVE_ROUNDS volte) e
+    quelli rimasti sono contati in stats["failed"].
     """
     if reset:
         Inmate.objects.all().delete()
@@ -92,96 +486,169 @@ def run_scrape(
 
     if not filters:
         filters = list(string.ascii_lowercase)
+    if workers is None:
+        workers = getattr(settings, "SCRAPER_WORKERS", 1)
+    workers = max(int(workers), 1)
+    if rate_limit is None:
+        rate_limit = getattr(settings, "SCRAPER_RATE_LIMIT", 0)
 
-    session = requests.Session()
-    session.headers.update(HEADERS)
+    if batch_size is None:
+        batch_size = getattr(settings, "SCRAPER_BATCH_SIZE", 200)
 
-    scanned = created = updated = 0
+    ckpt = _Checkpoint(checkpoint, filters) if checkpoint is not None else None
+    limiter = _RateLimiter(rate_limit)
+    writer = _InmateWriter(batch_size, charge_filter_contains, on_flush=ckpt.flush if ckpt else None)
+    local = threading.local()
+    session = _new_session()
 
-    for flt in filters:
-        url = URL_SEARCH.format(flt)
-        if verbose: 
-            print(f"[SCRAPER] Filtro '{flt}' -> {url}")
+    scanned = unchanged = deleted = 0
+    total = None
+    failed = []                 # (meta, fn, args) da ritentare a fine giro
+    failed_filters = []
+    listed = []                 # filtri scaricati (solo per il progresso)
 
-        try:
-            results = _fetch_json(session, url)
-        except Exception as e:
-            print(f"[SCRAPER][ERR] search {flt}: {e}")
-            continue
-
-        for row in results:
-            booking = str(row.get("bookingNumber") or "").strip()
-            full_name = row.get("inmateName", "").strip()
-            first, last = _split_name(full_name)
-
-            # --- Dettagli (per età)
+    def search(flts):
+        """Listing dei filtri indicati; quelli falliti finiscono in failed_filters."""
+        for flt in flts:
             try:
-                det = _fetch_json(session, URL_DETAILS.format(booking))
-                det0 = det[0] if isinstance(det, list) and det else {}
+                rows = _search_filter(session, limiter, flt, verbose)
             except Exception as e:
-                print(f"[SCRAPER][ERR] details {booking}: {e}")
-                det0 = {}
+                print(f"[SCRAPER][ERR] search {flt}: {e}")
+                failed_filters.append(flt)
+                if ckpt:
+                    ckpt.filter_failed(flt)
+                continue
+            if ckpt:
+                ckpt.save_filter(flt, rows)
+            if progress:
+                listed.append(flt)
+                progress({"listed_filters": len(listed), "total_filters": len(filters)})
+            yield from rows
 
-            age = None
-            birth_field = det0.get("BIRTH")
-            try:
-                age = int(str(birth_field).strip()) if birth_field not in (None, "", "NULL") else None
-            except Exception:
-                age = None
-
-            # --- Salva/aggiorna Inmate (senza immagine)
-            inmate, was_created = Inmate.objects.update_or_create(
-                booking_number=booking,
-                defaults={
-                    "first_name": first,
-                    "last_name":  last,
-                    "age":        age,
-                }
-            )
-            if was_created:
-                created += 1
-            else:
-                updated += 1
+    # --- Listing completo e deduplicato (lo stesso booking compare sotto più lettere),
+    #     ripreso dal checkpoint se c'è; poi ogni booking viene scaricato UNA volta sola.
+    listing = ckpt.listing() if ckpt else {}
+    duplicates = 0
 
-            # --- Charges
-            try:
-                charges = _fetch_json(session, URL_CHARGES.format(booking))
-            except Exception as e:
-                print(f"[SCRAPER][ERR] charges {booking}: {e}")
-                charges = []
+    def collect(flts):
+        nonlocal duplicates
+        for booking, first, last in search(flts):
+            if booking in listing:
+                duplicates += 1
+            listing[booking] = (first, last)
+
+    collect(ckpt.remaining_filters() if ckpt else filters)
+    if failed_filters:
+        retry, failed_filters[:] = list(failed_filters), []
+        collect(retry)
+
+    # già scritti da questo stesso job prima di un crash
+    done = ckpt.done_bookings() if ckpt else set()
+    diff = incremental and not reset
+    stored = dict(Inmate.objects.values_list("booking_number", "charges_hash")) if diff else {}
+
+    # completo solo se ogni lettera è riuscita in questo job (anche prima di un crash)
+    full_listing = (set(filters) >= set(string.ascii_lowercase) and not limit and not failed_filters
+                    and not (ckpt and ckpt.failed_filters()))
+    released = [b for b in stored if b not in listing]
+    if diff and full_listing and released:
+        for i in range(0, len(released), 500):
+            Inmate.objects.filter(booking_number__in=released[i:i + 500]).delete()
+        deleted = len(released)
+        if verbose:
+            print(f"[SCRAPER] Rilasciati (cancellati): {deleted}")
+
+    new = [b for b in listing if b not in stored and b not in done]
+    again = [b for b in listing if b in stored and b not in done] if diff and recheck else []
+    total = len(new) + len(again)
+    if limit:
+        total = min(total, limit)
+    if verbose:
+        print(f"[SCRAPER] Listing: {len(listing)} booking unici, {duplicates} duplicati, {len(done)} già scritti")
+
+    def tasks():
+        for booking in new:
+            yield (booking, *listing[booking]), _fetch_booking, (local, limiter, booking)
+        for booking in again:
+            yield (booking, *listing[booking]), _recheck_booking, (local, limiter, booking, stored[booking])
+
+    submitted = 0
+    max_pending = workers * 4
 
-            Charge.objects.filter(inmate=inmate).delete()
+    def report():
+        if progress:
+            progress({"scanned": scanned, "created": writer.created,
+                      "updated": writer.updated, "total": total})
 
-            for ch in charges:
-                desc   = (ch.get("Charge") or "").strip()
-                if not desc:
+    def drain(pending: dict, block_until_below: int):
+        """Writer: consuma i fetch completati e li passa al writer a batch (thread chiamante)."""
+        nonlocal scanned, unchanged
+        while pending and len(pending) >= block_until_below:
+            done_futures, _ = wait(list(pending), return_when=FIRST_COMPLETED)
+            for fut in done_futures:
+                task = pending.pop(fut)
+                booking, first, last = task[0]
+                try:
+                    result = fut.result()
+                except Exception as e:
+                    print(f"[SCRAPER][ERR] {booking}: {e}")
+                    failed.append(task)
+                    if ckpt:
+                        ckpt.failed(booking, e)
                     continue
-                if charge_filter_contains:
-                    if charge_filter_contains.upper() not in desc.upper():
-                        continue
-
-                bond   = (ch.get("BondAmount") or "").strip()
-                case   = (ch.get("CourtCaseNumber") or "").strip()
-                court  = (ch.get("CourtLocation") or "").strip()
-                note   = (ch.get("Note") or "").strip()
-
-                Charge.objects.create(
-                    inmate=inmate,
-                    charge=desc,
-                    bond_amount=bond,
-                    court_case_number=case,
-                    court_location=court,
-                    note=note,
-                )
-
-            scanned += 1
-            if limit and scanned >= limit:
-                stats = {"scanned": scanned, "created": created, "updated": updated}
-                if verbose: 
-                    print(f"[SCRAPER] DONE (limit raggiunto): {stats}")
-                return stats
-
-    stats = {"scanned": scanned, "created": created, "updated": updated}
+                scanned += 1
+                if result is None:
+                    unchanged += 1
+                    if ckpt:
+                        ckpt.done([booking])
+                    continue
+                det0, charges = result
+                writer.add(booking, first, last, det0, charges)
+            report()
+
+    def run(pool, task_iter, limit=None):
+        nonlocal submitted
+        pending = {}
+        for meta, fn, args in task_iter:
+            pending[pool.submit(fn, *args)] = (meta, fn, args)
+            submitted += 1
+            drain(pending, max_pending)
+            if limit and submitted >= limit:
+                break
+        drain(pending, 1)
+
+    with ThreadPoolExecutor(max_workers=workers, thread_name_prefix="scraper") as pool:
+        run(pool, tasks(), limit)
+        # --- Coda dei falliti: ritentati a fine giro (l'upstream nel frattempo può essersi ripreso)
+        for _ in range(getattr(settings, "SCRAPER_REDRIVE_ROUNDS", 1)):
+            if not failed:
+                break
+            retry, failed[:] = list(failed), []
+            if verbose:
+                print(f"[SCRAPER] Ritento {len(retry)} booking falliti")
+            run(pool, iter(retry))
+
+    writer.flush()
+    if ckpt:
+        ckpt.flush()
+        ckpt.finish()
+    if writer.created or writer.updated or deleted:
+        pairs.invalidate()
+    report()
+    images.evict()
+
+    stats = {
+        "scanned": scanned, "created": writer.created, "updated": writer.updated, "failed": len(failed),
+        # fetch risparmiati: booking ripetuti tra i filtri + già scritti da questo job
+        "duplicates_skipped": duplicates, "already_done": len(done),
+    }
+    if failed_filters:
+        stats["failed_filters"] = failed_filters
+    if incremental:
+        stats.update({"unchanged": unchanged, "deleted": deleted})
     if verbose: 
-        print(f"[SCRAPER] DONE: {stats}")
+        if limit and scanned >= limit:
+            print(f"[SCRAPER] DONE (limit raggiunto): {stats}")
+        else:
+            print(f"[SCRAPER] DONE: {stats}")
     return stats
@@ -0,0 +1,74 @@
+# core/services/search.py
+# -*- coding: utf-8 -*-
+"""
+Ricerca per sottostringa su Charge.charge appoggiata a un indice trigram.
+
+- PostgreSQL: estensione pg_trgm + indice GIN su UPPER(charge) (migration 0014);
+  le query UPPER(charge) LIKE '%PAROLA%' lo usano direttamente.
+- SQLite: tabella FTS5 "ombra" core_charge_fts (tokenizer trigram, case-insensitive),
+  tenuta allineata da trigger; si interroga con MATCH e si torna agli id.
+- Altrimenti (indice assente, parole < 3 caratteri): icontains come prima.
+
+Usata dall'admin (ricerca Charge) e dalla riclassificazione (candidati).
+"""
+
+from functools import reduce
+from operator import or_
+
+from django.db import connections, DEFAULT_DB_ALIAS
+from django.db.models import Q
+from django.db.models.expressions import RawSQL
+from django.db.models.functions import Upper
+
+from core.models import Charge
+
+FTS_TABLE = "core_charge_fts"
+TRGM_INDEX = "core_charge_charge_trgm"
+MIN_TRIGRAM = 3             # sotto i 3 caratteri un indice trigram non aiuta
+
+_backends: dict[str, str | None] = {}
+
+
+def backend(using: str = DEFAULT_DB_ALIAS) -> str | None:
+    """'trgm', 'fts5' o None; calcolato una volta per processo e alias."""
+    if using not in _backends:
+        connection = connections[using]
+        found = None
+        with connection.cursor() as cursor:
+            if connection.vendor == "postgresql":
+                cursor.execute("SELECT 1 FROM pg_indexes WHERE indexname = %s", [TRGM_INDEX])
+                found = "trgm" if cursor.fetchone() else None
+            elif connection.vendor == "sqlite":
+                cursor.execute("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = %s", [FTS_TABLE])
+                found = "fts5" if cursor.fetchone() else None
+        _backends[using] = found
+    return _backends[using]
+
+
+def _fts_phrase(word: str) -> str:
+    return '"' + word.replace('"', '""') + '"'
+
+
+def contains_any(words, queryset=None):
+    """Charge il cui testo contiene (case-insensitive) almeno una delle parole."""
+    queryset = Charge.objects.all() if queryset is None else queryset
+    words = sorted({w.strip() for w in words if w and w.strip()})
+    if not words:
+        return queryset.none()
+
+    kind = backend(queryset.db)
+    short = [w for w in words if len(w) < MIN_TRIGRAM]
+    indexed = [w for w in words if len(w) >= MIN_TRIGRAM]
+    if kind is None:
+        short, indexed = words, []
+
+    conditions = [Q(charge__icontains=w) for w in short]
+    if indexed and kind == "trgm":
+        queryset = queryset.annotate(charge_upper=Upper("charge"))
+        conditions += [Q(charge_upper__contains=w.upper()) for w in indexed]
+    elif indexed and kind == "fts5":
+        match = " OR ".join(_fts_phrase(w) for w in indexed)
+        conditions.append(Q(id__in=RawSQL(
+            f"SELECT rowid FROM {FTS_TABLE} WHERE {FTS_TABLE} MATCH %s", [match]
+        )))
+    return queryset.filter(reduce(or_, conditions))
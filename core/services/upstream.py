@@ -0,0 +1,120 @@
+# core/services/upstream.py
+# -*- coding: utf-8 -*-
+"""
+Client HTTP condiviso per le chiamate "live" a netapps.ocfl.net (fuori dallo scraper).
+
+- una requests.Session per processo con pool di connessioni keep-alive
+  (niente handshake TLS a ogni foto mancante);
+- timeout brevi (UPSTREAM_CONNECT_TIMEOUT / UPSTREAM_READ_TIMEOUT) invece dei 30s dello scraper;
+- circuit breaker: dopo UPSTREAM_BREAKER_FAILURES errori consecutivi le chiamate
+  falliscono subito (CircuitOpen) per UPSTREAM_BREAKER_COOLDOWN secondi, poi UNA
+  chiamata di prova decide se richiudere il circuito. Un upstream lento non può
+  tenere occupati tutti i worker.
+"""
+
+import threading
+import time
+
+import requests
+from django.conf import settings
+from requests.adapters import HTTPAdapter
+
+from core.services import metrics
+
+
+class CircuitOpen(Exception):
+    """Il circuito è aperto: la chiamata non è stata nemmeno tentata."""
+
+
+class CircuitBreaker:
+    def __init__(self, failures: int, cooldown: float):
+        self.max_failures = max(int(failures), 1)
+        self.cooldown = cooldown
+        self._lock = threading.Lock()
+        self._failures = 0
+        self._opened_at = None          # monotonic dell'apertura, None = chiuso
+        self._probing = False
+
+    def before(self):
+        with self._lock:
+            if self._opened_at is None:
+                return
+            if time.monotonic() - self._opened_at < self.cooldown or self._probing:
+                raise CircuitOpen("upstream non disponibile")
+            self._probing = True        # half-open: passa una sola chiamata di prova
+
+    def success(self):
+        with self._lock:
+            self._failures = 0
+            self._opened_at = None
+            self._probing = False
+
+    def failure(self):
+        with self._lock:
+            self._failures += 1
+            self._probing = False
+            if self._opened_at is not None or self._failures >= self.max_failures:
+                self._opened_at = time.monotonic()
+
+    @property
+    def state(self) -> str:
+        with self._lock:
+            if self._opened_at is None:
+                return "closed"
+            return "half-open" if time.monotonic() - self._opened_at >= self.cooldown else "open"
+
+
+_lock = threading.Lock()
+_session: requests.Session | None = None
+_breaker: CircuitBreaker | None = None
+
+
+def session() -> requests.Session:
+    global _session
+    with _lock:
+        if _session is None:
+            from core.services.scraper import HEADERS    # import locale: scraper importa images
+
+            size = getattr(settings, "UPSTREAM_POOL_SIZE", 16)
+            adapter = HTTPAdapter(pool_connections=2, pool_maxsize=size, max_retries=0)
+            s = requests.Session()
+            s.headers.update(HEADERS)
+            s.mount("https://", adapter)
+            s.mount("http://", adapter)
+            _session = s
+    return _session
+
+
+def breaker() -> CircuitBreaker:
+    global _breaker
+    with _lock:
+        if _breaker is None:
+            _breaker = CircuitBreaker(
+                getattr(settings, "UPSTREAM_BREAKER_FAILURES", 5),
+                getattr(settings, "UPSTREAM_BREAKER_COOLDOWN", 30),
+            )
+    return _breaker
+
+
+def _timeout() -> tuple[float, float]:
+    return (getattr(settings, "UPSTREAM_CONNECT_TIMEOUT", 3), getattr(settings, "UPSTREAM_READ_TIMEOUT", 5))
+
+
+def post_json(url: str):
+    """POST vuota con timeout brevi e circuit breaker. Solleva CircuitOpen o l'errore HTTP."""
+    cb = breaker()
+    cb.before()
+    started = time.perf_counter()
+    outcome = "error"
+    try:
+        r = session().post(url, data="{}", timeout=_timeout())
+        outcome = str(r.status_code)
+        r.raise_for_status()
+        data = r.json()
+    except Exception:
+        cb.failure()
+        raise
+    finally:
+        metrics.observe_upstream("live", url, time.perf_counter() - started, outcome)
+    cb.success()
+    return data
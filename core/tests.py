@@ -1,3 +1,726 @@
-from django.test import TestCase
+"""
+Budget delle viste calde: numero di query, tempo DB e chiamate HTTP a
+netapps.ocfl.net per richiesta, su un dataset di prova.
 
-# Create your tests here.
+Ogni voce di BUDGETS è un tetto: se una modifica fa salire uno dei tre valori
+il test fallisce ed elenca le query eseguite. Se l'aumento è voluto si alza il
+budget nello stesso commit, così la crescita resta visibile in review.
+"""
+
+import base64
+import importlib
+import io
+import json
+import os
+import shutil
+import tempfile
+import time
+from pathlib import Path
+from types import SimpleNamespace
+from unittest import mock
+
+import requests
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.core import signing
+from django.core.cache import cache
+from django.db import DatabaseError, connection
+from django.http import HttpResponse
+from django.test import RequestFactory, SimpleTestCase, TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from PIL import Image
+
+from core.models import CategoryGeneration, CategoryMembership, Charge, Inmate, Job, LeaderboardEntry, ScrapeItem
+from core.services import (
+    classify, gamestate, images, leaderboard, metrics, pairs, replay, scraper, search, upstream,
+)
+from core.services.filters import apply_filters, sync_memberships
+from core.services.modes import MODES, get_mode
+
+# vista -> (query, millisecondi di DB, chiamate upstream) massimi per richiesta.
+# *_cold = primo accesso dopo un avvio/invalidate (pool di pairs.py da caricare).
+# Le viste di gioco non chiamano mai l'upstream: le foto mancanti le scarica /img/.
+BUDGETS = {
+    "home":                   (0, 50, 0),
+    "pick_pair_cold":         (5, 50, 0),
+    "pick_pair":              (1, 20, 0),
+    "mode_start":             (0, 50, 0),
+    "mode_play_cold":         (5, 50, 0),
+    "mode_play":              (1, 20, 0),
+    "mode_choose":            (0, 50, 0),
+    "api_mode_start":         (5, 50, 0),
+    "api_mode_next":          (2, 20, 0),
+    "api_mode_answer":        (1, 20, 0),
+    "leaderboard":            (1, 50, 0),
+    "leaderboard_rank":       (2, 50, 0),
+    "leaderboard_submit":     (2, 50, 0),
+    "inmate_image":           (1, 50, 1),
+    "inmate_image_unknown":   (1, 50, 0),
+    "inmate_image_cached":    (0, 50, 0),
+    "admin_changelist":       (5, 100, 0),
+    "admin_charge_search":    (5, 100, 0),
+}
+
+CHARGES = [
+    "MURDER 1ST DEGREE",
+    "CHILD ABUSE",
+    "POSS CANNABIS OVER 20 GRAMS",
+    "TRAFFICKING FENTANYL",
+    "PETIT THEFT",
+    "BATTERY",
+    "DRIVING WHILE LICENSE SUSPENDED",
+]
+
+
+def _jpeg_b64() -> str:
+    buf = io.BytesIO()
+    Image.new("RGB", (60, 80), (120, 90, 60)).save(buf, "JPEG")
+    return base64.b64encode(buf.getvalue()).decode("ascii")
+
+
+class BudgetTestCase(TestCase):
+    """Dataset di prova + assertBudget(); HTTP verso l'upstream finto e contato."""
+
+    @classmethod
+    def setUpClass(cls):
+        cls._image_dir = tempfile.mkdtemp()
+        cls._settings = override_settings(
+            IMAGE_CACHE_DIR=cls._image_dir,
+            CACHES={"default": {"BACKEND": "django.core.cache.backends.locmem.LocMemCache",
+                                "LOCATION": "core-tests"}},
+            LEADERBOARD_BUFFERED=False,
+            GAME_STATE_STORE="cookie",
+        )
+        cls._settings.enable()
+        super().setUpClass()
+
+    @classmethod
+    def tearDownClass(cls):
+        super().tearDownClass()
+        cls._settings.disable()
+        shutil.rmtree(cls._image_dir, ignore_errors=True)
+
+    @classmethod
+    def setUpTestData(cls):
+        for n in range(40):
+            inmate = Inmate.objects.create(booking_number=f"T{n:05d}", first_name="JOHN", last_name=f"DOE{n}", age=30)
+            for text in (CHARGES[n % len(CHARGES)], CHARGES[(n * 3 + 1) % len(CHARGES)]):
+                Charge.objects.create(inmate=inmate, charge=text, categories=classify.flags(text))
+        apply_filters()
+        LeaderboardEntry.objects.bulk_create([
+            LeaderboardEntry(name=f"p{n}", score=n * 7 % 300, mode=mode)
+            for mode in MODES for n in range(30)
+        ])
+        cls.staff = get_user_model().objects.create_superuser("admin", "admin@example.com", "pw")
+
+    def setUp(self):
+        cache.clear()
+        pairs.invalidate()          # pool in memoria del processo: ogni test parte a freddo
+        shutil.rmtree(self._image_dir, ignore_errors=True)
+        self.upstream_calls = 0
+        patcher = mock.patch.object(requests.Session, "request", autospec=True, side_effect=self._fake_request)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.addCleanup(setattr, upstream, "_breaker", None)
+        upstream._breaker = None
+
+    def _fake_request(self, session, method, url, **kwargs):
+        self.upstream_calls += 1
+        response = requests.Response()
+        response.status_code = 200
+        response.url = url
+        response._content = json.dumps([{"BIRTH": "30", "IMAGE": _jpeg_b64()}]).encode()
+        return response
+
+    def assertBudget(self, name, func):
+        max_queries, max_ms, max_calls = BUDGETS[name]
+        self.upstream_calls = 0
+        with CaptureQueriesContext(connection) as ctx:
+            result = func()
+        queries = ctx.captured_queries
+        db_ms = sum(float(q["time"]) for q in queries) * 1000
+        listing = "\n".join(f"  {q['time']}s {q['sql']}" for q in queries)
+        self.assertLessEqual(len(queries), max_queries, f"{name}: {len(queries)} query, budget {max_queries}\n{listing}")
+        self.assertLessEqual(db_ms, max_ms, f"{name}: {db_ms:.1f}ms di DB, budget {max_ms}ms\n{listing}")
+        self.assertLessEqual(self.upstream_calls, max_calls,
+                             f"{name}: {self.upstream_calls} chiamate upstream, budget {max_calls}")
+        return result
+
+    def start_game(self, mode="child"):
+        self.client.get(reverse("mode_start", args=[mode]))
+
+    def set_state(self, key, value):
+        """Scrive nel client il cookie di stato `key` come farebbe una risposta della app."""
+        response = gamestate.save(RequestFactory().get("/"), HttpResponse(), key, value)
+        self.client.cookies[f"gs_{key}"] = response.cookies[f"gs_{key}"].value
+
+
+class GameplayBudgetTests(BudgetTestCase):
+
+    def test_home(self):
+        response = self.assertBudget("home", lambda: self.client.get(reverse("home")))
+        self.assertEqual(response.status_code, 200)
+
+    def test_pick_pair(self):
+        for key in MODES:
+            with self.subTest(mode=key):
+                mode = get_mode(key)
+                game = mode.new_game()
+                self.assertIsNotNone(self.assertBudget("pick_pair_cold", lambda: mode.next_pair(game)))
+                self.assertIsNotNone(self.assertBudget("pick_pair", lambda: mode.next_pair(game)))
+
+    def test_mode_start(self):
+        response = self.assertBudget("mode_start", lambda: self.client.get(reverse("mode_start", args=["child"])))
+        self.assertEqual(response.status_code, 302)
+
+    def test_mode_play(self):
+        for key in MODES:
+            with self.subTest(mode=key):
+                self.start_game(key)
+                play = reverse("mode_play", args=[key])
+                response = self.assertBudget("mode_play_cold", lambda: self.client.get(play))
+                self.assertContains(response, 'name="side"')
+                self.client.post(reverse("mode_choose", args=[key]), {"side": "left"})
+                response = self.assertBudget("mode_play", lambda: self.client.get(play))
+                self.assertContains(response, 'name="side"')
+                # la coppia successiva arriva con la stessa query della coppia corrente
+                self.assertEqual(len(response.context["prefetch"]), 2)
+
+    def test_mode_choose(self):
+        self.start_game()
+        self.client.get(reverse("mode_play", args=["child"]))
+        response = self.assertBudget(
+            "mode_choose", lambda: self.client.post(reverse("mode_choose", args=["child"]), {"side": "left"})
+        )
+        self.assertEqual(response.status_code, 302)
+
+    def test_mode_choose_with_session_cookie(self):
+        # un cookie di sessione (es. dopo il login in admin) non deve costare la SELECT
+        # della sessione: il gioco non la legge, e nemmeno il middleware di Server-Timing
+        self.start_game()
+        self.client.get(reverse("mode_play", args=["child"]))
+        self.client.cookies[settings.SESSION_COOKIE_NAME] = "x" * 32
+        response = self.assertBudget(
+            "mode_choose", lambda: self.client.post(reverse("mode_choose", args=["child"]), {"side": "left"})
+        )
+        self.assertEqual(response.status_code, 302)
+
+    def test_api_round(self):
+        response = self.assertBudget("api_mode_start", lambda: self.client.post(reverse("api_mode_start", args=["murder"])))
+        self.assertEqual(response.status_code, 200)
+        # ricaricare la coppia corrente: niente nuova estrazione, foto già in cache
+        response = self.assertBudget("api_mode_next", lambda: self.client.get(reverse("api_mode_next", args=["murder"])))
+        self.assertEqual(response.status_code, 200)
+        response = self.assertBudget(
+            "api_mode_answer", lambda: self.client.post(reverse("api_mode_answer", args=["murder"]), {"side": "right"})
+        )
+        self.assertEqual(response.status_code, 200)
+        self.assertIn("correct", response.json())
+
+
+class GameStateTests(BudgetTestCase):
+
+    def _state(self, mode):
+        return signing.loads(self.client.cookies[f"gs_game_{mode}"].value, salt=f"gamehub.state.game_{mode}")
+
+    def test_cookie_does_not_reveal_answer(self):
+        self.client.post(reverse("api_mode_start", args=["murder"]))
+        self.assertEqual(set(self._state("murder")["pair"]), {"left_id", "right_id"})
+
+    def test_replayed_cookie_keeps_first_outcome(self):
+        self.client.post(reverse("api_mode_start", args=["murder"]))
+        before = self.client.cookies["gs_game_murder"].value
+        state = self._state("murder")
+        positive = get_mode("murder")._positive_id(state["pair"], state["seq"])
+        wrong, right = ("left", "right") if state["pair"]["right_id"] == positive else ("right", "left")
+        answer = reverse("api_mode_answer", args=["murder"])
+        self.assertFalse(self.client.post(answer, {"side": wrong}).json()["correct"])
+        lives = self._state("murder")["lives"]
+        self.client.cookies["gs_game_murder"] = before
+        self.assertFalse(self.client.post(answer, {"side": right}).json()["correct"])
+        self.assertEqual(self._state("murder")["lives"], lives)
+
+    def test_final_score_submitted_once(self):
+        game = get_mode("drugs").new_game()
+        game.update(lives=0, score=77)
+        self.set_state("game_drugs", game)
+        self.client.get(reverse("mode_gameover", args=["drugs"]))
+        self.assertEqual(self.client.cookies["gs_game_drugs"].value, "")      # partita chiusa
+        final = self.client.cookies["gs_final"].value
+        submit = reverse("leaderboard_submit")
+        for _ in range(3):
+            self.client.cookies["gs_final"] = final
+            self.client.post(submit, {"name": "replay"})
+        self.assertEqual(LeaderboardEntry.objects.filter(name="replay").count(), 1)
+
+    def test_no_final_score_before_game_over(self):
+        game = get_mode("drugs").new_game()
+        game.update(score=77)
+        self.set_state("game_drugs", game)
+        response = self.client.get(reverse("mode_gameover", args=["drugs"]))
+        self.assertRedirects(response, reverse("mode_play", args=["drugs"]), fetch_redirect_response=False)
+        self.assertNotIn("gs_final", response.cookies)
+
+
+class LeaderboardBudgetTests(BudgetTestCase):
+
+    def test_leaderboard(self):
+        for key in MODES:
+            with self.subTest(mode=key):
+                cache.clear()
+                response = self.assertBudget("leaderboard", lambda: self.client.get(reverse("leaderboard", args=[key])))
+                self.assertEqual(len(response.context["entries"]), 30)
+
+    def test_leaderboard_rank(self):
+        response = self.assertBudget(
+            "leaderboard_rank", lambda: self.client.get(reverse("leaderboard_rank", args=["child"]), {"score": 150})
+        )
+        self.assertEqual(response.json()["total"], 30)
+
+    def test_leaderboard_submit(self):
+        self.set_state("final", {"id": "g1", "score": 123, "mode": "drugs"})
+        response = self.assertBudget(
+            "leaderboard_submit", lambda: self.client.post(reverse("leaderboard_submit"), {"name": "tester"})
+        )
+        self.assertRedirects(response, reverse("leaderboard", args=["drugs"]), fetch_redirect_response=False)
+        self.assertTrue(LeaderboardEntry.objects.filter(name="tester", score=123, mode="drugs").exists())
+
+    def test_buffered_flush_retries_after_db_error(self):
+        spool_dir = Path(tempfile.mkdtemp())
+        self.addCleanup(shutil.rmtree, spool_dir, ignore_errors=True)
+        self.addCleanup(setattr, leaderboard, "_buffer_instance", None)
+        # FLUSH_MS alto: il thread resta fermo, i tick li fa il test
+        with override_settings(LEADERBOARD_BUFFERED=True, LEADERBOARD_SPOOL_DIR=spool_dir, LEADERBOARD_FLUSH_MS=60000):
+            leaderboard._buffer_instance = None
+            leaderboard.submit("buffered1", 201, "drugs")
+            leaderboard.submit("buffered2", 202, "drugs")
+        buffer = leaderboard._buffer_instance
+        rows = LeaderboardEntry.objects.filter(name__startswith="buffered")
+
+        with mock.patch.object(LeaderboardEntry.objects, "bulk_create", side_effect=DatabaseError("database is locked")), \
+                mock.patch("builtins.print"):
+            self.assertEqual(buffer.tick(), 0)
+        self.assertFalse(rows.exists())
+        self.assertEqual(len(list(spool_dir.glob("*.flushing"))), 1)
+
+        self.assertEqual(buffer.tick(), 0)          # backoff non ancora scaduto
+        later = time.monotonic() + leaderboard.RETRY_MAX
+        with mock.patch.object(leaderboard.time, "monotonic", return_value=later):
+            self.assertEqual(buffer.tick(), 2)
+        self.assertEqual(sorted(rows.values_list("score", flat=True)), [201, 202])
+        self.assertEqual(list(spool_dir.glob("*.flushing")), [])
+
+
+class ImageBudgetTests(BudgetTestCase):
+
+    def test_inmate_image(self):
+        url = reverse("inmate_image", args=["T00001", "h280", "webp"])
+        response = self.assertBudget("inmate_image", lambda: self.client.get(url))
+        self.assertEqual(response.status_code, 200)
+        response = self.assertBudget("inmate_image_cached", lambda: self.client.get(url))
+        self.assertEqual(response.status_code, 200)
+
+    def test_unknown_booking_never_goes_upstream(self):
+        url = reverse("inmate_image", args=["X99999", "h280", "webp"])
+        response = self.assertBudget("inmate_image_unknown", lambda: self.client.get(url))
+        self.assertEqual(response.status_code, 404)
+        with self.assertNumQueries(0):              # cache negativa
+            self.assertEqual(self.client.get(url).status_code, 404)
+        self.assertEqual(self.upstream_calls, 0)
+
+    def test_evict_counts_variants_and_spares_fresh_orphans(self):
+        url = reverse("inmate_image", args=["T00001", "h560", "webp"])
+        self.assertEqual(self.client.get(url).status_code, 200)
+        sha, blob = images.lookup("T00001")
+        variant = images._variant_path(sha, "h560", "webp")
+        self.assertEqual(images.evict(max_bytes=10**9)["bytes"],
+                         blob.stat().st_size + variant.stat().st_size)
+
+        orphan = images._blob_path("0" * 64)
+        orphan.parent.mkdir(parents=True, exist_ok=True)
+        orphan.write_bytes(b"appena scritto, ref non ancora salvato")
+        images.evict(max_bytes=10**9)
+        self.assertTrue(orphan.exists())
+        old = time.time() - images._ORPHAN_GRACE - 1
+        os.utime(orphan, (old, old))
+        images.evict(max_bytes=10**9)
+        self.assertFalse(orphan.exists())
+
+
+class AdminBudgetTests(BudgetTestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.client.force_login(self.staff)
+
+    def test_changelists(self):
+        for model in ("inmate", "charge", "categorymembership", "leaderboardentry", "job", "scrapeitem"):
+            with self.subTest(model=model):
+                url = reverse(f"admin:core_{model}_changelist")
+                response = self.assertBudget("admin_changelist", lambda: self.client.get(url))
+                self.assertEqual(response.status_code, 200)
+
+    def test_charge_search(self):
+        url = reverse("admin:core_charge_changelist")
+        response = self.assertBudget("admin_charge_search", lambda: self.client.get(url, {"q": "murder"}))
+        self.assertEqual(response.status_code, 200)
+
+
+@override_settings(METRICS_TOKEN="secret", SERVER_TIMING=True)
+class MetricsTests(BudgetTestCase):
+
+    def test_server_timing(self):
+        self.start_game()
+        timing = self.client.get(reverse("mode_play", args=["child"]))["Server-Timing"]
+        for name in ("db;", "render;", "total;"):
+            self.assertIn(name, timing)
+        # l'unica vista che chiama l'upstream: foto non ancora in cache
+        timing = self.client.get(reverse("inmate_image", args=["T00001", "h280", "webp"]))["Server-Timing"]
+        self.assertRegex(timing, r'upstream;dur=[\d.]+;desc="1"')
+
+    @override_settings(SERVER_TIMING=False, DEBUG=False)
+    def test_server_timing_staff_only(self):
+        self.assertNotIn("Server-Timing", self.client.get(reverse("home")))
+        self.client.force_login(self.staff)
+        self.assertIn("Server-Timing", self.client.get(reverse("home")))
+
+    def test_metrics_export(self):
+        metrics.reset()
+        self.client.get(reverse("home"))
+        self.client.get(reverse("inmate_image", args=["T00001", "h280", "webp"]))
+        url = reverse("metrics")
+        self.assertEqual(self.client.get(url).status_code, 302)          # anonimo -> login admin
+        self.assertEqual(self.client.get(url, HTTP_AUTHORIZATION="Bearer wrong").status_code, 302)
+        response = self.client.get(url, HTTP_AUTHORIZATION="Bearer secret")
+        self.assertEqual(response.status_code, 200)
+        body = response.content.decode()
+        self.assertIn('gamehub_request_seconds_count{status="2xx",view="home"} 1', body)
+        self.assertIn('gamehub_upstream_seconds_count{endpoint="getInmateDetails",outcome="200",source="live"} 1', body)
+        self.assertIn('gamehub_cache_requests_total{cache="images",result="miss"}', body)
+        self.client.force_login(self.staff)
+        self.assertEqual(self.client.get(url).status_code, 200)
+
+
+# La vecchia classificazione di filters.py, una Q(charge__icontains=...) per regola.
+_OLD_CHILD_SECONDARY = [
+    "assault", "sex", "sexual", "abuse", "molest", "exploitation",
+    "pornograph", "indecent", "lewd", "lascivious", "battery",
+    "neglect", "endangerment", "solicitation", "entice", "incest",
+    "rape", "sodomy", "traffick", "conduct", "exposure", "fondling",
+    "statutory", "child abuse", "child neglect", "child porn", "video"
+]
+_OLD_RULES = {
+    ("child", "child_abuse"):       lambda t: "child" in t and any(k in t for k in _OLD_CHILD_SECONDARY),
+    ("murder", "murder"):           lambda t: "murder" in t,
+    ("drugs", "cannabis"):          lambda t: "cannabis" in t,
+    ("drugs", "cocaine_fentanyl"):  lambda t: "cocaine" in t or "fentanyl" in t,
+}
+
+
+def _old_labels(text: str) -> set:
+    text = text.lower()
+    return {key for key, rule in _OLD_RULES.items() if rule(text)}
+
+
+class ClassifyTests(SimpleTestCase):
+    """classify()/flags() devono dare gli stessi risultati delle vecchie regole icontains."""
+
+    CASES = [
+        # maiuscole/minuscole
+        "MURDER 1ST DEGREE", "Murder - Attempted", "poss cannabis over 20 grams",
+        "TRAFFICKING FENTANYL", "Cocaine Possession",
+        # accenti: nessuna normalizzazione Unicode, come icontains
+        "MÚRDER", "CANNABÍS", "CHÍLD ABUSE", "Child Abusé", "ASESINATO (MURDER)",
+        # parole sovrapposte o contenute in altre
+        "CHILD ABUSE", "CHILD NEGLECT", "CHILD PORNOGRAPHY", "SEXUAL BATTERY ON CHILD",
+        "LEWD LASCIVIOUS EXHIBITION CHILD", "CHILDREN SEX VIDEO", "CHILDABUSE",
+        "SOLICITATION OF CHILD", "HUMAN TRAFFICKING CHILD", "MURDERER", "COCAINE AND FENTANYL",
+        "CHILD MURDER", "CANNABIS COCAINE CHILD ABUSE MURDER",
+        # negativi
+        "", "PETIT THEFT", "BATTERY", "DRIVING WHILE LICENSE SUSPENDED", "CHILD SUPPORT",
+        "ABUSE OF ELDERLY", "SEXUAL BATTERY", "CANNABI", "MURDE R", "FENTANY", "CHIL D ABUSE",
+    ]
+
+    def test_matches_old_rules(self):
+        for text in self.CASES:
+            with self.subTest(text=text):
+                expected = _old_labels(text)
+                self.assertEqual(classify.classify(text), expected)
+                self.assertEqual(classify.labels_of(classify.flags(text)), expected)
+
+    def test_migration_0013_matches_old_rules(self):
+        # la migrazione ha le sue regole congelate: anche loro devono coincidere
+        migration = importlib.import_module("core.migrations.0013_charge_categories")
+        for text in self.CASES:
+            with self.subTest(text=text):
+                expected = sum(classify.BITS[key] for key in _old_labels(text))
+                self.assertEqual(migration.flags(text), expected)
+
+
+class SearchTests(BudgetTestCase):
+    """search.contains_any(): stessi risultati di icontains con e senza indice trigram."""
+
+    def assertSameAsIcontains(self, words):
+        expected = Charge.objects.none()
+        for word in words:
+            expected |= Charge.objects.filter(charge__icontains=word)
+        self.assertEqual(sorted(search.contains_any(words).values_list("pk", flat=True)),
+                         sorted(expected.values_list("pk", flat=True)))
+
+    @classmethod
+    def setUpTestData(cls):
+        super().setUpTestData()
+        inmate = Inmate.objects.first()
+        # inserita dopo la migration: il trigger la deve indicizzare
+        Charge.objects.create(inmate=inmate, charge="Trafficking in Cocaine 28G")
+
+    def test_backend(self):
+        self.assertEqual(search.backend(), "fts5" if connection.vendor == "sqlite" else "trgm")
+
+    def test_substring_and_multi_term(self):
+        found = set(search.contains_any(["nnabi"]).values_list("charge", flat=True))
+        self.assertEqual(found, {"POSS CANNABIS OVER 20 GRAMS"})
+        found = set(search.contains_any(["fentanyl", "cocaine", "murder"]).values_list("charge", flat=True))
+        self.assertEqual(found, {"MURDER 1ST DEGREE", "TRAFFICKING FENTANYL", "Trafficking in Cocaine 28G"})
+        for words in (["nnabi"], ["FENTANYL", "murder"], ["20", "child"], ["ft"], ["nothing here"], ['"quoted']):
+            with self.subTest(words=words):
+                self.assertSameAsIcontains(words)
+        self.assertFalse(search.contains_any([" ", ""]).exists())
+
+    def test_fallback_without_index(self):
+        with mock.patch.dict(search._backends, {connection.alias: None}):
+            self.assertNotIn("MATCH", str(search.contains_any(["cannabis"]).query))
+            for words in (["nnabi"], ["FENTANYL", "murder"], ["20", "child"]):
+                with self.subTest(words=words):
+                    self.assertSameAsIcontains(words)
+
+    def test_migration_skips_only_missing_index_support(self):
+        migration = importlib.import_module("core.migrations.0014_charge_trigram_index")
+        schema_editor = SimpleNamespace(connection=connection)
+        if connection.vendor == "sqlite":
+            with mock.patch("builtins.print") as printed:
+                migration._run(schema_editor, ["CREATE VIRTUAL TABLE t_missing USING no_such_module(a)"])
+            printed.assert_called_once()
+        with self.assertRaises(DatabaseError):
+            migration._run(schema_editor, ["CREATE INDEX broken ON no_such_table (charge)"])
+
+
+# "ADAMS, BOB" compare sotto a e b, "COOK, CARL ANN" sotto c e a: lo stesso booking
+# esce da più filtri del listing.
+SCRAPE_FIXTURE = [
+    {"bookingNumber": "S1", "inmateName": "ADAMS, BOB", "details": {"BIRTH": "30"},
+     "charges": [{"Charge": "MURDER 1ST DEGREE"}]},
+    {"bookingNumber": "S2", "inmateName": "COOK, CARL ANN", "details": {"BIRTH": "41"},
+     "charges": [{"Charge": "POSS COCAINE"}]},
+    {"bookingNumber": "S3", "inmateName": "MOSS, MIA", "details": {"BIRTH": "25"},
+     "charges": [{"Charge": "PETIT THEFT"}]},
+    {"bookingNumber": "S4", "inmateName": "ZED, ZOE", "details": {"BIRTH": "52"},
+     "charges": [{"Charge": "CHILD ABUSE"}]},
+]
+
+
+class ScraperTests(TestCase):
+    """run_scrape() contro il ReplayServer: upsert, cancellazione dei rilasciati, ripresa, redrive."""
+
+    def setUp(self):
+        image_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, image_dir, ignore_errors=True)
+        self.server = replay.ReplayServer(SCRAPE_FIXTURE)
+        self.server.start()
+        self.addCleanup(self.server.stop)
+        overrides = override_settings(
+            SCRAPER_BASE_URL=self.server.base_url, SCRAPER_RETRIES=0, SCRAPER_WORKERS=2,
+            SCRAPER_RATE_LIMIT=0, SCRAPER_REDRIVE_ROUNDS=1, UPSTREAM_BREAKER_FAILURES=1000,
+            IMAGE_CACHE_DIR=image_dir,
+        )
+        overrides.enable()
+        self.addCleanup(overrides.disable)
+        upstream._breaker = None
+        self.addCleanup(setattr, upstream, "_breaker", None)
+        # richieste per (endpoint, argomento); fail = {(endpoint, argomento): quante volte rispondere 503}
+        self.calls = {}
+        self.fail = {}
+        respond = self.server.respond
+
+        def counted(kind, arg):
+            self.calls[kind, arg] = self.calls.get((kind, arg), 0) + 1
+            if self.fail.get((kind, arg)):
+                self.fail[kind, arg] -= 1
+                return 503, {"error": "test"}
+            return respond(kind, arg)
+
+        self.server.respond = counted
+        Inmate.objects.create(booking_number="OLD", first_name="GONE", last_name="RELEASED")
+        print_patcher = mock.patch("builtins.print")
+        print_patcher.start()
+        self.addCleanup(print_patcher.stop)
+
+    def scrape(self, **kwargs):
+        return scraper.run_scrape(incremental=True, verbose=False, **kwargs)
+
+    def bookings(self):
+        return set(Inmate.objects.values_list("booking_number", flat=True))
+
+    def fetched(self, kind="getInmateDetails"):
+        return {arg: n for (k, arg), n in self.calls.items() if k == kind}
+
+    def test_full_run_upserts_each_inmate_once(self):
+        stats = self.scrape()
+        self.assertEqual(self.bookings(), {"S1", "S2", "S3", "S4"})          # OLD rilasciato
+        self.assertEqual(stats["created"], 4)
+        self.assertEqual(stats["deleted"], 1)
+        self.assertGreater(stats["duplicates_skipped"], 0)
+        self.assertEqual(self.fetched(), {"S1": 1, "S2": 1, "S3": 1, "S4": 1})
+        self.assertEqual(Charge.objects.get(inmate__booking_number="S1").categories,
+                         classify.flags("MURDER 1ST DEGREE"))
+
+        self.calls.clear()
+        stats = self.scrape()                   # secondo giro: niente di nuovo
+        self.assertEqual((stats["created"], stats["deleted"]), (0, 0))
+        self.assertEqual(self.fetched(), {})
+        self.assertEqual(Inmate.objects.count(), 4)
+
+    def test_incomplete_listing_deletes_nothing(self):
+        with self.subTest("filtro del listing fallito"):
+            self.fail["getInmates", "z"] = 2            # fallisce anche il secondo tentativo
+            stats = self.scrape()
+            self.assertEqual(stats["failed_filters"], ["z"])
+            self.assertEqual(stats["deleted"], 0)
+            self.assertEqual(self.bookings(), {"OLD", "S1", "S2", "S3"})
+        with self.subTest("limit"):
+            Inmate.objects.exclude(booking_number="OLD").delete()
+            stats = self.scrape(limit=1)
+            self.assertEqual(stats["deleted"], 0)
+            self.assertIn("OLD", self.bookings())
+
+    def test_failed_filter_restored_from_checkpoint_deletes_nothing(self):
+        job = Job.objects.create(kind="scrape", params={})
+        self.fail["getInmates", "c"] = 2
+        save_filter = scraper._Checkpoint.save_filter
+
+        def crash_after_m(ckpt, flt, rows):
+            save_filter(ckpt, flt, rows)
+            if flt == "m":
+                raise RuntimeError("worker morto")
+
+        with mock.patch.object(scraper._Checkpoint, "save_filter", crash_after_m):
+            with self.assertRaises(RuntimeError):
+                self.scrape(checkpoint=job)
+        job.refresh_from_db()
+        self.assertEqual(job.checkpoint, {"last_filter": "m", "failed_filters": ["c"]})
+
+        self.fail["getInmates", "c"] = 2                # "c" fallisce anche alla ripresa
+        stats = self.scrape(checkpoint=job)
+        self.assertEqual(stats["deleted"], 0)
+        self.assertIn("OLD", self.bookings())
+
+        job.refresh_from_db()
+        self.assertEqual(job.checkpoint, {})            # job finito: rieseguirlo rifà tutto il listing
+        stats = self.scrape(checkpoint=job)             # ora "c" risponde: listing completo
+        self.assertEqual(stats["deleted"], 1)
+        self.assertEqual(self.bookings(), {"S1", "S2", "S3", "S4"})
+
+    def test_resume_skips_done_bookings(self):
+        # stato di un job morto dopo aver scritto S1 e S2: listing completo nel checkpoint
+        job = Job.objects.create(kind="scrape", params={}, checkpoint={"last_filter": "z", "failed_filters": []})
+        for inmate in SCRAPE_FIXTURE:
+            last, first = inmate["inmateName"].split(", ")
+            done = inmate["bookingNumber"] in ("S1", "S2")
+            ScrapeItem.objects.create(job=job, booking_number=inmate["bookingNumber"], first_name=first,
+                                      last_name=last, status=ScrapeItem.DONE if done else ScrapeItem.PENDING)
+            if done:
+                Inmate.objects.create(booking_number=inmate["bookingNumber"], first_name=first, last_name=last)
+
+        stats = self.scrape(checkpoint=job)
+        self.assertEqual(self.fetched("getInmates"), {})                     # listing dal checkpoint
+        self.assertEqual(self.fetched(), {"S3": 1, "S4": 1})
+        self.assertEqual(stats["already_done"], 2)
+        self.assertEqual(stats["deleted"], 1)
+        self.assertEqual(self.bookings(), {"S1", "S2", "S3", "S4"})
+        self.assertFalse(ScrapeItem.objects.filter(job=job).exists())
+
+    def test_failed_items_are_redriven(self):
+        job = Job.objects.create(kind="scrape", params={})
+        self.fail["getInmateDetails", "S3"] = 1
+        stats = self.scrape(checkpoint=job)
+        self.assertEqual(stats["failed"], 0)
+        self.assertEqual(self.fetched()["S3"], 2)
+        self.assertIn("S3", self.bookings())
+        self.assertFalse(ScrapeItem.objects.filter(job=job).exists())
+
+        self.fail["getInmateDetails", "S4"] = 2         # fallisce anche al redrive
+        Inmate.objects.filter(booking_number="S4").delete()
+        Job.objects.filter(pk=job.pk).update(status=Job.DONE)
+        stats = self.scrape(checkpoint=Job.objects.create(kind="scrape", params={}))
+        self.assertEqual(stats["failed"], 1)
+        self.assertNotIn("S4", self.bookings())
+        self.assertEqual(ScrapeItem.objects.get(status=ScrapeItem.FAILED).booking_number, "S4")
+
+
+class FiltersTests(BudgetTestCase):
+    """Rebuild per generazioni (apply_filters) contro sync_memberships e pairs."""
+
+    def active_rows(self, categories=None):
+        generations = CategoryGeneration.active_map(categories or classify.CATEGORIES)
+        return {
+            (c, l, i) for c, l, i, g in
+            CategoryMembership.objects.values_list("category", "label", "inmate_id", "generation")
+            if generations.get(c) == g
+        }
+
+    def add_murder(self):
+        """Un detenuto senza murder che riceve un charge murder (come dopo uno scrape)."""
+        inmate = Inmate.objects.exclude(memberships__category="murder").first()
+        Charge.objects.create(inmate=inmate, charge="MURDER 2ND DEGREE", categories=classify.flags("MURDER 2ND DEGREE"))
+        return inmate
+
+    def test_rebuild_matches_sync_memberships(self):
+        expected = {
+            (category, label, inmate_id)
+            for inmate_id, flags in Charge.objects.values_list("inmate_id", "categories")
+            for category, label in classify.labels_of(flags)
+        }
+        self.assertEqual(self.active_rows(), expected)
+        CategoryMembership.objects.all().delete()
+        sync_memberships()
+        self.assertEqual(self.active_rows(), expected)
+        apply_filters()
+        self.assertEqual(self.active_rows(), expected)
+
+    def test_generation_flips_and_old_rows_go(self):
+        before = CategoryGeneration.active_map(classify.CATEGORIES)
+        others = self.active_rows(["child", "drugs"])
+        inmate = self.add_murder()
+        apply_filters(["murder"])
+        after = CategoryGeneration.active_map(classify.CATEGORIES)
+        self.assertEqual(after["murder"], before["murder"] + 1)
+        self.assertEqual({c: g for c, g in after.items() if c != "murder"},
+                         {c: g for c, g in before.items() if c != "murder"})
+        self.assertEqual(set(CategoryMembership.objects.filter(category="murder").values_list("generation", flat=True)),
+                         {after["murder"]})
+        self.assertIn(("murder", "murder", inmate.pk), self.active_rows())
+        self.assertEqual(self.active_rows(["child", "drugs"]), others)
+
+    def test_failed_rebuild_keeps_active_generation(self):
+        before = self.active_rows()
+        generations = CategoryGeneration.active_map(classify.CATEGORIES)
+        self.add_murder()
+        with mock.patch.object(CategoryGeneration.objects, "update_or_create", side_effect=DatabaseError("boom")):
+            with self.assertRaises(DatabaseError):
+                apply_filters(["murder"])
+        # INSERT ... SELECT e spostamento della generazione nella stessa transazione: niente a metà
+        self.assertEqual(CategoryGeneration.active_map(classify.CATEGORIES), generations)
+        self.assertEqual(self.active_rows(), before)
+        self.assertEqual(CategoryMembership.objects.count(), len(before))
+
+    def test_pairs_sees_new_generation(self):
+        murder, non_murder = ("murder", "murder"), ("murder", None)
+        pairs.get_pool(murder)
+        inmate = self.add_murder()
+        self.assertNotIn(inmate.pk, pairs.get_pool(murder).ids)             # pool in memoria
+        self.assertIn(inmate.pk, pairs.get_pool(non_murder).ids)
+        apply_filters(["murder"])
+        self.assertIn(inmate.pk, pairs.get_pool(murder).ids)
+        self.assertNotIn(inmate.pk, pairs.get_pool(non_murder).ids)
+        self.assertTrue(pairs.is_member(murder, inmate.pk))
@@ -1,23 +1,28 @@
+from datetime import datetime, timezone
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.http import Http404, HttpResponse, JsonResponse
 from django.shortcuts import render, redirect
+from django.urls import reverse
+from django.utils.cache import patch_cache_control
+from django.utils.crypto import constant_time_compare
+from django.utils.http import http_date, quote_etag
+from django.views.decorators.cache import never_cache
+from django.views.decorators.http import condition, require_GET, require_POST
 from django.contrib import messages
 from django.contrib.admin.views.decorators import staff_member_required
-from core.models import (
-    Inmate, Charge,
-    ChildAbuseIndex, NonChildAbuseIndex,
-    LeaderboardEntry,
-    MurderIndex, NonMurderIndex,
-    CannabisIndex, CocaineFentanylIndex
-)
-from core.services.scraper import run_scrape, fetch_inmate_details
-import random
-from django.db.models import Q
+from core.models import Inmate, LeaderboardEntry, Job
+from core.services.jobs import enqueue, eta_seconds
+from core.services import classify, gamestate, images, metrics, leaderboard as boards
+from core.services.modes import MODES, get_mode
+import secrets
 import string
 
 
 # ========== HOME ==========
 def home(request):
     """Pagina iniziale con i pulsanti/modalità."""
-    return render(request, "core/home.html")
+    return render(request, "core/home.html", {"modes": MODES.values()})
 
 
 # ========== UPDATE DB ==========
@@ -48,522 +53,336 @@ def update_db(request):
     else:
         filters = list({c for c in raw_filters if c.isalpha()})
 
-    stats = run_scrape(filters=filters, limit=limit, reset=True, verbose=True)
-    messages.success(request,
-                     f"DB aggiornato: scanned={stats['scanned']}, created={stats['created']}, updated={stats['updated']}")
-    return redirect("home")
+    # di default aggiornamento incrementale: il gioco resta giocabile durante lo scrape
+    params = {
+        "filters": filters,
+        "limit": limit,
+        "reset": request.POST.get("reset") == "1",
+        "recheck": request.POST.get("recheck") == "1",
+    }
+    _enqueue_job(request, "scrape", params)
+    return redirect("job_status")
 
 
-# ========== FUNZIONE SUPPORTO PER IMMAGINI ==========
-def get_inmate_image(inmate):
-    """Ritorna il campo IMAGE (base64) live dal servizio remoto"""
-    details = fetch_inmate_details(inmate.booking_number)
-    return details.get("IMAGE", "") or details.get("Image", "")
+# ========== JOB IN BACKGROUND ==========
+def _enqueue_job(request, kind, params=None):
+    job, created = enqueue(kind, params)
+    if created:
+        messages.success(request, f"Job #{job.pk} ({job.get_kind_display()}) accodato.")
+    else:
+        messages.info(request, f"Job #{job.pk} ({job.get_kind_display()}) già {job.get_status_display().lower()}.")
+    return job
 
 
-# ========== FILTRO CHILD ==========
 @staff_member_required
-def run_filters(request):
-    if request.method != "POST":
-        return redirect("home")
+def job_status(request):
+    jobs = list(Job.objects.all()[:20])
+    for job in jobs:
+        job.eta = eta_seconds(job)
+    return render(request, "core/jobs.html", {"jobs": jobs})
 
-    if Inmate.objects.count() == 0:
-        messages.info(request, "Database vuoto: premi prima 'Aggiorna database', poi 'Filtra'.")
-        return redirect("home")
 
-    ChildAbuseIndex.objects.all().delete()
-    NonChildAbuseIndex.objects.all().delete()
+# ========== METRICHE ==========
+def _metrics_response(request):
+    return HttpResponse(metrics.render(), content_type="text/plain; version=0.0.4; charset=utf-8")
 
-    secondary_keywords = [
-        "assault", "sex", "sexual", "abuse", "molest", "exploitation",
-        "pornograph", "indecent", "lewd", "lascivious", "battery",
-        "neglect", "endangerment", "solicitation", "entice", "incest",
-        "rape", "sodomy", "traffick", "conduct", "exposure", "fondling",
-        "statutory", "child abuse", "child neglect", "child porn", "video"
-    ]
 
-    second_q = Q()
-    for kw in secondary_keywords:
-        second_q |= Q(charge__icontains=kw)
+_metrics_staff = staff_member_required(_metrics_response)
 
-    matching = Charge.objects.filter(
-        Q(charge__icontains="child") & second_q
-    ).values_list("inmate_id", flat=True).distinct()
 
-    child_inmate_ids = set(matching)
-
-    child_inmates = Inmate.objects.filter(id__in=child_inmate_ids)
-    non_child_inmates = Inmate.objects.exclude(id__in=child_inmate_ids)
-
-    ChildAbuseIndex.objects.bulk_create(
-        [ChildAbuseIndex(inmate=i) for i in child_inmates],
-        ignore_conflicts=True,
-    )
-    NonChildAbuseIndex.objects.bulk_create(
-        [NonChildAbuseIndex(inmate=i) for i in non_child_inmates],
-        ignore_conflicts=True,
-    )
-
-    messages.success(
-        request,
-        f"Filtri applicati: child_abuse={child_inmates.count()}, non_child={non_child_inmates.count()}"
-    )
-    return redirect("home")
+@never_cache
+@require_GET
+def metrics_export(request):
+    """Metriche del processo in formato Prometheus: staff, oppure 'Authorization: Bearer <METRICS_TOKEN>'."""
+    token = getattr(settings, "METRICS_TOKEN", "")
+    if token and constant_time_compare(request.headers.get("Authorization", ""), f"Bearer {token}"):
+        return _metrics_response(request)
+    return _metrics_staff(request)
 
 
-# ========== SESSIONE CHILD ==========
-def _child_mode_reset_session(request):
-    request.session["lives"] = 3
-    request.session["streak"] = 0
-    request.session["score"] = 0
-    request.session["mult"] = 1
-    request.session["seen_child_ids"] = []
-    request.session["seen_non_child_ids"] = []
-    request.session.pop("current_pair", None)
-    request.session.modified = True
+# ========== IMMAGINI ==========
+def _image_etag_value(sha, variant, ext):
+    return f"{sha[:20]}-{variant}.{ext}"
 
 
-def _calc_multiplier(streak: int) -> int:
-    if streak >= 15:
-        return 10
-    if streak >= 10:
-        return 4
-    if streak >= 5:
-        return 2
-    return 1
+def _image_etag(request, booking_number, variant, ext):
+    hit = images.lookup(booking_number)
+    return _image_etag_value(hit[0], variant, ext) if hit else None
 
 
-def _pick_pair(request):
-    seen_child = set(request.session.get("seen_child_ids", []))
-    seen_non = set(request.session.get("seen_non_child_ids", []))
+def _image_last_modified(request, booking_number, variant, ext):
+    hit = images.lookup(booking_number)
+    if not hit:
+        return None
+    return datetime.fromtimestamp(hit[1].stat().st_mtime, tz=timezone.utc)
 
-    child_qs = Inmate.objects.filter(idx_child_abuse__isnull=False)
-    non_qs = Inmate.objects.filter(idx_non_child_abuse__isnull=False)
 
-    child_ids = list(child_qs.values_list("id", flat=True))
-    non_ids = list(non_qs.values_list("id", flat=True))
-
-    avail_child = [i for i in child_ids if i not in seen_child]
-    avail_non = [i for i in non_ids if i not in seen_non]
-
-    if not avail_child or not avail_non:
-        return None, None
-
-    child_id = random.choice(avail_child)
-    non_id = random.choice(avail_non)
-
-    child = Inmate.objects.get(id=child_id)
-    non = Inmate.objects.get(id=non_id)
-    return child, non
-
-
-def child_mode_start(request):
-    _child_mode_reset_session(request)
-    return redirect("child_mode_play")
-
-
-def child_mode_play(request):
-    child, non = _pick_pair(request)
-    if not child or not non:
-        return redirect("child_mode_gameover")
-
-    left_is_child = random.choice([True, False])
-    left = child if left_is_child else non
-    right = non if left_is_child else child
-
-    request.session["current_pair"] = {
-        "left_id": left.id,
-        "right_id": right.id,
-        "child_id": child.id,
-        "non_id": non.id,
-        "left_is_child": left_is_child,
-    }
-    seen_child = set(request.session.get("seen_child_ids", []))
-    seen_non = set(request.session.get("seen_non_child_ids", []))
-    seen_child.add(child.id)
-    seen_non.add(non.id)
-    request.session["seen_child_ids"] = list(seen_child)
-    request.session["seen_non_child_ids"] = list(seen_non)
-    request.session.modified = True
-
-    ctx = {
-        "left": left,
-        "right": right,
-        "left_img": get_inmate_image(left),
-        "right_img": get_inmate_image(right),
-        "lives": request.session["lives"],
-        "streak": request.session["streak"],
-        "score": request.session["score"],
-        "mult": request.session["mult"],
-    }
-    return render(request, "core/child_mode_play.html", ctx)
-
-
-def child_mode_choose(request):
-    if request.method != "POST":
-        return redirect("child_mode_play")
-
-    pair = request.session.get("current_pair")
-    if not pair:
-        return redirect("child_mode_play")
-
-    side = request.POST.get("side")
-    is_correct = (side == "left" and pair["left_is_child"]) or (side == "right" and not pair["left_is_child"])
-
-    lives = request.session.get("lives", 3)
-    streak = request.session.get("streak", 0)
-    score = request.session.get("score", 0)
-
-    if is_correct:
-        streak += 1
-        mult = _calc_multiplier(streak)
-        score += 1 * mult
-        if streak % 5 == 0 and lives < 5:
-            lives += 1
-    else:
-        lives = max(lives - 1, 0)
-        streak = 0
-
-    mult = _calc_multiplier(streak)
-    request.session["lives"] = lives
-    request.session["streak"] = streak
-    request.session["score"] = score
-    request.session["mult"] = mult
-    request.session.modified = True
-
-    if lives == 0:
-        return redirect("child_mode_gameover")
-    return redirect("child_mode_play")
-
-
-def child_mode_gameover(request):
-    score = request.session.get("score", 0)
-    request.session["final_score"] = score
-    request.session["mode"] = "child"
-    request.session.modified = True
-    return render(request, "core/child_mode_gameover.html", {"final_score": score})
-
-
-# ========== LEADERBOARD ==========
-def leaderboard(request, mode="child"):
-    if mode not in ("child", "murder", "drugs"):
-        mode = "child"
-    entries = LeaderboardEntry.objects.filter(mode=mode)[:50]
-    return render(request, "core/leaderboard.html", {"entries": entries, "mode": mode})
-
-
-def leaderboard_submit(request):
-    if request.method == "POST":
-        name = request.POST.get("name", "").strip()
-        score = request.session.get("final_score", 0)
-        mode = request.session.get("mode", "child")
-
-        if score > 0:
-            LeaderboardEntry.objects.create(
-                name=name if name else "Anonimo",
-                score=score,
-                mode=mode
-            )
-        return redirect("leaderboard", mode=mode)
-    return redirect("home")
-
-
-# ========== FILTRO MURDER ==========
+def _read_variant(booking_number, variant, ext, fetch):
+    hit = images.get_variant(booking_number, variant, ext, fetch=fetch)
+    if hit is None:
+        return None
+    sha, path = hit
+    try:
+        return sha, path.read_bytes()
+    except OSError:
+        return None
+
+
+@condition(etag_func=_image_etag, last_modified_func=_image_last_modified)
+async def inmate_image(request, booking_number, variant, ext):
+    """
+    Foto del detenuto dalla cache su disco (scaricata al volo solo se manca).
+    variant: orig | h280 | h560 ; ext: jpg | webp. ETag/Last-Modified => 304 dal browser/CDN.
+    Vista async: sotto ASGI un fetch remoto lento non blocca il worker.
+    Si scarica solo per i detenuti noti: il controllo sul DB gira nel thread sync,
+    il fetch (che non tocca il DB) in un thread a parte.
+    """
+    fetch = images.lookup(booking_number) is None and await sync_to_async(images.known)(booking_number)
+    hit = await sync_to_async(_read_variant, thread_sensitive=False)(booking_number, variant, ext, fetch)
+    if hit is None:
+        raise Http404("Immagine non disponibile")
+    sha, data = hit
+    response = HttpResponse(data, content_type=images.FORMATS[ext][1])
+    # al primo accesso (cache miss) il decoratore non ha potuto calcolarli
+    response["ETag"] = quote_etag(_image_etag_value(sha, variant, ext))
+    last_modified = _image_last_modified(request, booking_number, variant, ext)
+    if last_modified:
+        response["Last-Modified"] = http_date(last_modified.timestamp())
+    patch_cache_control(response, public=True, max_age=24 * 3600)
+    return response
+
+
+# ========== FILTRI ==========
 @staff_member_required
-def run_filters_murder(request):
+def run_filters(request):
+    """Accoda la ricostruzione delle categorie: POST category=<categoria>, vuota = tutte."""
     if request.method != "POST":
         return redirect("home")
 
-    if Inmate.objects.count() == 0:
-        messages.info(request, "Database vuoto: premi prima 'Aggiorna database', poi 'Filtra Murder'.")
+    category = request.POST.get("category", "")
+    if category and category not in classify.CATEGORIES:
+        messages.error(request, f"Categoria sconosciuta: {category}.")
         return redirect("home")
 
-    MurderIndex.objects.all().delete()
-    NonMurderIndex.objects.all().delete()
-
-    murder_ids = set(
-        Charge.objects.filter(charge__icontains="murder")
-        .values_list("inmate_id", flat=True)
-        .distinct()
-    )
-
-    murder_inmates = Inmate.objects.filter(id__in=murder_ids)
-    non_murder_inmates = Inmate.objects.exclude(id__in=murder_ids)
-
-    MurderIndex.objects.bulk_create([MurderIndex(inmate=i) for i in murder_inmates], ignore_conflicts=True)
-    NonMurderIndex.objects.bulk_create([NonMurderIndex(inmate=i) for i in non_murder_inmates], ignore_conflicts=True)
-
-    messages.success(
-        request,
-        f"Filtri Murder applicati: murder={murder_inmates.count()}, non_murder={non_murder_inmates.count()}"
-    )
-    return redirect("home")
-
-
-# ========== MODALITÀ MURDER ==========
-def _murder_reset_session(request):
-    request.session["m_lives"] = 3
-    request.session["m_streak"] = 0
-    request.session["m_score"] = 0
-    request.session["m_mult"] = 1
-    request.session["m_seen_murder_ids"] = []
-    request.session["m_seen_non_murder_ids"] = []
-    request.session.pop("m_current_pair", None)
-    request.session.modified = True
-
-
-def _murder_calc_multiplier(streak: int) -> int:
-    if streak >= 15: return 10
-    if streak >= 10: return 4
-    if streak >= 5: return 2
-    return 1
-
-
-def _murder_pick_pair(request):
-    seen_m = set(request.session.get("m_seen_murder_ids", []))
-    seen_n = set(request.session.get("m_seen_non_murder_ids", []))
-
-    m_qs = Inmate.objects.filter(idx_murder__isnull=False)
-    n_qs = Inmate.objects.filter(idx_non_murder__isnull=False)
+    if not Inmate.objects.exists():
+        messages.info(request, "Database vuoto: premi prima 'Aggiorna database', poi 'Filtra'.")
+        return redirect("home")
 
-    m_ids = [i for i in m_qs.values_list("id", flat=True) if i not in seen_m]
-    n_ids = [i for i in n_qs.values_list("id", flat=True) if i not in seen_n]
-    if not m_ids or not n_ids:
-        return None, None
+    _enqueue_job(request, "filters", {"categories": [category] if category else []})
+    return redirect("job_status")
 
-    m_id = random.choice(m_ids)
-    n_id = random.choice(n_ids)
-    return Inmate.objects.get(id=m_id), Inmate.objects.get(id=n_id)
 
+# ========== MODALITÀ DI GIOCO (motore unico, vedi core/services/modes.py) ==========
+def _get_mode_or_404(key):
+    mode = get_mode(key)
+    if mode is None:
+        raise Http404("Modalità inesistente")
+    return mode
 
-def murder_mode_start(request):
-    _murder_reset_session(request)
-    return redirect("murder_mode_play")
 
+def mode_start(request, mode):
+    mode = _get_mode_or_404(mode)
+    return gamestate.save(request, redirect("mode_play", mode=mode.key), mode.state_key, mode.new_game())
 
-def murder_mode_play(request):
-    m, n = _murder_pick_pair(request)
-    if not m or not n:
-        return render(request, "core/murder_mode_empty.html")
 
-    left_is_murder = random.choice([True, False])
-    left = m if left_is_murder else n
-    right = n if left_is_murder else m
+def mode_play(request, mode):
+    mode = _get_mode_or_404(mode)
+    game = gamestate.load(request, mode.state_key)
+    if game is None:
+        return redirect("mode_start", mode=mode.key)
 
-    request.session["m_current_pair"] = {
-        "left_id": left.id, "right_id": right.id,
-        "murder_id": m.id, "non_id": n.id,
-        "left_is_murder": left_is_murder,
-    }
-    sm = set(request.session.get("m_seen_murder_ids", [])); sm.add(m.id)
-    sn = set(request.session.get("m_seen_non_murder_ids", [])); sn.add(n.id)
-    request.session["m_seen_murder_ids"] = list(sm)
-    request.session["m_seen_non_murder_ids"] = list(sn)
-    request.session.modified = True
+    pair, upcoming = mode.next_pair_ahead(game)
+    if pair is None:
+        if mode.rounds_played(game):
+            # partita già iniziata: coppie esaurite => game over
+            return gamestate.save(request, redirect("mode_gameover", mode=mode.key), mode.state_key, game)
+        return render(request, "core/mode_empty.html", {"mode": mode, "counts": mode.counts()})
 
+    left, right = pair
     ctx = {
-        "left": left, "right": right,
-        "left_img": get_inmate_image(left),
-        "right_img": get_inmate_image(right),
-        "lives": request.session["m_lives"],
-        "streak": request.session["m_streak"],
-        "score": request.session["m_score"],
-        "mult": request.session["m_mult"],
+        "mode": mode,
+        "left": left,
+        "right": right,
+        "sides": (("left", left), ("right", right)),
+        "lives": game["lives"],
+        "streak": game["streak"],
+        "score": game["score"],
+        "mult": game["mult"],
+        "prefetch": _prefetch_urls(mode, game, upcoming),
     }
-    return render(request, "core/murder_mode_play.html", ctx)
-
-
-def murder_mode_choose(request):
-    if request.method != "POST":
-        return redirect("murder_mode_play")
-    pair = request.session.get("m_current_pair")
-    if not pair:
-        return redirect("murder_mode_play")
-    side = request.POST.get("side")
-    is_correct = (side == "left" and pair["left_is_murder"]) or (side == "right" and not pair["left_is_murder"])
-
-    lives = request.session.get("m_lives", 3)
-    streak = request.session.get("m_streak", 0)
-    score = request.session.get("m_score", 0)
-
-    if is_correct:
-        streak += 1
-        mult = _murder_calc_multiplier(streak)
-        score += 1 * mult
-        if streak % 5 == 0 and lives < 5:
-            lives += 1
-    else:
-        lives = max(lives - 1, 0)
-        streak = 0
-
-    mult = _murder_calc_multiplier(streak)
-    request.session["m_lives"] = lives
-    request.session["m_streak"] = streak
-    request.session["m_score"] = score
-    request.session["m_mult"] = mult
-    request.session.modified = True
-
-    if lives == 0:
-        return redirect("murder_mode_gameover")
-    return redirect("murder_mode_play")
-
-
-def murder_mode_gameover(request):
-    score = request.session.get("m_score", 0)
-    request.session["final_score"] = score
-    request.session["mode"] = "murder"
-    return render(request, "core/murder_mode_gameover.html", {"final_score": score})
+    return gamestate.save(request, render(request, "core/mode_play.html", ctx), mode.state_key, game)
 
 
-# ========== FILTRO DRUGS ==========
-@staff_member_required
-def run_filters_drugs(request):
+def mode_choose(request, mode):
+    mode = _get_mode_or_404(mode)
     if request.method != "POST":
-        return redirect("home")
-
-    if Inmate.objects.count() == 0:
-        messages.info(request, "Database vuoto: premi prima 'Aggiorna database', poi 'Filtra Drugs'.")
-        return redirect("home")
-
-    CannabisIndex.objects.all().delete()
-    CocaineFentanylIndex.objects.all().delete()
-
-    cannabis_ids = set(
-        Charge.objects.filter(charge__icontains="cannabis")
-        .values_list("inmate_id", flat=True)
-    )
-    cocaine_ids = set(
-        Charge.objects.filter(
-            Q(charge__icontains="cocaine") | Q(charge__icontains="fentanyl")
-        ).values_list("inmate_id", flat=True)
-    )
-
-    cannabis_inmates = Inmate.objects.filter(id__in=cannabis_ids)
-    cocaine_inmates = Inmate.objects.filter(id__in=cocaine_ids)
+        return redirect("mode_play", mode=mode.key)
+
+    game = gamestate.load(request, mode.state_key)
+    if not game or not game.get("pair"):
+        return redirect("mode_play", mode=mode.key)
+
+    mode.answer(game, request.POST.get("side"))
+
+    if game["lives"] == 0:
+        return gamestate.save(request, redirect("mode_gameover", mode=mode.key), mode.state_key, game)
+    return gamestate.save(request, redirect("mode_play", mode=mode.key), mode.state_key, game)
+
+
+def mode_gameover(request, mode):
+    """
+    Fine partita: il punteggio passa dal cookie di gioco a "final" (con l'id della
+    partita, che leaderboard_submit accetta una volta sola) e la partita si chiude.
+    Ricaricare la pagina mostra il "final" già emesso.
+    """
+    mode = _get_mode_or_404(mode)
+    game = gamestate.load(request, mode.state_key)
+    if game and game.get("lives", 0) > 0:
+        return redirect("mode_play", mode=mode.key)        # partita ancora in corso
+
+    final = None
+    if game and game.get("id"):
+        final = {"id": game["id"], "score": game.get("score", 0), "mode": mode.key}
+    elif not game:
+        final = gamestate.load(request, "final")
+        if final and final.get("mode") != mode.key:
+            final = None
+    response = render(request, "core/mode_gameover.html",
+                      {"mode": mode, "final_score": final["score"] if final else 0})
+    if game:
+        gamestate.save(request, response, "final", final)
+        gamestate.save(request, response, mode.state_key, None)
+    return response
+
+
+# ========== API JSON DI GIOCO (un round = una richiesta) ==========
+def _image_urls(booking):
+    return {
+        f"{ext}{suffix}": reverse("inmate_image", args=[booking, variant, ext])
+        for ext in ("webp", "jpg")
+        for variant, suffix in (("h280", ""), ("h560", "2x"))
+    }
 
-    CannabisIndex.objects.bulk_create([CannabisIndex(inmate=i) for i in cannabis_inmates], ignore_conflicts=True)
-    CocaineFentanylIndex.objects.bulk_create([CocaineFentanylIndex(inmate=i) for i in cocaine_inmates], ignore_conflicts=True)
 
-    messages.success(
-        request,
-        f"Filtri Drugs applicati: cannabis={cannabis_inmates.count()}, cocaine/fentanyl={cocaine_inmates.count()}"
+def _inmate_payload(inmate):
+    return {"name": f"{inmate.last_name}, {inmate.first_name}", "images": _image_urls(inmate.booking_number)}
+
+
+def _prefetch_urls(mode, game, upcoming=None):
+    """
+    Immagini della coppia successiva, da scaldare mentre il giocatore decide.
+    upcoming: i detenuti già caricati da next_pair_ahead (None => una query sui peek).
+    """
+    if upcoming is not None:
+        return [_image_urls(inmate.booking_number) for inmate in upcoming]
+    ids = mode.peek(game)
+    if not ids:
+        return []
+    bookings = Inmate.objects.filter(id__in=ids).values_list("booking_number", flat=True)
+    return [_image_urls(booking) for booking in bookings]
+
+
+def _round_payload(mode, game, pair, upcoming=None):
+    """Stato + coppia da mostrare (o fine partita) + prefetch della coppia dopo."""
+    payload = {"state": {k: game[k] for k in ("lives", "streak", "score", "mult")}}
+    if pair is None:
+        payload["gameover"] = True
+        payload["gameover_url"] = reverse("mode_gameover", args=[mode.key])
+        return payload
+    left, right = pair
+    payload.update(
+        gameover=False,
+        pair={"left": _inmate_payload(left), "right": _inmate_payload(right)},
+        prefetch=_prefetch_urls(mode, game, upcoming),
     )
-    return redirect("home")
-
-
-# ========== MODALITÀ DRUGS ==========
-def _drugs_reset_session(request):
-    request.session["d_lives"] = 3
-    request.session["d_streak"] = 0
-    request.session["d_score"] = 0
-    request.session["d_mult"] = 1
-    request.session["d_seen_cannabis"] = []
-    request.session["d_seen_cocaine"] = []
-    request.session.pop("d_current_pair", None)
-    request.session.modified = True
-
+    return payload
 
-def _drugs_calc_multiplier(streak: int) -> int:
-    if streak >= 15: return 10
-    if streak >= 10: return 4
-    if streak >= 5: return 2
-    return 1
 
+def _json_with_state(request, mode, game, payload, status=200):
+    return gamestate.save(request, JsonResponse(payload, status=status), mode.state_key, game)
 
-def _drugs_pick_pair(request):
-    seen_c = set(request.session.get("d_seen_cannabis", []))
-    seen_cf = set(request.session.get("d_seen_cocaine", []))
 
-    c_qs = Inmate.objects.filter(idx_cannabis__isnull=False)
-    cf_qs = Inmate.objects.filter(idx_cocaine_fentanyl__isnull=False)
+@require_POST
+def api_mode_start(request, mode):
+    mode = _get_mode_or_404(mode)
+    game = mode.new_game()
+    pair, upcoming = mode.next_pair_ahead(game)
+    if pair is None:
+        return JsonResponse({"error": "empty", "counts": mode.counts()}, status=409)
+    return _json_with_state(request, mode, game, _round_payload(mode, game, pair, upcoming))
 
-    c_ids = [i for i in c_qs.values_list("id", flat=True) if i not in seen_c]
-    cf_ids = [i for i in cf_qs.values_list("id", flat=True) if i not in seen_cf]
 
-    if not c_ids or not cf_ids:
-        return None, None
+@require_GET
+def api_mode_next(request, mode):
+    """Coppia corrente (idempotente: ricaricare non salta coppie), o una nuova se non c'è."""
+    mode = _get_mode_or_404(mode)
+    game = gamestate.load(request, mode.state_key)
+    if game is None:
+        return JsonResponse({"error": "no_game", "start_url": reverse("api_mode_start", args=[mode.key])}, status=409)
+    pair = mode.current_pair(game) or mode.next_pair(game)
+    return _json_with_state(request, mode, game, _round_payload(mode, game, pair))
 
-    c_id = random.choice(c_ids)
-    cf_id = random.choice(cf_ids)
-    return Inmate.objects.get(id=c_id), Inmate.objects.get(id=cf_id)
 
+@require_POST
+def api_mode_answer(request, mode):
+    """Verdetto della risposta + coppia successiva nella stessa risposta."""
+    mode = _get_mode_or_404(mode)
+    game = gamestate.load(request, mode.state_key)
+    if not game or not game.get("pair"):
+        return JsonResponse({"error": "no_pair"}, status=409)
 
-def drugs_mode_start(request):
-    _drugs_reset_session(request)
-    return redirect("drugs_mode_play")
+    correct = mode.answer(game, request.POST.get("side"))
+    pair, upcoming = (None, []) if game["lives"] == 0 else mode.next_pair_ahead(game)
+    payload = _round_payload(mode, game, pair, upcoming)
+    payload["correct"] = correct
+    return _json_with_state(request, mode, game, payload)
 
 
-def drugs_mode_play(request):
-    c, cf = _drugs_pick_pair(request)
-    if not c or not cf:
-        return render(request, "core/drugs_mode_empty.html")
+# ========== LEADERBOARD ==========
+def leaderboard(request, mode="child"):
+    if mode not in MODES:
+        mode = "child"
+    entries = boards.with_own(boards.top(mode), gamestate.load(request, "own"), mode)
+    return render(request, "core/leaderboard.html", {"entries": entries, "mode": mode, "modes": MODES.values()})
 
-    left_is_cannabis = random.choice([True, False])
-    left = c if left_is_cannabis else cf
-    right = cf if left_is_cannabis else c
 
-    request.session["d_current_pair"] = {
-        "left_id": left.id, "right_id": right.id,
-        "cannabis_id": c.id, "cocaine_id": cf.id,
-        "left_is_cannabis": left_is_cannabis,
-    }
-    sc = set(request.session.get("d_seen_cannabis", [])); sc.add(c.id)
-    scf = set(request.session.get("d_seen_cocaine", [])); scf.add(cf.id)
-    request.session["d_seen_cannabis"] = list(sc)
-    request.session["d_seen_cocaine"] = list(scf)
-    request.session.modified = True
-
-    ctx = {
-        "left": left, "right": right,
-        "left_img": get_inmate_image(left),
-        "right_img": get_inmate_image(right),
-        "lives": request.session["d_lives"],
-        "streak": request.session["d_streak"],
-        "score": request.session["d_score"],
-        "mult": request.session["d_mult"],
-    }
-    return render(request, "core/drugs_mode_play.html", ctx)
+def leaderboard_rank(request, mode):
+    """API: posizione che otterrebbe ?score=N (o quella di ?entry=<id>) nella modalità."""
+    if mode not in MODES:
+        raise Http404("Modalità inesistente")
+    entry_id = request.GET.get("entry")
+    try:
+        if entry_id:
+            entry = LeaderboardEntry.objects.get(pk=int(entry_id), mode=mode)
+            rank = boards.rank_of(mode, entry.score, entry.created_at)
+            score = entry.score
+        else:
+            score = int(request.GET.get("score", ""))
+            rank = boards.rank_of(mode, score)
+    except (ValueError, LeaderboardEntry.DoesNotExist):
+        return JsonResponse({"error": "score o entry non validi"}, status=400)
+    return JsonResponse({"mode": mode, "score": score, "rank": rank, "total": boards.total(mode)})
 
 
-def drugs_mode_choose(request):
-    if request.method != "POST":
-        return redirect("drugs_mode_play")
-    pair = request.session.get("d_current_pair")
-    if not pair:
-        return redirect("drugs_mode_play")
-
-    side = request.POST.get("side")
-    is_correct = (side == "left" and pair["left_is_cannabis"]) or (side == "right" and not pair["left_is_cannabis"])
-
-    lives = request.session.get("d_lives", 3)
-    streak = request.session.get("d_streak", 0)
-    score = request.session.get("d_score", 0)
-
-    if is_correct:
-        streak += 1
-        mult = _drugs_calc_multiplier(streak)
-        score += 1 * mult
-        if streak % 5 == 0 and lives < 5:
-            lives += 1
-    else:
-        lives = max(lives - 1, 0)
-        streak = 0
-
-    mult = _drugs_calc_multiplier(streak)
-    request.session["d_lives"] = lives
-    request.session["d_streak"] = streak
-    request.session["d_score"] = score
-    request.session["d_mult"] = mult
-    request.session.modified = True
-
-    if lives == 0:
-        return redirect("drugs_mode_gameover")
-    return redirect("drugs_mode_play")
-
-
-def drugs_mode_gameover(request):
-    score = request.session.get("d_score", 0)
-    request.session["final_score"] = score
-    request.session["mode"] = "drugs"
-    request.session.modified = True
-    return render(request, "core/drugs_mode_gameover.html", {"final_score": score})
+def leaderboard_submit(request):
+    if request.method == "POST":
+        name = request.POST.get("name", "").strip()
+        final = gamestate.load(request, "final") or {}
+        score = final.get("score", 0)
+        mode = final.get("mode", "child")
+
+        response = redirect("leaderboard", mode=mode)
+        if score > 0 and final.get("id"):
+            # un cookie "final" rigiocato (o un doppio click) non aggiunge altre righe
+            claim = secrets.token_urlsafe(8)
+            if gamestate.once("final", final["id"], claim) != claim:
+                messages.info(request, "Punteggio già registrato.")
+                return gamestate.save(request, response, "final", None)
+            entry = boards.submit(name, score, mode)
+            rank = boards.rank_of(mode, entry.score, entry.created_at)
+            messages.success(request, f"Sei arrivato #{rank} con {entry.score} punti!")
+            # il punteggio si invia una volta sola
+            gamestate.save(request, response, "final", None)
+            gamestate.save(request, response, "own", boards.own_entry(entry))
+        return response
+    return redirect("home")
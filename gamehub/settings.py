@@ -41,7 +41,9 @@ INSTALLED_APPS = [
 MIDDLEWARE = [
     'django.middleware.security.SecurityMiddleware',
     "whitenoise.middleware.WhiteNoiseMiddleware",  # whitenoise PRIMA delle sessioni
+    "core.middleware.ServerTimingMiddleware",      # Server-Timing + metriche: esterno alla sessione...
     'django.contrib.sessions.middleware.SessionMiddleware',
+    "core.middleware.SessionTimingMarker",         # ...e marker interno: in mezzo c'è il salvataggio sessione
     'django.middleware.common.CommonMiddleware',
     'django.middleware.csrf.CsrfViewMiddleware',
     'django.contrib.auth.middleware.AuthenticationMiddleware',
@@ -56,7 +58,7 @@ ROOT_URLCONF = 'gamehub.urls'
 # -------------------------------------------------------------------
 TEMPLATES = [
     {
-        'BACKEND': 'django.template.backends.django.DjangoTemplates',
+        'BACKEND': 'core.services.metrics.TimedDjangoTemplates',  # DjangoTemplates + fase 'render'
         'DIRS': [BASE_DIR / "templates"],  # cartella templates a livello progetto
         'APP_DIRS': True,
         'OPTIONS': {
@@ -65,6 +67,7 @@ TEMPLATES = [
                 'django.template.context_processors.request',
                 'django.contrib.auth.context_processors.auth',
                 'django.contrib.messages.context_processors.messages',
+                'core.context_processors.filter_categories',
             ],
         },
     },
@@ -115,4 +118,92 @@ MEDIA_ROOT = BASE_DIR / "media"
 # -------------------------------------------------------------------
 # Primary key default
 # -------------------------------------------------------------------
-DEFAULT_AUTO_FIELD = 'django.db.models.BigAutoField'
\ No newline at end of file
+DEFAULT_AUTO_FIELD = 'django.db.models.BigAutoField'
+
+# -------------------------------------------------------------------
+# Scraper
+# -------------------------------------------------------------------
+# Endpoint BestJail (getInmates / getInmateDetails / getCharges). Per i benchmark
+# si può puntare a un replay locale (python manage.py bench_scrape lo fa da sé).
+SCRAPER_BASE_URL = os.environ.get("SCRAPER_BASE_URL", "https://netapps.ocfl.net/BestJail/Home/")
+# Thread che scaricano details/charges in parallelo e limite req/s verso netapps.ocfl.net
+SCRAPER_WORKERS = int(os.environ.get("SCRAPER_WORKERS", "8"))
+SCRAPER_RATE_LIMIT = float(os.environ.get("SCRAPER_RATE_LIMIT", "10"))
+# Detenuti scritti per transazione (upsert Inmate + sostituzione Charge)
+SCRAPER_BATCH_SIZE = int(os.environ.get("SCRAPER_BATCH_SIZE", "200"))
+# Retry per richiesta (backoff esponenziale con jitter, rispetta 429/Retry-After)
+SCRAPER_RETRIES = int(os.environ.get("SCRAPER_RETRIES", "4"))
+SCRAPER_RETRY_BASE = float(os.environ.get("SCRAPER_RETRY_BASE", "0.5"))          # secondi
+SCRAPER_RETRY_MAX_WAIT = float(os.environ.get("SCRAPER_RETRY_MAX_WAIT", "30"))   # secondi
+# Giri extra a fine scrape per i booking ancora falliti
+SCRAPER_REDRIVE_ROUNDS = int(os.environ.get("SCRAPER_REDRIVE_ROUNDS", "1"))
+
+# -------------------------------------------------------------------
+# Chiamate live dalle pagine: foto mancanti (core/services/upstream.py)
+# -------------------------------------------------------------------
+UPSTREAM_CONNECT_TIMEOUT = float(os.environ.get("UPSTREAM_CONNECT_TIMEOUT", "3"))  # secondi
+UPSTREAM_READ_TIMEOUT = float(os.environ.get("UPSTREAM_READ_TIMEOUT", "5"))        # secondi
+UPSTREAM_POOL_SIZE = int(os.environ.get("UPSTREAM_POOL_SIZE", "16"))               # connessioni keep-alive
+UPSTREAM_BREAKER_FAILURES = int(os.environ.get("UPSTREAM_BREAKER_FAILURES", "5"))  # errori di fila => circuito aperto
+UPSTREAM_BREAKER_COOLDOWN = float(os.environ.get("UPSTREAM_BREAKER_COOLDOWN", "30"))  # secondi prima di riprovare
+
+# -------------------------------------------------------------------
+# Job in background (python manage.py run_jobs)
+# -------------------------------------------------------------------
+# Un job 'running' senza heartbeat da più di N secondi viene rimesso in coda
+JOBS_STALE_AFTER = int(os.environ.get("JOBS_STALE_AFTER", "300"))
+
+# -------------------------------------------------------------------
+# Cache foto detenuti (core/services/images.py)
+# -------------------------------------------------------------------
+IMAGE_CACHE_DIR = Path(os.environ.get("IMAGE_CACHE_DIR", BASE_DIR / "cache" / "images"))
+IMAGE_CACHE_MAX_BYTES = int(os.environ.get("IMAGE_CACHE_MAX_BYTES", str(512 * 1024 * 1024)))
+IMAGE_CACHE_TTL = int(os.environ.get("IMAGE_CACHE_TTL", str(7 * 24 * 3600)))  # secondi
+
+# -------------------------------------------------------------------
+# Pool coppie delle modalità di gioco (core/services/pairs.py)
+# -------------------------------------------------------------------
+PAIR_POOL_TTL = int(os.environ.get("PAIR_POOL_TTL", "60"))  # secondi prima di ricaricare gli id
+
+# -------------------------------------------------------------------
+# Cache (classifiche, generazione dei pool coppie)
+# -------------------------------------------------------------------
+# REDIS_URL => cache condivisa tra i worker gunicorn; altrimenti memoria locale per processo
+if os.environ.get("REDIS_URL"):
+    CACHES = {
+        "default": {
+            "BACKEND": "django.core.cache.backends.redis.RedisCache",
+            "LOCATION": os.environ["REDIS_URL"],
+        }
+    }
+else:
+    CACHES = {
+        "default": {
+            "BACKEND": "django.core.cache.backends.locmem.LocMemCache",
+            "LOCATION": "gamehub",
+        }
+    }
+LEADERBOARD_CACHE_TTL = int(os.environ.get("LEADERBOARD_CACHE_TTL", "300"))  # secondi
+
+# -------------------------------------------------------------------
+# Submit classifica bufferizzati (write-behind, core/services/leaderboard.py)
+# -------------------------------------------------------------------
+LEADERBOARD_BUFFERED = os.environ.get("LEADERBOARD_BUFFERED", "False") == "True"
+LEADERBOARD_FLUSH_EVERY = int(os.environ.get("LEADERBOARD_FLUSH_EVERY", "50"))   # righe
+LEADERBOARD_FLUSH_MS = int(os.environ.get("LEADERBOARD_FLUSH_MS", "1000"))       # millisecondi
+LEADERBOARD_SPOOL_DIR = Path(os.environ.get("LEADERBOARD_SPOOL_DIR", BASE_DIR / "cache" / "leaderboard"))
+
+# -------------------------------------------------------------------
+# Stato di gioco (core/services/gamestate.py)
+# -------------------------------------------------------------------
+# "cookie" = stato nel cookie firmato; "cache" = solo un token nel cookie, stato in cache (serve REDIS_URL)
+GAME_STATE_STORE = os.environ.get("GAME_STATE_STORE", "cookie")
+GAME_STATE_MAX_AGE = int(os.environ.get("GAME_STATE_MAX_AGE", str(24 * 3600)))  # secondi
+
+# -------------------------------------------------------------------
+# Metriche (core/services/metrics.py, core/middleware.py, vista /metrics/)
+# -------------------------------------------------------------------
+METRICS_ENABLED = os.environ.get("METRICS_ENABLED", "True") == "True"
+# header Server-Timing a tutti i client; con False solo allo staff e con DEBUG (espone tempi di DB e upstream)
+SERVER_TIMING = os.environ.get("SERVER_TIMING", "False") == "True"
+METRICS_TOKEN = os.environ.get("METRICS_TOKEN", "")   # se impostato: /metrics/ anche con "Authorization: Bearer <token>"
@@ -7,33 +7,26 @@ from core import views
 urlpatterns = [
     path("admin/", admin.site.urls),
     path("", views.home, name="home"),
+    path("img/<str:booking_number>/<slug:variant>.<str:ext>", views.inmate_image, name="inmate_image"),
 
     path("update-db/", views.update_db, name="update_db"),
     path("run-filters/", views.run_filters, name="run_filters"),
-    path("run-filters-murder/", views.run_filters_murder, name="run_filters_murder"),
+    path("jobs/", views.job_status, name="job_status"),
+    path("metrics/", views.metrics_export, name="metrics"),
+
+    # modalità di gioco (registro in core/services/modes.py)
+    path("mode/<slug:mode>/", views.mode_start, name="mode_start"),
+    path("mode/<slug:mode>/play/", views.mode_play, name="mode_play"),
+    path("mode/<slug:mode>/choose/", views.mode_choose, name="mode_choose"),
+    path("mode/<slug:mode>/gameover/", views.mode_gameover, name="mode_gameover"),
+    path("api/mode/<slug:mode>/start/", views.api_mode_start, name="api_mode_start"),
+    path("api/mode/<slug:mode>/next/", views.api_mode_next, name="api_mode_next"),
+    path("api/mode/<slug:mode>/answer/", views.api_mode_answer, name="api_mode_answer"),
 
-    # nuova modalità
-    path("mode/child/", views.child_mode_start, name="child_mode_start"),
-    path("mode/child/play/", views.child_mode_play, name="child_mode_play"),
-    path("mode/child/choose/", views.child_mode_choose, name="child_mode_choose"),
-    path("mode/child/gameover/", views.child_mode_gameover, name="child_mode_gameover"),
     path("leaderboard/submit/", views.leaderboard_submit, name="leaderboard_submit"),
     path("leaderboard/<str:mode>/", views.leaderboard, name="leaderboard"),
+    path("leaderboard/<str:mode>/rank/", views.leaderboard_rank, name="leaderboard_rank"),
     path("leaderboard/", views.leaderboard, {"mode": "child"}, name="leaderboard_default"),
-
-    
-    # modalità murder
-    path("mode/murder/", views.murder_mode_start, name="murder_mode_start"),
-    path("mode/murder/play/", views.murder_mode_play, name="murder_mode_play"),
-    path("mode/murder/choose/", views.murder_mode_choose, name="murder_mode_choose"),
-    path("mode/murder/gameover/", views.murder_mode_gameover, name="murder_mode_gameover"),
-
-    # Modalità drugs
-    path("mode/drugs/", views.drugs_mode_start, name="drugs_mode_start"),
-    path("mode/drugs/play/", views.drugs_mode_play, name="drugs_mode_play"),
-    path("mode/drugs/choose/", views.drugs_mode_choose, name="drugs_mode_choose"),
-    path("mode/drugs/gameover/", views.drugs_mode_gameover, name="drugs_mode_gameover"),
-    path("run-filters-drugs/", views.run_filters_drugs, name="run_filters_drugs"),
 ]
 
 if settings.DEBUG: